@@ -0,0 +1,59 @@
+"""Карточки рецептов: денормализованное представление рецепта с тегами,
+автором и ингредиентами, сохраняемое в Recipe.card.
+
+Список рецептов читает карточки из одной таблицы и добавляет к ним только
+отметки текущего пользователя. Карточки пересоздаются при изменении
+рецепта, его тегов, ингредиентов и публичных данных автора (см.
+api.signals), для заполнения существующих рецептов предназначена команда
+rebuild_recipe_cards. Пересоздание карточки отмечает рецепт измененным
+для синхронизации клиентов (recipes.changes).
+"""
+from django.utils import timezone
+
+from recipes.changes import log_changes  # isort:skip
+from recipes.models import Change, Recipe  # isort:skip
+
+from .serializers import (AuthorCardSerializer,  # isort:skip
+                          RecipeCardSerializer)  # isort:skip
+
+# Поля пользователя, изменение которых требует пересоздания карточек.
+AUTHOR_FIELDS = frozenset(AuthorCardSerializer.Meta.fields)
+
+
+def build_card(recipe):
+    return RecipeCardSerializer(recipe).data
+
+
+def refresh_card(recipe):
+    """Пересоздание карточки одного рецепта."""
+
+    fresh = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        'amounts__ingredient'
+    ).get(pk=recipe.pk)
+    recipe.card = build_card(fresh)
+    recipe.updated_at = timezone.now()
+    Recipe.objects.filter(pk=recipe.pk).update(
+        card=recipe.card,
+        updated_at=recipe.updated_at
+    )
+    log_changes(Change.RECIPE, (recipe.pk,))
+
+
+def refresh_cards(recipe_ids, batch_size=500):
+    """Пересоздание карточек рецептов пачками."""
+
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        recipes = list(Recipe.objects.filter(
+            pk__in=recipe_ids[start:start + batch_size]
+        ).select_related('author').prefetch_related(
+            'tags',
+            'amounts__ingredient'
+        ))
+        now = timezone.now()
+        for recipe in recipes:
+            recipe.card = build_card(recipe)
+            recipe.updated_at = now
+        Recipe.objects.bulk_update(recipes, ('card', 'updated_at'))
+        log_changes(Change.RECIPE, [recipe.pk for recipe in recipes])
@@ -0,0 +1,169 @@
+"""Ограничение времени обработки запросов.
+
+Вьюсет с DeadlineMixin задает бюджет времени для действий в атрибуте
+deadlines (действие -> секунды). На время обработки запроса:
+- перед каждым SQL-запросом проверяется, не истек ли бюджет;
+- на PostgreSQL устанавливается statement_timeout, равный бюджету;
+- сериализаторы и формирование PDF вызывают check_deadline() в циклах.
+При превышении бюджета клиент получает 503 с заголовком Retry-After, а
+превышение записывается в лог и в счетчик в общем кэше.
+"""
+import logging
+from contextvars import ContextVar
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+# Код ошибки PostgreSQL при отмене запроса по statement_timeout.
+QUERY_CANCELED = '57014'
+METRIC_KEY = 'deadline-exceeded:{}'
+
+current_deadline = ContextVar('current_deadline', default=None)
+
+
+class DeadlineExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервер перегружен, повторите запрос позже.'
+    default_code = 'deadline_exceeded'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = settings.DEADLINES['RETRY_AFTER']
+
+
+class Deadline:
+    """Бюджет времени обработки одного запроса."""
+
+    def __init__(self, name, seconds):
+        self.name = name
+        self.seconds = seconds
+        self.expires = monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - monotonic()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded()
+
+
+def check_deadline():
+    """Контрольная точка: исключение, если бюджет запроса исчерпан."""
+
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def remaining_time():
+    """Остаток бюджета текущего запроса в секундах, None без бюджета."""
+
+    deadline = current_deadline.get()
+    return None if deadline is None else max(deadline.remaining(), 0)
+
+
+def record_exceeded(name):
+    """Запись превышения бюджета в лог и в счетчик."""
+
+    logger.warning('Превышено время обработки запроса: %s', name)
+    key = METRIC_KEY.format(name)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+class DeadlineMixin:
+    """Бюджет времени для действий вьюсета."""
+
+    # Действие (или метод HTTP для представлений без действий) -> секунды.
+    deadlines = {}
+
+    def get_deadline(self):
+        action = getattr(self, 'action', None) or self.request.method.lower()
+        seconds = self.deadlines.get(action)
+        if seconds is None or not settings.DEADLINES['ENABLED']:
+            return None
+        return Deadline(
+            f'{type(self).__name__}.{action}',
+            seconds * settings.DEADLINES['SCALE']
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        deadline = self.get_deadline()
+        if deadline is None:
+            return
+        # Вложенный вызов (см. BootstrapView) не выходит за бюджет
+        # внешнего, statement_timeout уже установлен внешним.
+        parent = current_deadline.get()
+        if parent is not None:
+            deadline.expires = min(deadline.expires, parent.expires)
+        self.deadline_token = current_deadline.set(deadline)
+        connection = connections[DEFAULT_DB_ALIAS]
+        self.deadline_wrapper = self.make_wrapper(deadline)
+        connection.execute_wrappers.append(self.deadline_wrapper)
+        if parent is None and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SET statement_timeout = %s',
+                    [max(1, int(deadline.seconds * 1000))]
+                )
+            self.deadline_statement_timeout = True
+
+    @staticmethod
+    def make_wrapper(deadline):
+        def wrapper(execute, sql, params, many, context):
+            deadline.check()
+            try:
+                return execute(sql, params, many, context)
+            except OperationalError as error:
+                if getattr(error.__cause__, 'pgcode', None) == QUERY_CANCELED:
+                    raise DeadlineExceeded() from error
+                raise
+
+        return wrapper
+
+    def release_deadline(self):
+        """Снятие ограничений, установленных в initial()."""
+
+        wrapper = getattr(self, 'deadline_wrapper', None)
+        if wrapper is None:
+            return
+        connection = connections[DEFAULT_DB_ALIAS]
+        connection.execute_wrappers.remove(wrapper)
+        self.deadline_wrapper = None
+        current_deadline.reset(self.deadline_token)
+        if getattr(self, 'deadline_statement_timeout', False):
+            self.deadline_statement_timeout = False
+            self.reset_statement_timeout(connection)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Необработанное исключение DRF передает дальше без
+        # finalize_response(), ограничения снимаются в любом случае.
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            self.release_deadline()
+
+    @staticmethod
+    def reset_statement_timeout(connection):
+        if connection.needs_rollback or connection.connection is None:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('RESET statement_timeout')
+
+    def handle_exception(self, exc):
+        if isinstance(exc, DeadlineExceeded):
+            deadline = current_deadline.get()
+            record_exceeded(
+                deadline.name if deadline else type(self).__name__
+            )
+        return super().handle_exception(exc)
@@ -0,0 +1,72 @@
+"""Количество рецептов по тегам для фильтров списка рецептов.
+
+Количества считаются для рецептов, отобранных всеми фильтрами, кроме
+фильтра по тегам: рядом с каждым тегом показывается, сколько рецептов
+будет найдено с ним. Без фильтров и с фильтром по автору количества
+читаются из счетчиков TagCounter (recipes.masks). Для избранного и
+списка покупок они считаются одним запросом с группировкой по маске
+тегов: различных масок намного меньше, чем рецептов, биты масок
+суммируются в Python.
+"""
+from collections import Counter
+
+from django.db.models import Count
+
+from backend.cache import cache  # isort:skip
+from recipes.masks import mask_to_bits  # isort:skip
+from recipes.models import Tag, TagCounter  # isort:skip
+
+from .filters import RecipeFilter  # isort:skip
+
+# Параметры фильтра по тегам, которые не учитываются в количествах.
+TAG_PARAMS = ('tags', 'tags_mode')
+# Срок свежести закэшированных тегов, с. Кэш сбрасывается при изменении
+# тегов (api.signals).
+TAGS_TIMEOUT = 60 * 60
+
+
+def get_tags():
+    """Идентификаторы, биты и слаги тегов."""
+
+    return cache.get_or_set(
+        'tags',
+        'facets',
+        lambda: list(Tag.objects.filter(bit__isnull=False).values_list(
+            'id', 'bit', 'slug'
+        )),
+        TAGS_TIMEOUT
+    )
+
+
+def count_by_masks(queryset):
+    """Количество рецептов запроса по битам тегов."""
+
+    counts = Counter()
+    masks = queryset.order_by().values_list('tags_mask').annotate(
+        count=Count('pk')
+    )
+    for mask, count in masks:
+        for bit in mask_to_bits(mask):
+            counts[bit] += count
+    return counts
+
+
+def get_tag_facets(request):
+    """Количество рецептов по слагам тегов для параметров запроса
+    списка рецептов."""
+
+    params = request.query_params.copy()
+    for name in TAG_PARAMS:
+        params.pop(name, None)
+    filterset = RecipeFilter(params, request=request)
+    if not filterset.is_valid():
+        return None
+    filters = filterset.form.cleaned_data
+    tags = get_tags()
+    if filters.get('is_favorited') or filters.get('is_in_shopping_cart'):
+        counts = count_by_masks(filterset.qs)
+        return {slug: counts[bit] for _, bit, slug in tags}
+    counts = dict(TagCounter.objects.filter(
+        author=filters.get('author')
+    ).values_list('tag_id', 'count'))
+    return {slug: counts.get(tag_id, 0) for tag_id, _, slug in tags}
@@ -0,0 +1,73 @@
+"""Выбор полей ответа параметрами запроса fields и omit.
+
+?fields=id,name,image - вернуть только перечисленные поля,
+?omit=text,ingredients - вернуть все поля, кроме перечисленных.
+Выбор применяется к полям верхнего уровня. Вьюсеты используют его также
+для того, чтобы не загружать данные для невостребованных полей.
+"""
+
+
+class FieldSelection:
+    """Набор полей, запрошенных клиентом."""
+
+    def __init__(self, fields=None, omit=()):
+        self.fields = None if fields is None else frozenset(fields)
+        self.omit = frozenset(omit)
+
+    def __contains__(self, name):
+        return (
+            (self.fields is None or name in self.fields)
+            and name not in self.omit
+        )
+
+    def filter(self, names):
+        return [name for name in names if name in self]
+
+    @staticmethod
+    def parse(value):
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    @classmethod
+    def from_request(cls, request):
+        """Выбор полей из параметров запроса или None, если параметры не
+        переданы."""
+
+        params = request.query_params
+        if 'fields' not in params and 'omit' not in params:
+            return None
+        fields = params.get('fields')
+        return cls(
+            fields=None if fields is None else cls.parse(fields),
+            omit=cls.parse(params.get('omit', ''))
+        )
+
+
+def wants(selection, name):
+    """Нужно ли поле в ответе."""
+
+    return selection is None or name in selection
+
+
+class SparseFieldsViewMixin:
+    """Передает выбор полей из запроса в контекст сериализатора."""
+
+    def get_field_selection(self):
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = FieldSelection.from_request(self.request)
+        return self._field_selection
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_field_selection()
+        return context
+
+
+class SparseFieldsSerializerMixin:
+    """Убирает из сериализатора поля, не выбранные клиентом."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selection = self.context.get('fields')
+        if selection is not None:
+            for name in set(self.fields) - set(selection.filter(self.fields)):
+                self.fields.pop(name)
@@ -1,8 +1,23 @@
+from django.db.models import F
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
+from recipes.masks import tags_to_mask  # isort:skip
 from recipes.models import Recipe, Tag  # isort:skip
 
+# Наибольшая длина строки поиска ингредиента: длиннее названия
+# ингредиента она ничего не найдет.
+MAX_SEARCH_LENGTH = 200
+
+
+def normalize_search(value):
+    """Строка поиска ингредиента: слова через один пробел, в нижнем
+    регистре, не длиннее MAX_SEARCH_LENGTH. Используется и в фильтре, и в
+    ключе кэша списка ингредиентов, поэтому разные записи одного запроса
+    дают одно значение в кэше."""
+
+    return ' '.join(value.split()).lower()[:MAX_SEARCH_LENGTH]
+
 
 class RecipeFilter(FilterSet):
     """Фильтры по тегам для рецептов."""
@@ -10,7 +25,12 @@ class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='filter_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_mode'
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
@@ -24,6 +44,24 @@ class RecipeFilter(FilterSet):
             'tags',
         )
 
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по тегам через маску тегов рецепта. По умолчанию
+        рецепт должен содержать любой из тегов, с tags_mode=all - все."""
+
+        if not value:
+            return queryset
+        mask = tags_to_mask(value)
+        queryset = queryset.alias(matched_tags=F('tags_mask').bitand(mask))
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(matched_tags=mask)
+        return queryset.filter(matched_tags__gt=0)
+
+    @staticmethod
+    def filter_tags_mode(queryset, name, value):
+        """Режим применяется в фильтре по тегам."""
+
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         """Фильтр по избранным рецептам."""
 
@@ -43,3 +81,9 @@ class IngredientSearchFilter(SearchFilter):
     """Фильтр для поиска ингредиента по наименованию."""
 
     search_param = 'name'
+
+    def get_search_terms(self, request):
+        params = normalize_search(
+            request.query_params.get(self.search_param, '')
+        )
+        return params.replace('\x00', '').replace(',', ' ').split()
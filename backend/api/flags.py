@@ -0,0 +1,65 @@
+from recipes.models import Favorite, ShoppingCart  # isort:skip
+from users.models import Follow  # isort:skip
+
+# Вид отметки -> модель, поле с идентификатором объекта.
+FLAGS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'shopping_cart': (ShoppingCart, 'recipe_id'),
+    'following': (Follow, 'author_id'),
+}
+
+
+class UserFlags:
+    """Отметки текущего пользователя: избранное, список покупок и
+    подписки на авторов.
+
+    Отметки загружаются одним запросом на пачку объектов и запоминаются
+    до конца обработки запроса."""
+
+    def __init__(self, user):
+        self.user = user
+        self.flags = {kind: {} for kind in FLAGS}
+
+    def load(self, kind, object_ids):
+        """Загрузка отметок одного вида для пачки объектов."""
+
+        if self.user.is_anonymous:
+            return
+        known = self.flags[kind]
+        object_ids = {pk for pk in object_ids if pk not in known}
+        if not object_ids:
+            return
+        model, field = FLAGS[kind]
+        marked = set(model.objects.filter(
+            user=self.user,
+            **{f'{field}__in': object_ids}
+        ).values_list(field, flat=True))
+        for pk in object_ids:
+            known[pk] = pk in marked
+
+    def get(self, kind, object_id):
+        if self.user.is_anonymous:
+            return False
+        if object_id not in self.flags[kind]:
+            self.load(kind, (object_id,))
+        return self.flags[kind][object_id]
+
+    def is_favorited(self, recipe_id):
+        return self.get('favorites', recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return self.get('shopping_cart', recipe_id)
+
+    def is_subscribed(self, author_id):
+        return self.get('following', author_id)
+
+
+def get_user_flags(request):
+    """Отметки пользователя, общие для всех сериализаторов запроса."""
+
+    request = getattr(request, '_request', request)
+    flags = getattr(request, 'user_flags', None)
+    if flags is None or flags.user != request.user:
+        flags = UserFlags(request.user)
+        request.user_flags = flags
+    return flags
@@ -0,0 +1,220 @@
+"""Поиск ингредиентов с опечатками по триграммам.
+
+Название переводится в нижний регистр, буквы, которые часто путают при
+наборе, заменяются (recipes.indexes.FOLD_FROM -> FOLD_TO), и название
+разбивается на триграммы так же, как в pg_trgm: каждое слово дополняется
+двумя пробелами в начале и одним в конце. Сходство запроса и
+названия - доля общих триграмм от объединения триграмм обоих (similarity()
+pg_trgm). Названия, начинающиеся с запроса, получают надбавку
+INGREDIENT_SEARCH['PREFIX_BOOST'] и попадают в выдачу при любом сходстве.
+
+На PostgreSQL поиск выполняется запросом по GIN-индексу pg_trgm
+(recipes.indexes.TrigramIndex), на других СУБД - по индексу в памяти
+процесса: для каждой триграммы хранится массив позиций названий,
+количество общих триграмм считается подсчетом позиций по всем триграммам
+запроса.
+Индекс перестраивается при изменении версии пространства 'ingredients'
+общего кэша (api.signals) и не реже, чем раз в INDEX_TTL секунд.
+"""
+import re
+import threading
+from bisect import bisect_left
+from time import monotonic
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Case, F, FloatField, Func, Q,
+                              Value, When)
+
+from backend.cache import cache  # isort:skip
+from recipes.indexes import FOLD_FROM, FOLD_TO  # isort:skip
+from recipes.models import Ingredient  # isort:skip
+
+WORD = re.compile(r'\w+')
+FOLD = str.maketrans(FOLD_FROM, FOLD_TO)
+EMPTY = np.zeros(0, dtype=np.int32)
+
+
+def normalize(text):
+    """Слова названия в нижнем регистре с заменами через пробел."""
+
+    return ' '.join(WORD.findall(text.lower().translate(FOLD)))
+
+
+def get_trigrams(texts):
+    """Триграммы нормализованных текстов: массивы номеров текстов и кодов
+    триграмм без повторов внутри текста, упорядоченные по коду, затем по
+    номеру текста.
+
+    Дополненные пробелами слова всех текстов склеиваются через символ с
+    кодом 0, и триграммы без него кодируются тремя кодами символов по 21
+    бит."""
+
+    words = [
+        (row, f'  {word} ')
+        for row, text in enumerate(texts) for word in text.split()
+    ]
+    if not words:
+        return EMPTY, EMPTY
+    chars = np.frombuffer(
+        '\0'.join(word for _, word in words).encode('utf-32-le'),
+        dtype=np.uint32
+    ).astype(np.int64)
+    rows = np.repeat(
+        np.array([row for row, _ in words], dtype=np.int32),
+        [len(word) + 1 for _, word in words]
+    )[:len(chars) - 2]
+    codes = chars[:-2] << 42 | chars[1:-1] << 21 | chars[2:]
+    valid = (chars[:-2] != 0) & (chars[1:-1] != 0) & (chars[2:] != 0)
+    rows, codes = rows[valid], codes[valid]
+    order = np.argsort(codes, kind='stable')
+    rows, codes = rows[order], codes[order]
+    unique = np.ones(len(rows), dtype=bool)
+    unique[1:] = (rows[1:] != rows[:-1]) | (codes[1:] != codes[:-1])
+    return rows[unique], codes[unique]
+
+
+class IngredientTrigramIndex:
+    """Индекс триграмма -> позиции названий для одного процесса. Названия
+    отсортированы, поэтому названия с общим началом занимают непрерывный
+    диапазон позиций."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built = None
+        self.names = []
+        self.ids = EMPTY
+        self.sizes = EMPTY
+        self.postings = {}
+
+    def build(self):
+        with self.lock:
+            version = cache.version('ingredients')
+            ingredients = sorted(
+                (normalize(name), ingredient_id)
+                for ingredient_id, name in Ingredient.objects.values_list(
+                    'id', 'name'
+                ).iterator(chunk_size=10000)
+            )
+            names = [name for name, _ in ingredients]
+            positions, codes = get_trigrams(names)
+            starts = np.flatnonzero(np.diff(codes)) + 1
+            self.names = names
+            self.ids = np.array(
+                [ingredient_id for _, ingredient_id in ingredients],
+                dtype=np.int64
+            )
+            self.sizes = np.bincount(positions, minlength=len(names))
+            self.postings = dict(zip(
+                codes[np.concatenate(([0], starts))].tolist(),
+                np.split(positions, starts)
+            ))
+            self.version = version
+            self.built = monotonic()
+
+    def ensure_fresh(self):
+        expired = (
+            self.built is None
+            or monotonic() - self.built
+            > settings.INGREDIENT_SEARCH['INDEX_TTL']
+        )
+        if expired or cache.version('ingredients') != self.version:
+            self.build()
+
+    def get_prefix_range(self, query):
+        """Диапазон позиций названий, начинающихся с запроса."""
+
+        start = bisect_left(self.names, query)
+        return start, bisect_left(self.names, query + '\uffff', start)
+
+    def search(self, query, limit):
+        """Идентификаторы ингредиентов, упорядоченные по убыванию сходства
+        с учетом надбавки за совпадение начала, затем по названию."""
+
+        options = settings.INGREDIENT_SEARCH
+        query = normalize(query)
+        if not query:
+            return []
+        trigrams = get_trigrams([query])[1].tolist()
+        self.ensure_fresh()
+        with self.lock:
+            ids, sizes, count = self.ids, self.sizes, len(self.names)
+            postings = [
+                self.postings[trigram] for trigram in trigrams
+                if trigram in self.postings
+            ]
+            start, end = self.get_prefix_range(query)
+        threshold, size = options['THRESHOLD'], len(trigrams)
+        shared = np.bincount(
+            np.concatenate(postings + [EMPTY]), minlength=count
+        )
+        # shared / (size + sizes - shared) >= threshold без деления.
+        similar = np.flatnonzero(
+            shared * (1 + threshold) >= threshold * (size + sizes)
+        )
+        similar = similar[(similar < start) | (similar >= end)]
+        positions = np.concatenate((similar, np.arange(start, end)))
+        common = shared[positions]
+        scores = common / (size + sizes[positions] - common)
+        scores[len(similar):] += options['PREFIX_BOOST']
+        if len(positions) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            positions, scores = positions[top], scores[top]
+        positions = positions[np.lexsort((positions, -scores))]
+        return ids[positions].tolist()
+
+
+trigram_index = IngredientTrigramIndex()
+
+
+class Folded(Func):
+    """Выражение, по которому построен индекс recipes.indexes.TrigramIndex."""
+
+    template = f"translate(lower(%(expressions)s), '{FOLD_FROM}', '{FOLD_TO}')"
+
+
+class TrigramSimilarity(Func):
+    function = 'SIMILARITY'
+    output_field = FloatField()
+
+
+class TrigramMatch(Func):
+    """Оператор % pg_trgm: сходство не ниже pg_trgm.similarity_threshold,
+    использует GIN-индекс триграмм."""
+
+    arg_joiner = ' %% '
+    template = '(%(expressions)s)'
+    output_field = BooleanField()
+
+
+def search_postgresql(query, limit):
+    options = settings.INGREDIENT_SEARCH
+    folded = normalize(query)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                [str(options['THRESHOLD'])]
+            )
+        return list(Ingredient.objects.filter(
+            Q(TrigramMatch(Folded(F('name')), Value(folded)))
+            | Q(name__istartswith=query)
+        ).annotate(rank=TrigramSimilarity(
+            Folded(F('name')), Value(folded)
+        ) + Case(
+            When(name__istartswith=query, then=Value(options['PREFIX_BOOST'])),
+            default=Value(0.0),
+            output_field=FloatField()
+        )).order_by('-rank', 'name').values_list('id', flat=True)[:limit])
+
+
+def search(query):
+    """Идентификаторы ингредиентов, похожих на запрос, по убыванию
+    сходства, не больше INGREDIENT_SEARCH['LIMIT']."""
+
+    limit = settings.INGREDIENT_SEARCH['LIMIT']
+    if connection.vendor == 'postgresql':
+        return search_postgresql(query, limit)
+    return trigram_index.search(query, limit)
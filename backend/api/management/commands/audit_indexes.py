@@ -0,0 +1,204 @@
+import re
+from collections import namedtuple
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from jobs.models import Job  # isort:skip
+from recipes.models import (Change, Favorite, Ingredient,  # isort:skip
+                            IngredientAmount, Recipe,  # isort:skip
+                            ShoppingCart)  # isort:skip
+from users.models import Follow, User  # isort:skip
+
+# Запрос каталога: имя и функция, строящая QuerySet по образцам значений.
+HotQuery = namedtuple('HotQuery', ('name', 'build'))
+
+CATALOG = (
+    HotQuery(
+        'recipes-page',
+        lambda p: Recipe.objects.only('id', 'card')[:6],
+    ),
+    HotQuery(
+        'recipes-by-author',
+        lambda p: Recipe.objects.filter(author_id=p.author).only(
+            'id', 'card'
+        )[:6],
+    ),
+    HotQuery(
+        'recipes-favorited',
+        lambda p: Recipe.objects.filter(favorites__user_id=p.user).only(
+            'id', 'card'
+        )[:6],
+    ),
+    HotQuery(
+        'recipes-in-shopping-cart',
+        lambda p: Recipe.objects.filter(
+            shopping_carts__user_id=p.user
+        ).only('id', 'card')[:6],
+    ),
+    HotQuery(
+        'recipes-similar',
+        lambda p: Recipe.objects.filter(
+            neighbour_of__recipe_id=p.recipe
+        ).order_by('-neighbour_of__score')[:6],
+    ),
+    HotQuery(
+        'subscriptions',
+        lambda p: User.objects.filter(following__user_id=p.user)[:6],
+    ),
+    HotQuery(
+        'subscriptions-recipes',
+        lambda p: Recipe.objects.filter(author_id__in=p.authors).only(
+            'id', 'author_id', 'name', 'image', 'cooking_time'
+        ),
+    ),
+    HotQuery(
+        'follow-flags',
+        lambda p: Follow.objects.filter(
+            user_id=p.user, author_id__in=p.authors
+        ).values_list('author_id', flat=True),
+    ),
+    HotQuery(
+        'favorite-flags',
+        lambda p: Favorite.objects.filter(
+            user_id=p.user, recipe_id__in=p.recipes
+        ).values_list('recipe_id', flat=True),
+    ),
+    HotQuery(
+        'shopping-cart-flags',
+        lambda p: ShoppingCart.objects.filter(
+            user_id=p.user, recipe_id__in=p.recipes
+        ).values_list('recipe_id', flat=True),
+    ),
+    HotQuery(
+        'shopping-cart-ingredients',
+        lambda p: IngredientAmount.objects.filter(
+            recipe__shopping_carts__user_id=p.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ),
+    ),
+    HotQuery(
+        'ingredient-search',
+        lambda p: Ingredient.objects.filter(name__istartswith=p.prefix),
+    ),
+    HotQuery(
+        'sync-changes',
+        lambda p: Change.objects.filter(
+            id__gt=p.change, user_id=p.user
+        ).order_by('id')[:100],
+    ),
+    HotQuery(
+        'jobs-queue',
+        lambda p: Job.objects.filter(status=Job.PENDING).order_by(
+            'created'
+        ).values_list('id', flat=True)[:4],
+    ),
+)
+
+# Строки плана с полным просмотром таблицы. Просмотр индекса SQLite
+# (SCAN ... USING INDEX) не отмечается: так выполняется выборка первых
+# строк в порядке индекса.
+SEQ_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)'),
+}
+
+
+def get_samples():
+    """Образцы значений параметров из имеющихся данных."""
+
+    follow = Follow.objects.values('user_id').first()
+    user = follow['user_id'] if follow else 0
+    authors = list(Follow.objects.filter(user_id=user).values_list(
+        'author_id', flat=True
+    )[:6]) or [0]
+    recipes = list(Recipe.objects.values_list('id', flat=True)[:6]) or [0]
+    ingredient = Ingredient.objects.values_list('name', flat=True).first()
+    return SimpleNamespace(
+        user=user,
+        author=authors[0],
+        authors=authors,
+        recipe=recipes[0],
+        recipes=recipes,
+        prefix=(ingredient or 'а')[:3],
+        change=max(
+            (Change.objects.order_by('-id').values_list(
+                'id', flat=True
+            ).first() or 0) - 100,
+            0
+        ),
+    )
+
+
+class Command(BaseCommand):
+    """
+    Проверка планов выполнения частых запросов приложения: для каждого
+    запроса каталога выполняется EXPLAIN и отмечаются полные просмотры
+    таблиц. Образцы параметров берутся из данных базы.
+
+    На маленькой базе PostgreSQL выбирает полный просмотр, даже если
+    подходящий индекс есть, поэтому с --no-seqscan полный просмотр
+    запрещается на время проверки: если он остается в плане, индекса для
+    запроса нет. Команда завершается с ошибкой, если найдены запросы с
+    полным просмотром.
+    """
+
+    help = 'Проверка использования индексов частыми запросами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-seqscan',
+            action='store_true',
+            help='Запретить полный просмотр таблиц (только PostgreSQL).'
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Выполнить запросы (EXPLAIN ANALYZE, только PostgreSQL).'
+        )
+        parser.add_argument(
+            '--query',
+            action='append',
+            dest='queries',
+            help='Проверить только указанный запрос (можно повторять).'
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        pattern = SEQ_SCAN.get(vendor)
+        if pattern is None:
+            raise CommandError(f'СУБД {vendor} не поддерживается.')
+        postgresql = vendor == 'postgresql'
+        catalog = [
+            query for query in CATALOG
+            if not options['queries'] or query.name in options['queries']
+        ]
+        samples = get_samples()
+        flagged = []
+        with transaction.atomic():
+            if postgresql and options['no_seqscan']:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in catalog:
+                explain = {'analyze': True} if (
+                    postgresql and options['analyze']
+                ) else {}
+                plan = query.build(samples).explain(**explain)
+                scans = sorted(set(pattern.findall(plan)))
+                if scans:
+                    flagged.append(query.name)
+                    self.stdout.write(self.style.WARNING(
+                        f'{query.name}: полный просмотр {", ".join(scans)}'
+                    ))
+                else:
+                    self.stdout.write(f'{query.name}: OK')
+                if scans or options['verbosity'] > 1:
+                    for line in plan.splitlines():
+                        self.stdout.write(f'  {line}')
+            transaction.set_rollback(True)
+        if flagged:
+            raise CommandError(
+                f'Полный просмотр таблиц в запросах: {", ".join(flagged)}.'
+            )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from backend.cache import cache  # isort:skip
+
+
+class Command(BaseCommand):
+    """
+    Счетчики двухуровневого кэша (backend.cache), накопленные всеми
+    процессами. Счетчики процессов добавляются к общим не сразу, а через
+    каждые несколько обращений к кэшу.
+    """
+
+    help = 'Статистика двухуровневого кэша.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счетчики после вывода.'
+        )
+
+    def handle(self, *args, **options):
+        stats = cache.stats()
+        hits = stats['local_hits'] + stats['shared_hits'] + stats[
+            'stale_hits'
+        ]
+        total = hits + stats['misses']
+        for name, value in stats.items():
+            self.stdout.write(f'{name}: {value}')
+        if total:
+            self.stdout.write(f'hit_ratio: {hits / total:.3f}')
+        if options['reset']:
+            cache.reset_stats()
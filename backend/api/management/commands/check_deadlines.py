@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api.deadlines import (DeadlineExceeded, DeadlineMixin,  # isort:skip
+                           current_deadline)  # isort:skip
+
+
+class CheckView(DeadlineMixin, APIView):
+    """Представление с бюджетом, которое завершается ответом, ошибкой
+    бюджета или необработанным исключением."""
+
+    permission_classes = AllowAny,
+    authentication_classes = ()
+    deadlines = {'get': 1}
+
+    def get(self, request):
+        outcome = request.query_params.get('outcome')
+        if outcome == 'error':
+            raise RuntimeError('check_deadlines')
+        if outcome == 'exceeded':
+            raise DeadlineExceeded()
+        return Response()
+
+
+class Command(BaseCommand):
+    """
+    Проверка снятия ограничений DeadlineMixin (api.deadlines): после
+    ответа, превышения бюджета и необработанного исключения в
+    представлении обертка SQL-запросов удалена из соединения, а текущий
+    бюджет сброшен. Оставшаяся обертка отвечала бы 503 на все следующие
+    запросы потока.
+    """
+
+    help = 'Проверка снятия ограничений времени после запроса.'
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        view = CheckView.as_view()
+        factory = RequestFactory()
+        failures = []
+        with override_settings(
+            DEADLINES=dict(settings.DEADLINES, ENABLED=True, SCALE=1)
+        ):
+            for outcome in ('ok', 'exceeded', 'error'):
+                wrappers = list(connection.execute_wrappers)
+                try:
+                    view(factory.get('/', {'outcome': outcome}))
+                except RuntimeError:
+                    pass
+                if connection.execute_wrappers != wrappers:
+                    failures.append(f'{outcome}: обертка SQL не удалена')
+                if current_deadline.get() is not None:
+                    failures.append(f'{outcome}: бюджет не сброшен')
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError(f'Ограничения не сняты: {len(failures)}.')
+        self.stdout.write(self.style.SUCCESS('Ограничения сняты.'))
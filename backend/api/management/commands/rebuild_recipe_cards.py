@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.cards import refresh_cards  # isort:skip
+from recipes.models import Recipe  # isort:skip
+
+
+class Command(BaseCommand):
+    """
+    Пересоздание карточек рецептов, которые отдаются в списке рецептов.
+    Запускается после миграции, загрузки данных командой import_recipes
+    или изменения формата карточки.
+    """
+
+    help = 'Пересоздание карточек рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Создать карточки только для рецептов без карточки.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество рецептов, обрабатываемых за один раз.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by('pk')
+        if options['missing']:
+            recipes = recipes.filter(card__isnull=True)
+        recipe_ids = list(recipes.values_list('pk', flat=True))
+        refresh_cards(recipe_ids, batch_size=options['batch_size'])
+        self.stdout.write(f'Обновлено карточек: {len(recipe_ids)}.')
@@ -1,9 +1,108 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
 
+from backend.cache import cache  # isort:skip
 from backend.settings import REST_FRAMEWORK  # isort:skip
 
 
+def table_namespace(table):
+    return f'count-table:{table}'
+
+
+def reset_counts(*models):
+    """Сброс закэшированных количеств для запросов к таблицам моделей."""
+
+    for model in models:
+        cache.bump(table_namespace(model._meta.db_table))
+
+
+def estimate_count(queryset):
+    """Оценка количества строк планировщиком PostgreSQL."""
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def calculate_count(queryset):
+    """Количество объектов и признак того, что оно приблизительное.
+
+    На PostgreSQL сначала берется оценка планировщика: если она больше
+    порога, точное количество не считается."""
+
+    threshold = settings.PAGINATION_COUNT['ESTIMATE_THRESHOLD']
+    if threshold and connections[queryset.db].vendor == 'postgresql':
+        estimate = estimate_count(queryset)
+        if estimate > threshold:
+            return estimate, True
+    return queryset.count(), False
+
+
+def get_count(queryset):
+    """Количество объектов запроса из кэша.
+
+    Ключ - хэш SQL запроса, поэтому одинаковые фильтры в любом порядке
+    параметров дают один ключ. В ключ входят версии всех таблиц запроса,
+    запись в любую из них (см. api.signals) делает его недействительным."""
+
+    query = queryset.query
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+    tables = sorted({join.table_name for join in query.alias_map.values()})
+    versions = ','.join(
+        f'{table}:{cache.version(table_namespace(table))}'
+        for table in tables
+    )
+    key = hashlib.md5(
+        f'{versions}|{sql}|{params!r}'.encode()
+    ).hexdigest()
+    return tuple(cache.get_or_set(
+        'count',
+        key,
+        lambda: calculate_count(queryset),
+        settings.PAGINATION_COUNT['TIMEOUT']
+    ))
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, берущий количество объектов из кэша."""
+
+    approximate = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        count, self.approximate = get_count(self.object_list)
+        return count
+
+
 class CustomPageNumberPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = REST_FRAMEWORK['PAGE_SIZE']
+    django_paginator_class = CachedCountPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_approximate': self.page.paginator.approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
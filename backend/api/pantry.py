@@ -0,0 +1,283 @@
+"""Инвертированный индекс ингредиентов для подбора рецептов по продуктам.
+
+Индекс хранится в памяти процесса: для каждого ингредиента и тега -
+отсортированный массив идентификаторов рецептов, для каждого рецепта -
+общее количество ингредиентов. Покрытие набора продуктов считается
+объединением массивов и подсчетом повторов без запросов к базе.
+
+Изменения публикуются в общем кэше журналом: версия индекса - счетчик,
+для каждой версии хранится идентификатор измененного рецепта. Процесс,
+изменивший рецепт, после фиксации транзакции обновляет рецепт в своем
+индексе и публикует следующую версию, остальные процессы при следующем
+запросе перечитывают из базы только рецепты пропущенных версий. Индекс
+перестраивается полностью, если журнал неполон (запись вытеснена из
+кэша или еще не записана) или отставание больше MAX_CHANGES версий, и
+не реже, чем раз в PANTRY_INDEX_TTL секунд.
+"""
+import threading
+from array import array
+from time import monotonic, time_ns
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import IngredientAmount, Recipe  # isort:skip
+
+VERSION_KEY = 'pantry-index-log-version'
+CHANGE_KEY = 'pantry-index-log-{}'
+# Отставание в версиях, после которого индекс дешевле построить заново.
+MAX_CHANGES = 500
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def group(keys, values):
+    """Словарь ключ -> отсортированный массив значений."""
+
+    keys = np.frombuffer(keys, dtype=np.int64)
+    values = np.frombuffer(values, dtype=np.int64)
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique, starts = np.unique(keys, return_index=True)
+    return dict(zip(unique.tolist(), np.split(values, starts[1:])))
+
+
+def insert(values, value):
+    position = np.searchsorted(values, value)
+    if position < len(values) and values[position] == value:
+        return values
+    return np.insert(values, position, value)
+
+
+def remove(values, value):
+    position = np.searchsorted(values, value)
+    if position < len(values) and values[position] == value:
+        return np.delete(values, position)
+    return values
+
+
+class Matches:
+    """Результаты поиска для пагинатора: количество - длина массивов,
+    кортежи (рецепт, недостающих, имеющихся) строятся только для
+    запрошенного среза страницы."""
+
+    def __init__(self, recipe_ids, missing, matched):
+        self.recipe_ids = recipe_ids
+        self.missing = missing
+        self.matched = matched
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        return list(zip(
+            self.recipe_ids[index].tolist(),
+            self.missing[index].tolist(),
+            self.matched[index].tolist()
+        ))
+
+
+class PantryIndex:
+    """Индекс ингредиент -> рецепты для одного процесса."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built = None
+        self.ingredients = {}
+        self.tags = {}
+        self.recipe_ids = EMPTY
+        self.totals = EMPTY
+
+    def build(self):
+        """Полное построение индекса из IngredientAmount и тегов."""
+
+        with self.lock:
+            version = cache.get(VERSION_KEY)
+            recipes, ingredients = array('q'), array('q')
+            amounts = IngredientAmount.objects.values_list(
+                'recipe_id', 'ingredient_id'
+            )
+            for recipe_id, ingredient_id in amounts.iterator(
+                chunk_size=10000
+            ):
+                recipes.append(recipe_id)
+                ingredients.append(ingredient_id)
+            tag_recipes, tags = array('q'), array('q')
+            recipe_tags = Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id'
+            )
+            for recipe_id, tag_id in recipe_tags.iterator(chunk_size=10000):
+                tag_recipes.append(recipe_id)
+                tags.append(tag_id)
+            self.ingredients = group(ingredients, recipes)
+            self.tags = group(tags, tag_recipes)
+            self.recipe_ids, self.totals = np.unique(
+                np.frombuffer(recipes, dtype=np.int64), return_counts=True
+            )
+            self.version = version
+            self.built = monotonic()
+
+    def ensure_fresh(self):
+        if (
+            self.built is None
+            or monotonic() - self.built > settings.PANTRY_INDEX_TTL
+        ):
+            self.build()
+            return
+        version = cache.get(VERSION_KEY)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            if not self.catch_up(version):
+                self.build()
+
+    def catch_up(self, version):
+        """Применение изменений опубликованных версий после текущей.
+        Возвращает False, если журнал неполон и индекс нужно построить
+        заново."""
+
+        if (
+            version is None
+            or self.version is None
+            or not 0 < version - self.version <= MAX_CHANGES
+        ):
+            return False
+        keys = [
+            CHANGE_KEY.format(number)
+            for number in range(self.version + 1, version + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        for recipe_id in {changes[key] for key in keys}:
+            self.apply(recipe_id)
+        self.version = version
+        return True
+
+    def discard(self, recipe_id):
+        """Удаление рецепта из индекса текущего процесса."""
+
+        with self.lock:
+            self.ingredients = {
+                key: remove(values, recipe_id)
+                for key, values in self.ingredients.items()
+            }
+            self.tags = {
+                key: remove(values, recipe_id)
+                for key, values in self.tags.items()
+            }
+            position = np.searchsorted(self.recipe_ids, recipe_id)
+            if (position < len(self.recipe_ids)
+                    and self.recipe_ids[position] == recipe_id):
+                self.recipe_ids = np.delete(self.recipe_ids, position)
+                self.totals = np.delete(self.totals, position)
+
+    def apply(self, recipe_id):
+        """Перечитывание рецепта из базы в индекс текущего процесса.
+        Удаленный рецепт удаляется из индекса."""
+
+        with self.lock:
+            self.discard(recipe_id)
+            ingredient_ids = list(IngredientAmount.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', flat=True))
+            tag_ids = Recipe.tags.through.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('tag_id', flat=True)
+            for ingredient_id in ingredient_ids:
+                self.ingredients[ingredient_id] = insert(
+                    self.ingredients.get(ingredient_id, EMPTY), recipe_id
+                )
+            for tag_id in tag_ids:
+                self.tags[tag_id] = insert(
+                    self.tags.get(tag_id, EMPTY), recipe_id
+                )
+            if ingredient_ids:
+                position = np.searchsorted(self.recipe_ids, recipe_id)
+                self.recipe_ids = np.insert(
+                    self.recipe_ids, position, recipe_id
+                )
+                self.totals = np.insert(
+                    self.totals, position, len(ingredient_ids)
+                )
+
+    def refresh(self, recipe_id, deleted=False):
+        """Обновление рецепта в индексе текущего процесса и публикация
+        изменения для остальных процессов после фиксации транзакции:
+        до нее остальные процессы не видят изменения в базе, а при
+        откате изменения не было."""
+
+        transaction.on_commit(lambda: self.publish(recipe_id, deleted))
+
+    def publish(self, recipe_id, deleted=False):
+        version = self.next_version()
+        cache.set(
+            CHANGE_KEY.format(version), recipe_id,
+            settings.PANTRY_INDEX_TTL * 2
+        )
+        with self.lock:
+            if self.built is None:
+                return
+            if deleted:
+                self.discard(recipe_id)
+            else:
+                self.apply(recipe_id)
+            # Если между текущей и новой версией есть чужие изменения,
+            # они будут применены при следующем запросе.
+            if self.version is not None and self.version + 1 == version:
+                self.version = version
+
+    @staticmethod
+    def next_version():
+        """Следующая версия журнала. Ключ версии может быть вытеснен из
+        кэша, поэтому отсутствующая версия начинается с текущего времени
+        в наносекундах: отставание от нее заставит процессы построить
+        индекс заново."""
+
+        while True:
+            cache.add(VERSION_KEY, time_ns(), None)
+            try:
+                return cache.incr(VERSION_KEY)
+            except ValueError:
+                continue
+
+    def search(self, ingredient_ids, tag_ids=None):
+        """Рецепты, содержащие хотя бы один из ингредиентов, упорядоченные
+        по количеству недостающих ингредиентов, затем от новых к старым.
+
+        Возвращает массивы идентификаторов рецептов, количества
+        недостающих и количества имеющихся ингредиентов."""
+
+        self.ensure_fresh()
+        # Обновление заменяет атрибуты новыми объектами, под блокировкой
+        # берется согласованный снимок индекса.
+        with self.lock:
+            index, tags = self.ingredients, self.tags
+            all_recipe_ids, all_totals = self.recipe_ids, self.totals
+        postings = [
+            index[ingredient_id]
+            for ingredient_id in set(ingredient_ids)
+            if ingredient_id in index
+        ]
+        if not postings:
+            return EMPTY, EMPTY, EMPTY
+        recipe_ids, matched = np.unique(
+            np.concatenate(postings), return_counts=True
+        )
+        if tag_ids is not None:
+            tagged = [tags.get(tag_id, EMPTY) for tag_id in tag_ids]
+            mask = np.isin(recipe_ids, np.concatenate(tagged + [EMPTY]))
+            recipe_ids, matched = recipe_ids[mask], matched[mask]
+        totals = all_totals[np.searchsorted(all_recipe_ids, recipe_ids)]
+        missing = totals - matched
+        order = np.lexsort((-recipe_ids, missing))
+        return recipe_ids[order], missing[order], matched[order]
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,293 @@
+"""Формирование PDF-документов с помощью ReportLab."""
+import io
+from concurrent import futures
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Prefetch
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.models import IngredientAmount, Recipe  # isort:skip
+
+from .deadlines import (DeadlineExceeded, check_deadline,  # isort:skip
+                        remaining_time)  # isort:skip
+
+FONT_NAME = 'arial'
+FONT_PATH = './data/arial.ttf'
+FONTS_SIZE = {
+    'small': 10,
+    'normal': 12,
+    'huge': 18
+}
+
+
+def register_fonts():
+    """Регистрация шрифта с кириллицей, повторный вызов ничего не делает."""
+
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH, 'UTF-8'))
+
+
+def get_shopping_cart(user):
+    """Суммарное количество ингредиентов из рецептов списка покупок."""
+
+    ingredients = IngredientAmount.objects.filter(
+        recipe__shopping_carts__user=user
+    ).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    )
+    cart_list = {}
+    for ingredient in ingredients:
+        check_deadline()
+        name, measure, amount = ingredient
+        name = name.capitalize()
+        if name in cart_list:
+            cart_list[name]['amount'] += amount
+        else:
+            cart_list[name] = {
+                'unit': measure,
+                'amount': amount
+            }
+    return cart_list
+
+
+def render_shopping_cart(user, output=None):
+    """Список покупок пользователя в PDF. Документ записывается в output
+    (файлоподобный объект), если он не передан - возвращаются байты."""
+
+    height_page, string_interval, text_indent = 750, 15, 100
+    buffer = output if output is not None else io.BytesIO()
+    register_fonts()
+    page = canvas.Canvas(buffer)
+    page.setFont(FONT_NAME, FONTS_SIZE['huge'])
+    page.drawString(
+        text_indent - 30,
+        height_page,
+        'Список ингредиентов для покупки:'
+    )
+    height_page -= string_interval * 2
+    page.setFont(FONT_NAME, size=FONTS_SIZE['normal'])
+    cart_list = get_shopping_cart(user)
+    for idx, (name, data) in enumerate(cart_list.items(), 1):
+        description = f'{idx}. {name} ({data["unit"]}) - {data["amount"]}'
+        page.drawString(text_indent, height_page, description)
+        height_page -= string_interval
+    page.setLineWidth(1)
+    page.line(
+        text_indent,
+        height_page + 10,
+        text_indent + 150,
+        height_page + 10
+    )
+    page.setFont(FONT_NAME, FONTS_SIZE['small'])
+    page.drawString(
+        text_indent,
+        height_page,
+        f'Foodgram project (c) {date.today().year}'
+    )
+    page.showPage()
+    page.save()
+    if output is None:
+        return buffer.getvalue()
+    return None
+
+
+# Книга рецептов: страница A4, поля и размер картинки в пунктах.
+BOOK_MARGIN = 50
+BOOK_IMAGE_BOX = 240
+BOOK_LINE_HEIGHT = {
+    'huge': 24,
+    'normal': 16,
+    'small': 13,
+}
+BOOK_SOURCES = {
+    'favorites': 'favorites__user',
+    'shopping_cart': 'shopping_carts__user',
+}
+
+
+def get_book_recipes(user, source):
+    """Рецепты пользователя из избранного или списка покупок с
+    ингредиентами."""
+
+    return Recipe.objects.filter(**{BOOK_SOURCES[source]: user}).only(
+        'id', 'name', 'image', 'text', 'cooking_time'
+    ).prefetch_related(Prefetch(
+        'amounts',
+        queryset=IngredientAmount.objects.select_related('ingredient')
+    ))
+
+
+def get_page_data(recipe):
+    """Данные рецепта для подготовки страницы в другом процессе."""
+
+    image = None
+    if recipe.image:
+        try:
+            image = recipe.image.path
+        except NotImplementedError:
+            with recipe.image.open('rb') as file:
+                image = file.read()
+    return {
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'ingredients': [
+            f'{amount.ingredient.name.capitalize()} '
+            f'({amount.ingredient.measurement_unit}) - {amount.amount}'
+            for amount in recipe.amounts.all()
+        ],
+        'image': image,
+    }
+
+
+def downscale_image(source, size, quality):
+    """Уменьшение картинки до size точек по большей стороне и перевод в
+    JPEG, который ReportLab встраивает без перекодирования."""
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        image.draft('RGB', (size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), image.size
+
+
+def prepare_page(data):
+    """Подготовка страницы рецепта: уменьшенная картинка и строки текста,
+    разбитые по ширине страницы. Выполняется в пуле процессов."""
+
+    register_fonts()
+    width = A4[0] - BOOK_MARGIN * 2
+    title = simpleSplit(data['name'], FONT_NAME, FONTS_SIZE['huge'], width)
+    image = None
+    if data['image'] is not None:
+        try:
+            image = downscale_image(
+                data['image'],
+                settings.RECIPE_BOOK['IMAGE_SIZE'],
+                settings.RECIPE_BOOK['IMAGE_QUALITY']
+            )
+        except (OSError, ValueError):
+            image = None
+    lines = [
+        ('normal', f'Время приготовления: {data["cooking_time"]} мин.'),
+        ('normal', 'Ингредиенты:'),
+    ]
+    for idx, ingredient in enumerate(data['ingredients'], 1):
+        lines.extend(
+            ('small', line) for line in simpleSplit(
+                f'{idx}. {ingredient}', FONT_NAME, FONTS_SIZE['small'], width
+            )
+        )
+    lines.append(('normal', ''))
+    for paragraph in data['text'].splitlines():
+        lines.extend(
+            ('small', line) for line in simpleSplit(
+                paragraph, FONT_NAME, FONTS_SIZE['small'], width
+            ) or ['']
+        )
+    return {'title': title, 'image': image, 'lines': lines}
+
+
+def prepare_pages(pages, parallel=False):
+    """Подготовка страниц. Пул процессов запускается только по parallel
+    (фоновая задача): в рабочем процессе веб-сервера он создавал бы
+    процессы на каждый запрос. Без пула и для небольших книг страницы
+    готовятся в текущем процессе по мере вывода."""
+
+    workers = settings.RECIPE_BOOK['WORKERS']
+    if (
+        not parallel
+        or workers < 2
+        or len(pages) < settings.RECIPE_BOOK['MIN_PARALLEL']
+    ):
+        return map(prepare_page, pages)
+    executor = futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        # Ожидание результатов ограничено бюджетом времени запроса,
+        # невыполненные части отменяются.
+        return list(executor.map(
+            prepare_page, pages, chunksize=4, timeout=remaining_time()
+        ))
+    except futures.TimeoutError:
+        raise DeadlineExceeded()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def draw_book_page(page, prepared):
+    """Вывод подготовленной страницы рецепта, при переполнении текст
+    переносится на следующую страницу."""
+
+    top = A4[1] - BOOK_MARGIN
+    height = top
+    page.setFont(FONT_NAME, FONTS_SIZE['huge'])
+    for text in prepared['title']:
+        page.drawString(BOOK_MARGIN, height - FONTS_SIZE['huge'], text)
+        height -= BOOK_LINE_HEIGHT['huge']
+    if prepared['image'] is not None:
+        height = draw_book_image(page, prepared['image'], height)
+    for style, text in prepared['lines']:
+        if height - BOOK_LINE_HEIGHT[style] < BOOK_MARGIN:
+            page.showPage()
+            height = top
+        page.setFont(FONT_NAME, FONTS_SIZE[style])
+        page.drawString(BOOK_MARGIN, height - FONTS_SIZE[style], text)
+        height -= BOOK_LINE_HEIGHT[style]
+    page.showPage()
+
+
+def draw_book_image(page, image, height):
+    """Вывод картинки, вписанной в квадрат BOOK_IMAGE_BOX, под заголовком.
+    Возвращает высоту, с которой продолжается текст."""
+
+    content, (width, image_height) = image
+    scale = min(BOOK_IMAGE_BOX / width, BOOK_IMAGE_BOX / image_height)
+    width, image_height = width * scale, image_height * scale
+    page.drawImage(
+        ImageReader(io.BytesIO(content)),
+        BOOK_MARGIN,
+        height - image_height - 10,
+        width=width,
+        height=image_height
+    )
+    return height - image_height - 20
+
+
+def render_recipe_book(recipes, output, parallel=False):
+    """Книга рецептов в PDF: по странице на рецепт с картинкой,
+    ингредиентами и описанием.
+
+    Картинки уменьшаются и текст разбивается на строки (с parallel - в
+    пуле процессов), готовые страницы выводятся в один документ в
+    текущем процессе и записываются в output (файлоподобный объект)."""
+
+    register_fonts()
+    pages = [get_page_data(recipe) for recipe in recipes]
+    page = canvas.Canvas(output, pagesize=A4)
+    page.setTitle('Книга рецептов')
+    for prepared in prepare_pages(pages, parallel):
+        check_deadline()
+        draw_book_page(page, prepared)
+    if not pages:
+        page.setFont(FONT_NAME, FONTS_SIZE['normal'])
+        page.drawString(BOOK_MARGIN, A4[1] - BOOK_MARGIN, 'Рецептов нет.')
+        page.showPage()
+    page.save()
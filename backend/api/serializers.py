@@ -1,21 +1,47 @@
 from django.contrib.auth import get_user_model
+from django.db import models
+from django.urls import reverse
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
+from backend.tracing import TracedMethodField  # isort:skip
+from jobs.models import Job  # isort:skip
 from recipes.models import (Favorite, Ingredient,  # isort:skip
                             IngredientAmount, Recipe,  # isort:skip
                             ShoppingCart, Tag)  # isort:skip
-from users.models import Follow  # isort:skip
+from recipes.signals import recipe_changed  # isort:skip
+
+from .deadlines import check_deadline  # isort:skip
+from .fields import SparseFieldsSerializerMixin, wants  # isort:skip
+from .flags import get_user_flags  # isort:skip
+from .uploads import RecipeImageField  # isort:skip
 
 User = get_user_model()
 
 
-class CustomUserSerializer(UserSerializer):
+class UserFlagsListSerializer(serializers.ListSerializer):
+    """Список, для которого отметки текущего пользователя (избранное,
+    список покупок, подписки) загружаются одним запросом на вид отметок."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        data = list(data)
+        request = self.context.get('request')
+        if request is not None:
+            self.child.load_flags(get_user_flags(request), data)
+        representation = []
+        for item in data:
+            check_deadline()
+            representation.append(self.child.to_representation(item))
+        return representation
+
+
+class CustomUserSerializer(SparseFieldsSerializerMixin, UserSerializer):
     """Сериализатор описывающий пользователя."""
 
-    is_subscribed = serializers.SerializerMethodField(read_only=True)
+    is_subscribed = TracedMethodField(read_only=True)
 
     class Meta:
         model = User
@@ -27,15 +53,20 @@ class CustomUserSerializer(UserSerializer):
             'last_name',
             'is_subscribed',
         )
+        list_serializer_class = UserFlagsListSerializer
+
+    def load_flags(self, flags, users):
+        if 'is_subscribed' in self.fields:
+            flags.load('following', [user.id for user in users])
 
     def get_is_subscribed(self, obj):
         """Функция возвращающая, подписан ли пользователь на автора
         рецепта или нет."""
 
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if not request:
             return False
-        return Follow.objects.filter(author=obj.id, user=user).exists()
+        return get_user_flags(request).is_subscribed(obj.id)
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -68,8 +99,8 @@ class CustomUserCreateSerializer(UserCreateSerializer):
 class FollowSerializer(CustomUserSerializer):
     """Сериализатор описывающий подписки пользователя на авторов рецептов."""
 
-    recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes = TracedMethodField(read_only=True)
+    recipes_count = TracedMethodField(read_only=True)
 
     class Meta:
         model = User
@@ -83,17 +114,51 @@ class FollowSerializer(CustomUserSerializer):
             'recipes',
             'recipes_count',
         )
+        list_serializer_class = UserFlagsListSerializer
+
+    def get_recipes_limit(self):
+        limit = self.context.get('request').query_params.get('recipes_limit')
+        return max(int(limit), 0) if limit else None
+
+    def load_flags(self, flags, users):
+        super().load_flags(flags, users)
+        if 'recipes' in self.fields:
+            self.load_recipes(users)
+
+    def load_recipes(self, users):
+        """Рецепты всех авторов списка одним запросом. Ограничение
+        количества рецептов автора применяется в базе: коррелированный
+        подзапрос отбирает первые limit рецептов каждого автора."""
+
+        limit = self.get_recipes_limit()
+        self.authors_recipes = {user.id: [] for user in users}
+        recipes = Recipe.objects.filter(
+            author__in=list(self.authors_recipes)
+        ).only(*RecipeInfoSerializer.Meta.fields, 'author_id')
+        if limit is not None:
+            recipes = recipes.filter(pk__in=models.Subquery(
+                Recipe.objects.filter(
+                    author=models.OuterRef('author')
+                ).values('pk')[:limit]
+            ))
+        for recipe in recipes:
+            self.authors_recipes[recipe.author_id].append(recipe)
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = obj.recipes.all()
-        limit = request.query_params.get('recipes_limit')
-        if limit:
-            recipes = recipes[:int(limit)]
+        authors_recipes = getattr(self, 'authors_recipes', {})
+        if obj.id in authors_recipes:
+            recipes = authors_recipes[obj.id]
+        else:
+            recipes = obj.recipes.all()
+            limit = self.get_recipes_limit()
+            if limit is not None:
+                recipes = recipes[:limit]
         return RecipeInfoSerializer(recipes, many=True).data
 
     @staticmethod
     def get_recipes_count(obj):
+        if hasattr(obj, 'recipes_total'):
+            return obj.recipes_total
         return obj.recipes.count()
 
 
@@ -153,47 +218,139 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         fields = 'id', 'amount',
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
-    """Сериализатор для списка рецептов."""
+class AuthorCardSerializer(serializers.ModelSerializer):
+    """Сериализатор автора в карточке рецепта."""
+
+    class Meta:
+        model = User
+        fields = (
+            'email',
+            'id',
+            'username',
+            'first_name',
+            'last_name',
+        )
+
+
+class RecipeCardSerializer(serializers.ModelSerializer):
+    """Сериализатор карточки рецепта, сохраняемой в Recipe.card.
+
+    Карточка не зависит от пользователя и запроса: картинка хранится
+    относительной ссылкой."""
 
     tags = TagSerializer(many=True)
-    author = CustomUserSerializer(read_only=True)
-    ingredients = serializers.SerializerMethodField(read_only=True)
-    is_favorited = serializers.SerializerMethodField(read_only=True)
-    is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    author = AuthorCardSerializer()
+    ingredients = IngredientAmountSerializer(source='amounts', many=True)
+    image = TracedMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+        fields = ('id', 'tags', 'author', 'ingredients', 'name', 'image',
+                  'text', 'cooking_time')
 
     @staticmethod
-    def get_ingredients(obj):
-        queryset = IngredientAmount.objects.filter(recipe=obj)
-        return IngredientAmountSerializer(queryset, many=True).data
+    def get_image(obj):
+        return obj.image.url if obj.image else None
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return Favorite.objects.filter(recipe=obj, user=request.user).exists()
 
-    def get_is_in_shopping_cart(self, obj):
+class RecipeListSerializer(serializers.BaseSerializer):
+    """Сериализатор для списка рецептов.
+
+    Простые поля берутся из таблицы рецептов, теги, автор и ингредиенты -
+    из сохраненной карточки (см. api.cards), отметки текущего пользователя
+    добавляются при каждом запросе. Поддерживает выбор полей (api.fields).
+    """
+
+    FIELDS = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
+              'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time')
+    CARD_FIELDS = frozenset(('tags', 'author', 'ingredients'))
+    COLUMN_FIELDS = frozenset(('name', 'image', 'text', 'cooking_time'))
+
+    class Meta:
+        list_serializer_class = UserFlagsListSerializer
+
+    @classmethod
+    def get_columns(cls, selection):
+        """Поля модели, которые нужно загрузить для выбранных полей."""
+
+        columns = {'id'}
+        if wants(selection, 'author'):
+            columns.add('author_id')
+        if any(wants(selection, name) for name in cls.CARD_FIELDS):
+            columns.add('card')
+        columns.update(
+            name for name in cls.COLUMN_FIELDS if wants(selection, name)
+        )
+        return columns
+
+    def get_field_names(self):
+        selection = self.context.get('fields')
+        if selection is None:
+            return self.FIELDS
+        return selection.filter(self.FIELDS)
+
+    def load_flags(self, flags, recipes):
+        names = self.get_field_names()
+        recipe_ids = [recipe.id for recipe in recipes]
+        if 'is_favorited' in names:
+            flags.load('favorites', recipe_ids)
+        if 'is_in_shopping_cart' in names:
+            flags.load('shopping_cart', recipe_ids)
+        if 'author' in names:
+            flags.load('following', [recipe.author_id for recipe in recipes])
+
+    def to_representation(self, recipe):
+        names = self.get_field_names()
         request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return ShoppingCart.objects.filter(
-            recipe=obj,
-            user=request.user
-        ).exists()
+        flags = get_user_flags(request) if request is not None else None
+        card = None
+        if self.CARD_FIELDS.intersection(names):
+            card = recipe.card or RecipeCardSerializer(recipe).data
+        data = {}
+        for name in names:
+            if name == 'id':
+                data[name] = recipe.id
+            elif name == 'author':
+                data[name] = dict(
+                    card['author'],
+                    is_subscribed=(
+                        flags is not None
+                        and flags.is_subscribed(recipe.author_id)
+                    )
+                )
+            elif name in self.CARD_FIELDS:
+                data[name] = card[name]
+            elif name == 'is_favorited':
+                data[name] = (
+                    flags is not None and flags.is_favorited(recipe.id)
+                )
+            elif name == 'is_in_shopping_cart':
+                data[name] = (
+                    flags is not None and flags.is_in_shopping_cart(recipe.id)
+                )
+            elif name == 'image':
+                data[name] = recipe.image.url if recipe.image else None
+                if data[name] and request is not None:
+                    data[name] = request.build_absolute_uri(data[name])
+            else:
+                data[name] = getattr(recipe, name)
+        return data
+
+
+class PantryRecipeSerializer(RecipeListSerializer):
+    """Сериализатор рецепта, подобранного по имеющимся продуктам."""
+
+    FIELDS = RecipeListSerializer.FIELDS + (
+        'missing_ingredients',
+        'matched_ingredients',
+    )
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления и обновления рецепта."""
 
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     ingredients = AddIngredientSerializer(many=True)
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
@@ -260,6 +417,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe.save()
         recipe.tags.set(tags_data)
         self.create_ingredients(recipe, ingredients_data)
+        recipe_changed.send(sender=Recipe, recipe=recipe)
         return recipe
 
     def update(self, recipe, validated_data):
@@ -267,7 +425,9 @@ class RecipeSerializer(serializers.ModelSerializer):
         IngredientAmount.objects.filter(recipe=recipe).delete()
         recipe.tags.set(validated_data.pop('tags'))
         self.create_ingredients(recipe, validated_data.pop('ingredients'))
-        return super().update(recipe, validated_data)
+        recipe = super().update(recipe, validated_data)
+        recipe_changed.send(sender=Recipe, recipe=recipe)
+        return recipe
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -317,3 +477,27 @@ class FavoriteSerializer(serializers.ModelSerializer):
             instance.recipe,
             context={'request': request}
         ).data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Сериализатор для фоновой задачи."""
+
+    result = TracedMethodField()
+
+    class Meta:
+        model = Job
+        fields = (
+            'id', 'kind', 'status', 'created', 'started', 'finished',
+            'expires', 'error', 'result',
+        )
+
+    def get_result(self, obj):
+        """Ссылка на результат выполненной задачи."""
+
+        if obj.status != Job.DONE or not obj.result:
+            return None
+        url = reverse('jobs-result', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
@@ -0,0 +1,125 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from backend.cache import cache  # isort:skip
+from recipes.models import (Favorite, Ingredient,  # isort:skip
+                            Recipe, ShoppingCart, Tag)  # isort:skip
+from users.models import Follow  # isort:skip
+from recipes.signals import recipe_changed  # isort:skip
+
+from .cards import AUTHOR_FIELDS, refresh_card, refresh_cards  # isort:skip
+from .paginations import reset_counts  # isort:skip
+from .pantry import pantry_index  # isort:skip
+
+User = get_user_model()
+
+
+@receiver(recipe_changed)
+def refresh_recipe_card(sender, recipe, **kwargs):
+    """Пересоздание карточки измененного рецепта."""
+
+    refresh_card(recipe)
+
+
+@receiver(post_save, sender=User)
+def refresh_author_cards(sender, instance, created, update_fields=None,
+                         raw=False, **kwargs):
+    """Пересоздание карточек рецептов автора при изменении его
+    публичных данных."""
+
+    if created or raw:
+        return
+    if update_fields is not None and not AUTHOR_FIELDS.intersection(
+        update_fields
+    ):
+        return
+    refresh_cards(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def refresh_tag_cards(sender, instance, created, raw=False, **kwargs):
+    """Пересоздание карточек рецептов с измененным тегом."""
+
+    if not created and not raw:
+        refresh_cards(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_cards(sender, instance, created, raw=False,
+                             **kwargs):
+    """Пересоздание карточек рецептов с измененным ингредиентом."""
+
+    if not created and not raw:
+        refresh_cards(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_card_recipes(sender, instance, **kwargs):
+    instance.card_recipe_ids = list(
+        instance.recipes.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_deleted_cards(sender, instance, **kwargs):
+    """Пересоздание карточек рецептов, из которых удален тег или
+    ингредиент."""
+
+    refresh_cards(getattr(instance, 'card_recipe_ids', ()))
+
+
+@receiver(recipe_changed)
+def refresh_pantry_index(sender, recipe, **kwargs):
+    """Обновление рецепта в индексе подбора по продуктам."""
+
+    pantry_index.refresh(recipe.id)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_from_pantry_index(sender, instance, **kwargs):
+    """Удаление рецепта из индекса подбора по продуктам."""
+
+    pantry_index.refresh(instance.id, deleted=True)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reset_tags_cache(sender, **kwargs):
+    cache.bump('tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reset_ingredients_cache(sender, **kwargs):
+    cache.bump('ingredients')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def reset_list_counts(sender, created=True, raw=False, **kwargs):
+    """Сброс количеств в списках после добавления или удаления объектов.
+    Изменение существующих объектов количества не меняет."""
+
+    if created and not raw:
+        reset_counts(sender)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def reset_tag_counts(sender, action, **kwargs):
+    """Сброс количеств рецептов при изменении тегов: фильтр по тегам
+    использует маску тегов в таблице рецептов."""
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        reset_counts(Recipe, sender)
@@ -0,0 +1,26 @@
+"""Обработчики фоновых задач API (см. jobs.registry)."""
+import tempfile
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+
+from jobs.registry import register  # isort:skip
+
+from .pdf import (get_book_recipes, render_recipe_book,  # isort:skip
+                  render_shopping_cart)  # isort:skip
+
+
+@register('shopping_cart_pdf')
+def shopping_cart_pdf(job):
+    return 'shopping_list.pdf', ContentFile(render_shopping_cart(job.user))
+
+
+@register('recipe_book_pdf')
+def recipe_book_pdf(job):
+    output = tempfile.TemporaryFile()
+    render_recipe_book(
+        get_book_recipes(job.user, job.params['source']), output,
+        parallel=True
+    )
+    output.seek(0)
+    return 'recipe_book.pdf', File(output)
@@ -0,0 +1,545 @@
+"""Бюджеты SQL-запросов для маршрутов API.
+
+Каждый маршрут из api.urls (вместе с маршрутами djoser) и каждый его
+метод HTTP должны быть описаны в BUDGETS или в SKIPPED. Тест
+api.tests.test_query_budgets на тестовой базе создает набор данных, в
+котором количество тегов, рецептов, ингредиентов рецепта, подписок и
+отметок равно размеру страницы, выполняет запросы к маршрутам анонимно и от
+имени пользователя с отметками, затем откатывает транзакцию. Проверка
+повторяется для двух размеров: маршрут не проходит проверку, если
+количество запросов больше бюджета или растет вместе с количеством
+строк (признак N+1 в сериализаторе).
+
+Бюджеты BUDGETS измерены на SQLite. Запросы, которые выполняются только
+на другой СУБД, описаны в VENDOR_BUDGETS и добавляются к бюджету при
+проверке на ней.
+"""
+import base64
+import io
+import re
+import tempfile
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+from types import SimpleNamespace
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLResolver, get_resolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.pantry import pantry_index  # isort:skip
+from backend.cache import cache  # isort:skip
+from jobs.models import Job  # isort:skip
+from recipes.changes import last_token  # isort:skip
+from recipes.models import (Favorite, Ingredient,  # isort:skip
+                            IngredientAmount, Recipe, ShoppingCart,
+                            SimilarRecipe, Tag)  # isort:skip
+from recipes.signals import recipe_changed  # isort:skip
+from users.models import Follow, User  # isort:skip
+
+PASSWORD = 'Lemon-tree-42'
+NEW_PASSWORD = 'Orange-cloud-17'
+USERS = ('anonymous', 'authenticated')
+
+# Бюджет маршрута: наибольшее количество запросов для анонимного и
+# авторизованного пользователя, функция, возвращающая параметры запроса
+# (kwargs маршрута, params строки запроса, data тела) для набора данных,
+# и допустимое количество запросов на строку для маршрутов, которые
+# обрабатывают строки по одной (например, проверка тегов при записи).
+Budget = namedtuple(
+    'Budget',
+    ('anonymous', 'authenticated', 'request', 'per_row'),
+    defaults=(None, 0)
+)
+
+
+def recipe_data(fixture):
+    return {
+        'name': 'Рецепт',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': fixture.image_data,
+        'tags': [tag.id for tag in fixture.tags],
+        'ingredients': [
+            {'id': ingredient.id, 'amount': 5}
+            for ingredient in fixture.ingredients[:fixture.size]
+        ],
+    }
+
+
+BUDGETS = {
+    ('api-root', 'get'): Budget(0, 1),
+    ('bootstrap', 'get'): Budget(5, 14),
+    ('sync', 'get'): Budget(0, 7, lambda f: {'params': {'since': f.since}}),
+    ('subscriptions', 'get'): Budget(
+        0, 5, lambda f: {'params': {'recipes_limit': f.size}}
+    ),
+    ('subscribe', 'post'): Budget(
+        0, 10,
+        lambda f: {
+            'kwargs': {'user_id': f.new_author.id},
+            'params': {'recipes_limit': f.size},
+        }
+    ),
+    ('subscribe', 'delete'): Budget(0, 6),
+    ('users-list', 'get'): Budget(2, 4),
+    ('users-list', 'post'): Budget(
+        5, 6,
+        lambda f: {'data': {
+            'email': f'{f.stamp}-new@example.com',
+            'username': f'{f.stamp}-new',
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'password': PASSWORD,
+        }}
+    ),
+    ('users-me', 'get'): Budget(0, 2),
+    ('users-set-password', 'post'): Budget(
+        0, 9,
+        lambda f: {'data': {
+            'current_password': PASSWORD,
+            'new_password': NEW_PASSWORD,
+        }}
+    ),
+    ('users-set-username', 'post'): Budget(
+        0, 10,
+        lambda f: {'data': {
+            'current_password': PASSWORD,
+            'new_email': f'{f.stamp}-renamed@example.com',
+        }}
+    ),
+    ('users-detail', 'get'): Budget(1, 3),
+    ('users-detail', 'patch'): Budget(
+        0, 11,
+        lambda f: {
+            'kwargs': {'id': f.viewer.id},
+            'data': {'first_name': 'Новое имя'},
+        }
+    ),
+    ('tags-list', 'get'): Budget(1, 2),
+    ('tags-detail', 'get'): Budget(1, 2),
+    ('ingredients-list', 'get'): Budget(
+        1, 2, lambda f: {'params': {'name': f.stamp}}
+    ),
+    ('ingredients-detail', 'get'): Budget(1, 2),
+    ('recipes-list', 'get'): Budget(4, 8),
+    ('recipes-list', 'post'): Budget(
+        0, 26, lambda f: {'data': recipe_data(f)}, per_row=2
+    ),
+    ('recipes-detail', 'get'): Budget(1, 5),
+    ('recipes-detail', 'patch'): Budget(
+        0, 35,
+        lambda f: {
+            'kwargs': {'pk': f.own_recipe.id},
+            'data': recipe_data(f),
+        },
+        per_row=2
+    ),
+    ('recipes-detail', 'delete'): Budget(
+        0, 14, lambda f: {'kwargs': {'pk': f.own_recipe.id}}
+    ),
+    ('recipes-trending', 'get'): Budget(2, 6),
+    ('recipes-similar', 'get'): Budget(1, 2),
+    ('recipes-pantry', 'get'): Budget(
+        3, 5,
+        lambda f: {'params': {'ingredients': ','.join(
+            str(ingredient.id) for ingredient in f.ingredients
+        )}}
+    ),
+    ('recipes-favorite', 'post'): Budget(
+        0, 12, lambda f: {'kwargs': {'pk': f.own_recipe.id}}
+    ),
+    ('recipes-favorite', 'delete'): Budget(0, 9),
+    ('recipes-shopping-cart', 'post'): Budget(
+        0, 12, lambda f: {'kwargs': {'pk': f.own_recipe.id}}
+    ),
+    ('recipes-shopping-cart', 'delete'): Budget(0, 9),
+    ('recipes-download-shopping-cart', 'get'): Budget(0, 2),
+    ('recipes-download-shopping-cart', 'post'): Budget(0, 2),
+    ('recipes-download-recipe-book', 'get'): Budget(0, 3),
+    ('recipes-download-recipe-book', 'post'): Budget(0, 2),
+    ('jobs-list', 'get'): Budget(0, 3),
+    ('jobs-detail', 'get'): Budget(0, 2),
+    ('jobs-result', 'get'): Budget(0, 2),
+    ('login', 'post'): Budget(
+        3, 4,
+        lambda f: {'data': {
+            'email': f.viewer.email,
+            'password': PASSWORD,
+        }}
+    ),
+    ('logout', 'post'): Budget(0, 2),
+}
+
+# Дополнительные запросы на других СУБД. PostgreSQL при промахе кэша
+# количества строк постраничного списка сначала выполняет EXPLAIN для
+# оценки планировщика (api.paginations.calculate_count): по запросу на
+# каждый список ответа.
+VENDOR_BUDGETS = {
+    'postgresql': {
+        ('bootstrap', 'get'): Budget(1, 2),
+        ('subscriptions', 'get'): Budget(0, 1),
+        ('users-list', 'get'): Budget(1, 1),
+        ('recipes-list', 'get'): Budget(1, 1),
+        ('recipes-trending', 'get'): Budget(1, 1),
+        ('jobs-list', 'get'): Budget(0, 1),
+    },
+}
+
+# Маршруты, которые не проверяются, с причиной.
+SKIPPED = {
+    ('users-activation', 'post'): 'требует ключ из письма',
+    ('users-resend-activation', 'post'): 'отправляет письмо',
+    ('users-reset-password', 'post'): 'отправляет письмо',
+    ('users-reset-password-confirm', 'post'): 'требует ключ из письма',
+    ('users-reset-username', 'post'): 'отправляет письмо',
+    ('users-reset-username-confirm', 'post'): 'требует ключ из письма',
+    ('users-detail', 'put'): 'совпадает с patch',
+    ('users-detail', 'delete'): (
+        'каскадное удаление выполняет сигналы для каждой отметки'
+    ),
+    ('recipes-detail', 'put'): 'совпадает с patch',
+    ('profiles-list', 'get'): 'только для сотрудников, читает файлы',
+    ('profiles-detail', 'get'): 'только для сотрудников, читает файлы',
+    ('profiles-download', 'get'): 'только для сотрудников, читает файлы',
+}
+
+# Имя вьюсета -> атрибут набора данных с объектом для маршрутов detail.
+DETAIL_OBJECTS = {
+    'users': 'author',
+    'subscribe': 'author',
+    'tags': 'tag',
+    'ingredients': 'ingredient',
+    'recipes': 'recipe',
+    'jobs': 'job',
+}
+
+Route = namedtuple('Route', ('name', 'method', 'kwargs'))
+Result = namedtuple(
+    'Result', ('route', 'user', 'size', 'status', 'queries')
+)
+
+
+def get_routes(urlconf='api.urls'):
+    """Маршруты API с методами HTTP. Маршруты с суффиксом формата и
+    маршруты, перекрытые более ранними с тем же шаблоном (djoser и
+    роутер вьюсетов), пропускаются."""
+
+    seen = set()
+    routes = []
+
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, prefix + str(pattern.pattern))
+                continue
+            regex = prefix + str(pattern.pattern)
+            kwargs = tuple(pattern.pattern.regex.groupindex)
+            if 'format' in kwargs or regex in seen or not pattern.name:
+                continue
+            seen.add(regex)
+            callback = pattern.callback
+            actions = getattr(callback, 'actions', None)
+            if actions is None:
+                actions = [
+                    method for method in callback.view_class.http_method_names
+                    if method not in ('head', 'options')
+                    and hasattr(callback.view_class, method)
+                ]
+            for method in actions:
+                routes.append(Route(pattern.name, method, kwargs))
+
+    walk(get_resolver(urlconf).url_patterns, '')
+    return routes
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def build_fixture(size):
+    """Набор данных, в котором количество строк каждого вида равно size.
+
+    Пользователь viewer подписан на size авторов, у каждого автора (и у
+    еще одного, на которого viewer не подписан) size рецептов с size
+    тегами и size ингредиентами, все рецепты авторов в избранном и в
+    списке покупок viewer. У viewer есть собственный рецепт без отметок
+    и выполненная задача с результатом."""
+
+    stamp = f'budget-{uuid4().hex[:8]}'
+    since = last_token()
+    image = make_image()
+    image_name = default_storage.save(
+        'recipes/images/budget.png', ContentFile(image)
+    )
+    tags = [
+        Tag.objects.create(name=f'{stamp}-{i}', slug=f'{stamp}-{i}')
+        for i in range(size)
+    ]
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(name=f'{stamp}-{i}', measurement_unit='г')
+        for i in range(size * 2)
+    )
+    if not all(ingredient.pk for ingredient in ingredients):
+        ingredients = list(Ingredient.objects.filter(
+            name__startswith=stamp
+        ).order_by('id'))
+    viewer = User.objects.create_user(
+        email=f'{stamp}@example.com',
+        username=stamp,
+        first_name='Имя',
+        last_name='Фамилия',
+        password=PASSWORD
+    )
+    authors = [
+        User.objects.create(
+            email=f'{stamp}-{i}@example.com',
+            username=f'{stamp}-{i}',
+            first_name='Имя',
+            last_name='Фамилия'
+        )
+        for i in range(size + 1)
+    ]
+
+    def create_recipe(author, number):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f'{stamp}-{number}',
+            image=image_name,
+            text='Описание',
+            cooking_time=10
+        )
+        recipe.tags.set(tags)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient, amount=5)
+            for ingredient in ingredients[:size]
+        )
+        recipe_changed.send(sender=Recipe, recipe=recipe)
+        return recipe
+
+    recipes = [
+        create_recipe(author, number)
+        for author in authors
+        for number in range(size)
+    ]
+    own_recipe = create_recipe(viewer, 0)
+    for author in authors[:size]:
+        Follow.objects.create(user=viewer, author=author)
+    for recipe in recipes:
+        Favorite.objects.create(user=viewer, recipe=recipe)
+        ShoppingCart.objects.create(user=viewer, recipe=recipe)
+    SimilarRecipe.objects.bulk_create(
+        SimilarRecipe(recipe=recipes[0], similar=similar, score=1.0)
+        for similar in recipes[1:size + 1]
+    )
+    job = Job.objects.create(
+        user=viewer,
+        kind='shopping_cart_pdf',
+        status=Job.DONE,
+        filename='shopping_list.pdf'
+    )
+    job.result.save(f'{job.id}.pdf', ContentFile(b'%PDF-1.4'))
+    return SimpleNamespace(
+        size=size,
+        stamp=stamp,
+        since=since,
+        image_data='data:image/png;base64,' + base64.b64encode(
+            image
+        ).decode(),
+        tags=tags,
+        tag=tags[0],
+        ingredients=ingredients,
+        ingredient=ingredients[0],
+        viewer=viewer,
+        token=Token.objects.create(user=viewer).key,
+        author=authors[0],
+        new_author=authors[size],
+        recipe=recipes[0],
+        own_recipe=own_recipe,
+        job=job,
+    )
+
+
+def prepare_request(route, budget, fixture):
+    """URL, параметры строки запроса и тело запроса к маршруту."""
+
+    options = budget.request(fixture) if budget.request else {}
+    kwargs = {}
+    basename = route.name.split('-')[0]
+    for name in route.kwargs:
+        kwargs[name] = getattr(fixture, DETAIL_OBJECTS[basename]).pk
+    kwargs.update(options.get('kwargs', {}))
+    params = {'limit': fixture.size}
+    params.update(options.get('params', {}))
+    return reverse(route.name, kwargs=kwargs), params, options.get('data')
+
+
+def measure(route, budget, fixture, user):
+    """Выполнение одного запроса в откатываемой транзакции с пустым
+    кэшем. Возвращает код ответа и выполненные SQL-запросы."""
+
+    client = APIClient()
+    if user == 'authenticated':
+        client.credentials(HTTP_AUTHORIZATION=f'Token {fixture.token}')
+    path, params, data = prepare_request(route, budget, fixture)
+    caches['default'].clear()
+    cache.local.clear()
+    with transaction.atomic():
+        # Обработчики on_commit (журнал изменений, индекс кладовой) в
+        # работающем процессе выполняются в том же запросе после фиксации.
+        with CaptureQueriesContext(connection) as context, \
+                TestCase.captureOnCommitCallbacks(execute=True):
+            if route.method == 'get':
+                response = client.get(path, params)
+            else:
+                response = getattr(client, route.method)(
+                    f'{path}?{urlencode(params)}', data, format='json'
+                )
+            if response.streaming:
+                # Тестовый клиент закрывает ответ после чтения содержимого.
+                b''.join(response.streaming_content)
+        transaction.set_rollback(True)
+    return response.status_code, [query['sql'] for query in context]
+
+
+def run_checks(sizes, routes=None):
+    """Результаты запросов ко всем маршрутам для каждого размера набора
+    данных и пользователя, маршруты без бюджета и пропущенные."""
+
+    routes = routes or get_routes()
+    missing = [
+        route for route in routes
+        if (route.name, route.method) not in BUDGETS
+        and (route.name, route.method) not in SKIPPED
+    ]
+    checked = [
+        route for route in routes if (route.name, route.method) in BUDGETS
+    ]
+    results = []
+    with ExitStack() as stack:
+        media_root = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            MEDIA_ROOT=media_root,
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'query-budgets',
+            }},
+            DEADLINES=dict(settings.DEADLINES, ENABLED=False),
+            SYNC=dict(settings.SYNC, LAG_SECONDS=0),
+        ))
+        for size in sizes:
+            with transaction.atomic():
+                with TestCase.captureOnCommitCallbacks(execute=True):
+                    fixture = build_fixture(size)
+                # Как в работающем процессе: индекс уже построен, и запись
+                # рецепта обновляет его независимо от порядка проверок.
+                pantry_index.build()
+                for route in checked:
+                    budget = BUDGETS[(route.name, route.method)]
+                    for user in USERS:
+                        status, queries = measure(
+                            route, budget, fixture, user
+                        )
+                        results.append(
+                            Result(route, user, size, status, queries)
+                        )
+                transaction.set_rollback(True)
+    return results, missing
+
+
+def get_vendor_budgets():
+    """Дополнительные бюджеты для СУБД соединения по умолчанию. Оценка
+    количества строк выполняется, только если задан порог."""
+
+    if (
+        connection.vendor == 'postgresql'
+        and not settings.PAGINATION_COUNT['ESTIMATE_THRESHOLD']
+    ):
+        return {}
+    return VENDOR_BUDGETS.get(connection.vendor, {})
+
+
+def describe_vendor():
+    """СУБД, для которой рассчитаны бюджеты."""
+
+    extra = get_vendor_budgets()
+    return f'СУБД: {connection.vendor}, бюджеты SQLite' + (
+        f' с дополнительными запросами {connection.vendor} для '
+        f'{len(extra)} маршрутов.' if extra else '.'
+    )
+
+
+def get_limit(route, user, size):
+    """Наибольшее допустимое количество запросов маршрута."""
+
+    key = (route.name, route.method)
+    budget = BUDGETS[key]
+    extra = get_vendor_budgets().get(key)
+    return (
+        getattr(budget, user) + budget.per_row * size
+        + (getattr(extra, user) if extra else 0)
+    )
+
+
+def find_failures(results):
+    """Проверки, не уложившиеся в бюджет, с количеством запросов,
+    растущим вместе с размером набора данных быстрее допустимого, и
+    запросы пользователя с отметками, завершившиеся ошибкой: пары
+    (описание, результат с запросами для вывода)."""
+
+    failures = []
+    by_check = {}
+    for result in results:
+        by_check.setdefault((result.route, result.user), []).append(result)
+    for (route, user), measured in by_check.items():
+        budget = BUDGETS[(route.name, route.method)]
+        for result in measured:
+            limit = get_limit(route, user, result.size)
+            if len(result.queries) > limit:
+                failures.append((
+                    f'{len(result.queries)} запросов при бюджете {limit} '
+                    f'(размер {result.size})',
+                    result
+                ))
+        if user == 'authenticated':
+            failures.extend(
+                (f'ответ с ошибкой {result.status} (размер {result.size})',
+                 result)
+                for result in measured if result.status >= 400
+            )
+        smallest, largest = measured[0], measured[-1]
+        growth = len(largest.queries) - len(smallest.queries)
+        if growth > budget.per_row * (largest.size - smallest.size):
+            failures.append((
+                f'количество запросов растет с количеством строк: '
+                f'{len(smallest.queries)} при размере {smallest.size}, '
+                f'{len(largest.queries)} при размере {largest.size}',
+                largest
+            ))
+    return failures
+
+
+def normalize(sql):
+    """SQL-запрос без значений параметров для поиска повторов."""
+
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+def repeated(queries):
+    """Запросы, выполненные несколько раз с разными параметрами."""
+
+    counts = Counter(normalize(sql) for sql in queries)
+    return [(sql, count) for sql, count in counts.most_common() if count > 1]
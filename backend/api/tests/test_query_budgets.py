@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from .query_budgets import (SKIPPED, describe_vendor,  # isort:skip
+                            find_failures, repeated,  # isort:skip
+                            run_checks)  # isort:skip
+
+# Размеры страницы и набора данных для сравнения.
+SIZES = (2, 5)
+
+
+class QueryBudgetsTest(TestCase):
+    """Количество SQL-запросов во всех маршрутах API (см.
+    api.tests.query_budgets). Запросы ко всем маршрутам выполняются один
+    раз для класса, тесты проверяют результаты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.results, cls.missing = run_checks(SIZES)
+
+    def test_routes_have_budgets(self):
+        self.assertEqual(
+            [
+                f'{route.method.upper()} {route.name}'
+                for route in self.missing
+            ],
+            [],
+            'Маршруты без бюджета: задайте их в BUDGETS или в SKIPPED.'
+        )
+
+    def test_skipped_routes_have_reasons(self):
+        for route, reason in SKIPPED.items():
+            with self.subTest(route=route):
+                self.assertTrue(reason)
+
+    def test_budgets(self):
+        for description, result in find_failures(self.results):
+            route = f'{result.route.method.upper()} {result.route.name}'
+            with self.subTest(route=route, user=result.user):
+                lines = [f'{describe_vendor()} {description}']
+                lines.extend(
+                    f'  {number}. {sql}'
+                    for number, sql in enumerate(result.queries, 1)
+                )
+                lines.extend(
+                    f'  повторяется {count} раз: {sql}'
+                    for sql, count in repeated(result.queries)
+                )
+                self.fail('\n'.join(lines))
@@ -0,0 +1,108 @@
+"""Загрузка картинок рецептов файлом multipart/form-data.
+
+Файл из multipart/form-data записывается во временный файл по частям,
+загрузка прерывается, как только размер превышает
+RECIPE_IMAGE['MAX_SIZE']. Картинка проверяется Pillow по заголовку
+(verify() не раскодирует точки), в памяти не бывает ни всего файла, ни
+раскодированного изображения. Строка Base64 в JSON по-прежнему
+принимается.
+"""
+import json
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+}
+
+
+class FileTooLarge(MultiPartParserError):
+    pass
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Запись загружаемого файла во временный файл с ограничением
+    размера."""
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.RECIPE_IMAGE['MAX_SIZE']:
+            self.file.close()
+            raise FileTooLarge(
+                f'размер файла больше {settings.RECIPE_IMAGE["MAX_SIZE"]} '
+                f'байт.'
+            )
+        return super().receive_data_chunk(raw_data, start)
+
+
+class FormData(dict):
+    """Поля формы. Request.data объединяет их с файлами через copy() и
+    update(), update() берет из MultiValueDict файлов последние значения
+    полей, а не списки."""
+
+    def copy(self):
+        return FormData(self)
+
+    def update(self, other):
+        super().update((key, other[key]) for key in other)
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    """multipart/form-data для записи рецепта. Поля из json_fields
+    передаются строками JSON, например ingredients=[{"id": 1,
+    "amount": 10}], остальные поля - строками."""
+
+    json_fields = ('ingredients', 'tags')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [LimitedUploadHandler(request)]
+        parsed = super().parse(stream, media_type, parser_context)
+        data = {}
+        for key, values in parsed.data.lists():
+            data[key] = values[-1]
+            if key in self.json_fields:
+                try:
+                    data[key] = json.loads(data[key])
+                except ValueError:
+                    raise ParseError(f'Поле {key} должно быть строкой JSON.')
+        return DataAndFiles(FormData(data), parsed.files)
+
+
+class RecipeImageField(Base64ImageField):
+    """Картинка рецепта: файл из multipart/form-data или строка Base64."""
+
+    def to_internal_value(self, data):
+        limit = settings.RECIPE_IMAGE['MAX_SIZE']
+        if isinstance(data, UploadedFile):
+            # Формат определяется содержимым, расширение имени файла клиента
+            # не проверяется.
+            data.name = 'image.jpg'
+            image = serializers.ImageField.to_internal_value(self, data)
+        elif isinstance(data, str) and len(data) > limit * 4 // 3 + 100:
+            raise serializers.ValidationError(
+                f'Размер картинки больше {limit} байт.'
+            )
+        else:
+            image = super().to_internal_value(data)
+        if image is None:
+            return None
+        if image.image.format not in IMAGE_FORMATS:
+            raise serializers.ValidationError(
+                f'Допустимые форматы картинки: {", ".join(IMAGE_FORMATS)}.'
+            )
+        width, height = image.image.size
+        if width * height > settings.RECIPE_IMAGE['MAX_PIXELS']:
+            raise serializers.ValidationError(
+                'Слишком большое разрешение картинки.'
+            )
+        image.name = f'image.{IMAGE_FORMATS[image.image.format]}'
+        return image
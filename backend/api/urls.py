@@ -1,19 +1,25 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from jobs.views import JobViewSet  # isort:skip
 from users.views import (CustomUserViewSet, FollowListView,  # isort:skip
                          FollowViewSet)  # isort:skip
 
-from .views import (IngredientsViewSet, RecipesViewSet,  # isort:skip
-                    TagsViewSet)  # isort:skip
+from .views import (BootstrapView, IngredientsViewSet,  # isort:skip
+                    ProfilesViewSet, RecipesViewSet,  # isort:skip
+                    SyncView, TagsViewSet)  # isort:skip
 
 router = DefaultRouter()
 router.register('users', CustomUserViewSet, basename='users')
 router.register('tags', TagsViewSet, basename='tags')
 router.register('ingredients', IngredientsViewSet, basename='ingredients')
 router.register('recipes', RecipesViewSet, basename='recipes')
+router.register('jobs', JobViewSet, basename='jobs')
+router.register('profiles', ProfilesViewSet, basename='profiles')
 
 urlpatterns = [
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
+    path('sync/', SyncView.as_view(), name='sync'),
     path(
         'users/subscriptions/',
         FollowListView.as_view(),
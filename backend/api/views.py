@@ -1,29 +1,58 @@
-from datetime import date
+import os
+import tempfile
+from copy import copy
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, QueryDict
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.views import APIView
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
 
-from recipes.models import (Favorite, Ingredient,  # isort:skip
-                            IngredientAmount, Recipe,  # isort:skip
+from backend import profiling  # isort:skip
+from backend import tracing  # isort:skip
+from backend.cache import cache  # isort:skip
+from jobs.registry import enqueue  # isort:skip
+from recipes import changes  # isort:skip
+from recipes import trending  # isort:skip
+from recipes.models import (Change, Favorite,  # isort:skip
+                            Ingredient, Recipe,  # isort:skip
                             ShoppingCart, Tag)  # isort:skip
+from users.views import CustomUserViewSet  # isort:skip
 
-from .filters import IngredientSearchFilter, RecipeFilter  # isort:skip
+from . import ingredient_search  # isort:skip
+from .deadlines import DeadlineMixin  # isort:skip
+from .facets import get_tag_facets  # isort:skip
+from .fields import SparseFieldsViewMixin  # isort:skip
+from .filters import (IngredientSearchFilter, RecipeFilter,  # isort:skip
+                      normalize_search)  # isort:skip
+from .flags import get_user_flags  # isort:skip
 from .paginations import CustomPageNumberPagination  # isort:skip
+from .pantry import Matches, pantry_index  # isort:skip
+from .pdf import (BOOK_SOURCES, get_book_recipes,  # isort:skip
+                  render_recipe_book, render_shopping_cart)  # isort:skip
 from .permissions import IsAuthorOrReadOnly  # isort:skip
 from .serializers import (FavoriteSerializer,  # isort:skip
                           IngredientSerializer,  # isort:skip
-                          RecipeListSerializer,
+                          JobSerializer,  # isort:skip
+                          PantryRecipeSerializer,  # isort:skip
+                          RecipeInfoSerializer, RecipeListSerializer,
                           RecipeSerializer,  # isort:skip
                           ShoppingCartSerializer, TagSerializer)  # isort:skip
+from .uploads import RecipeMultiPartParser  # isort:skip
+
+# Срок свежести закэшированных справочников, с. Кэш сбрасывается при
+# изменении тегов и ингредиентов (api.signals).
+CACHE_TIMEOUT = 60 * 60
 
 
 class TagsViewSet(ReadOnlyModelViewSet):
@@ -34,6 +63,16 @@ class TagsViewSet(ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return Response(cache.get_or_set(
+            'tags',
+            'list',
+            lambda: list(self.get_serializer(
+                self.get_queryset(), many=True
+            ).data),
+            CACHE_TIMEOUT
+        ))
+
 
 class IngredientsViewSet(ReadOnlyModelViewSet):
     """Вьюсет для ингредиентов. Добавить ингредиенты может только
@@ -46,28 +85,180 @@ class IngredientsViewSet(ReadOnlyModelViewSet):
     search_fields = '^name',
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        # Ключи кэша строятся из нормализованной строки поиска, make_key
+        # хэширует их. Запрос без слов не дает триграмм и выполняется
+        # обычным поиском, без отдельной записи в кэше.
+        name = normalize_search(request.query_params.get('name', ''))
+        fuzzy = request.query_params.get('fuzzy', '').lower()
+        if fuzzy in ('1', 'true') and ingredient_search.normalize(name):
+            return Response(cache.get_or_set(
+                'ingredients',
+                f'fuzzy:{name}',
+                lambda: self.get_similar(name),
+                CACHE_TIMEOUT
+            ))
+        return Response(cache.get_or_set(
+            'ingredients',
+            f'list:{name}',
+            lambda: list(self.get_serializer(
+                self.filter_queryset(self.get_queryset()), many=True
+            ).data),
+            CACHE_TIMEOUT
+        ))
+
+    def get_similar(self, name):
+        """Ингредиенты, похожие на name, по убыванию сходства."""
 
-class RecipesViewSet(ModelViewSet):
+        ids = ingredient_search.search(name)
+        ingredients = Ingredient.objects.in_bulk(ids)
+        return list(self.get_serializer(
+            [ingredients[pk] for pk in ids if pk in ingredients], many=True
+        ).data)
+
+
+class RecipesViewSet(DeadlineMixin, SparseFieldsViewMixin, ModelViewSet):
     """Вьюсет для рецептов. Анонимным пользователям разрешено только
     просматривать рецепты."""
 
     queryset = Recipe.objects.all()
     permission_classes = IsAuthorOrReadOnly,
+    parser_classes = JSONParser, RecipeMultiPartParser
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
     pagination_class = CustomPageNumberPagination
+    # Нечисловой идентификатор дает 404 на уровне маршрутов, а не ошибку
+    # преобразования в запросах действий (similar, favorite и др.).
+    lookup_value_regex = r'\d+'
+    deadlines = {
+        'list': 0.3,
+        'retrieve': 0.3,
+        'trending': 0.3,
+        'similar': 0.3,
+        'pantry': 0.5,
+        'download_shopping_cart': 5,
+        'download_recipe_book': 30,
+    }
+
+    def get_queryset(self):
+        if self.action in ('retrieve', 'list', 'trending'):
+            return Recipe.objects.only(*RecipeListSerializer.get_columns(
+                self.get_field_selection()
+            ))
+        return super().get_queryset()
 
     def get_serializer_class(self):
-        if self.action in ('retrieve', 'list'):
+        if self.action in ('retrieve', 'list', 'trending'):
             return RecipeListSerializer
         return RecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        """Список рецептов с количеством рецептов по тегам (api.facets)."""
+
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = {'tags': get_tag_facets(request)}
+        return response
+
+    @action(
+        detail=False,
+        methods=['GET'],
+    )
+    def trending(self, request):
+        """Популярные рецепты по недавним добавлениям в избранное и в
+        списки покупок. Поддерживает те же фильтры, что и список рецептов."""
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            trend__score__gte=trending.threshold()
+        ).order_by('-trend__score')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['GET'],
+    )
+    def similar(self, request, pk):
+        """Рецепты с похожим набором ингредиентов, рассчитанные командой
+        build_similar_recipes."""
+
+        try:
+            limit = min(max(int(request.query_params.get('limit', 6)), 0), 50)
+        except ValueError:
+            limit = 6
+        recipes = list(Recipe.objects.filter(
+            neighbour_of__recipe_id=pk
+        ).order_by('-neighbour_of__score')[:limit])
+        if not recipes:
+            get_object_or_404(Recipe, id=pk)
+        serializer = RecipeInfoSerializer(
+            recipes,
+            many=True,
+            context={'request': request}
+        )
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+    )
+    def pantry(self, request):
+        """Подбор рецептов по имеющимся продуктам: сначала рецепты с
+        наименьшим количеством недостающих ингредиентов."""
+
+        try:
+            ingredient_ids = [
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value
+            ]
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Укажите идентификаторы ингредиентов.'}
+            )
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Выберите хотя бы один ингредиент.'}
+            )
+        slugs = request.query_params.getlist('tags')
+        tag_ids = None
+        if slugs:
+            tag_ids = list(Tag.objects.filter(slug__in=slugs).values_list(
+                'id', flat=True
+            ))
+        page = self.paginate_queryset(
+            Matches(*pantry_index.search(ingredient_ids, tag_ids))
+        )
+        recipes = Recipe.objects.only(*PantryRecipeSerializer.get_columns(
+            self.get_field_selection()
+        )).in_bulk(
+            [item[0] for item in page]
+        )
+        results = []
+        for recipe_id, missing_count, matched_count in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.missing_ingredients = missing_count
+            recipe.matched_ingredients = matched_count
+            results.append(recipe)
+        serializer = PantryRecipeSerializer(
+            results,
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
     @staticmethod
     def post_method(request, pk, serializers):
         data = {'user': request.user.id, 'recipe': pk}
         serializer = serializers(data=data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # Событие и оценка популярности записываются в одной транзакции
+        # (см. команду rescale_trending), удаление выполняется в
+        # транзакции вместе с сигналами.
+        with transaction.atomic(savepoint=False):
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @staticmethod
@@ -119,66 +310,267 @@ class RecipesViewSet(ModelViewSet):
 
     @action(
         detail=False,
-        methods=['GET'],
+        methods=['GET', 'POST'],
         permission_classes=[IsAuthenticated]
     )
     def download_shopping_cart(self, request):
+        """Список покупок в PDF. GET формирует документ сразу, POST ставит
+        задачу в очередь и возвращает ее для опроса через /api/jobs/."""
+
+        if request.method == 'POST':
+            job = enqueue('shopping_cart_pdf', request.user)
+            return Response(
+                JobSerializer(job, context={'request': request}).data,
+                status=status.HTTP_202_ACCEPTED
+            )
         filename = 'shopping_list.pdf'
-        height_page, string_interval, text_indent = 750, 15, 100
-        fonts_size = {
-            'small': 10,
-            'normal': 12,
-            'huge': 18
-        }
         response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename={filename}'
-        pdfmetrics.registerFont(
-            TTFont('arial', './data/arial.ttf', 'UTF-8')
-        )
-        page = canvas.Canvas(response)
-        page.setFont('arial', fonts_size['huge'])
-        page.drawString(
-            text_indent - 30,
-            height_page,
-            'Список ингредиентов для покупки:'
-        )
-        height_page -= string_interval * 2
-        page.setFont('arial', size=fonts_size['normal'])
-        ingredients = IngredientAmount.objects.filter(
-            recipe__shopping_carts__user=request.user
-        ).values_list(
-            'ingredient__name',
-            'ingredient__measurement_unit',
-            'amount'
-        )
-        cart_list = {}
-        for ingredient in ingredients:
-            name, measure, amount = ingredient
-            name = name.capitalize()
-            if name in cart_list:
-                cart_list[name]['amount'] += amount
-            else:
-                cart_list[name] = {
-                    'unit': measure,
-                    'amount': amount
-                }
-        for idx, (name, data) in enumerate(cart_list.items(), 1):
-            description = f'{idx}. {name} ({data["unit"]}) - {data["amount"]}'
-            page.drawString(text_indent, height_page, description)
-            height_page -= string_interval
-        page.setLineWidth(1)
-        page.line(
-            text_indent,
-            height_page + 10,
-            text_indent + 150,
-            height_page + 10
-        )
-        page.setFont('arial', fonts_size['small'])
-        page.drawString(
-            text_indent,
-            height_page,
-            f'Foodgram project (c) {date.today().year}'
-        )
-        page.showPage()
-        page.save()
+        with tracing.span('pdf', document='shopping_cart'):
+            render_shopping_cart(request.user, response)
         return response
+
+    @action(
+        detail=False,
+        methods=['GET', 'POST'],
+        permission_classes=[IsAuthenticated]
+    )
+    def download_recipe_book(self, request):
+        """Книга рецептов в PDF из избранного (source=favorites) или из
+        списка покупок (source=shopping_cart). GET формирует документ
+        сразу, POST ставит задачу в очередь."""
+
+        source = request.query_params.get('source', 'favorites')
+        if source not in BOOK_SOURCES:
+            raise ValidationError(
+                {'source': f'Допустимые значения: {", ".join(BOOK_SOURCES)}.'}
+            )
+        if request.method == 'POST':
+            job = enqueue('recipe_book_pdf', request.user, source=source)
+            return Response(
+                JobSerializer(job, context={'request': request}).data,
+                status=status.HTTP_202_ACCEPTED
+            )
+        output = tempfile.TemporaryFile()
+        with tracing.span('pdf', document='recipe_book'):
+            render_recipe_book(
+                get_book_recipes(request.user, source), output
+            )
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename='recipe_book.pdf',
+            content_type='application/pdf'
+        )
+
+
+class BootstrapView(DeadlineMixin, APIView):
+    """Данные для первой отрисовки приложения одним запросом: текущий
+    пользователь, теги, первая страница рецептов и рецепты из списка
+    покупок.
+
+    Каждая часть формируется вьюсетом соответствующего эндпоинта с теми же
+    фильтрами, пагинацией и сериализаторами. Параметры запроса передаются
+    в списки рецептов. Пользователь определяется один раз, отметки
+    избранного, списка покупок и подписок загружаются один раз на весь
+    запрос."""
+
+    permission_classes = AllowAny,
+    deadlines = {'get': 1}
+
+    def get(self, request):
+        get_user_flags(request)
+        params = request.query_params
+        data = {
+            'me': None,
+            'tags': self.run(
+                TagsViewSet, 'list', request, reverse('tags-list')
+            ),
+            'recipes': self.run(
+                RecipesViewSet, 'list', request, reverse('recipes-list'),
+                params
+            ),
+            'shopping_cart': None,
+        }
+        if request.user.is_authenticated:
+            data['me'] = self.run(
+                CustomUserViewSet, 'me', request, reverse('users-me')
+            )
+            cart_params = params.copy()
+            cart_params['is_in_shopping_cart'] = '1'
+            data['shopping_cart'] = self.run(
+                RecipesViewSet, 'list', request, reverse('recipes-list'),
+                cart_params
+            )
+        return Response(data)
+
+    @staticmethod
+    def run(viewset, action, request, path, params=None):
+        """Выполнение действия вьюсета в рамках текущего запроса.
+
+        Вьюсет получает копию запроса с путем и параметрами эндпоинта,
+        поэтому ссылки пагинации указывают на сам эндпоинт."""
+
+        http_request = copy(request._request)
+        http_request.path = http_request.path_info = path
+        http_request.GET = QueryDict(mutable=True)
+        if params is not None:
+            http_request.GET.update(params)
+        http_request.META = dict(
+            http_request.META,
+            QUERY_STRING=http_request.GET.urlencode()
+        )
+        subrequest = Request(
+            http_request,
+            parsers=request.parsers,
+            authenticators=request.authenticators,
+            negotiator=request.negotiator
+        )
+        subrequest.user = request.user
+        subrequest.auth = request.auth
+        view = viewset(
+            action=action,
+            action_map={'get': action},
+            request=subrequest,
+            args=(),
+            kwargs={},
+            format_kwarg=None
+        )
+        view.initial(subrequest)
+        try:
+            return getattr(view, action)(subrequest).data
+        finally:
+            if isinstance(view, DeadlineMixin):
+                view.release_deadline()
+
+
+class SyncView(DeadlineMixin, APIView):
+    """Изменения для синхронизации клиента с локальной копией данных.
+
+    Клиент без сохраненного номера изменения запрашивает эндпоинт без
+    параметров и получает текущий token, затем загружает данные обычными
+    запросами. Дальше он передает since=<token> и получает только
+    рецепты, отметки избранного, списка покупок и подписки, измененные
+    после этого номера, вместе с идентификаторами удаленных объектов, и
+    новый token. При has_more=true запрос повторяется с новым token.
+    Если часть изменений уже удалена из журнала, возвращается 410 и
+    клиент должен загрузить данные заново."""
+
+    permission_classes = IsAuthenticated,
+    deadlines = {'get': 1}
+
+    # Вид изменения -> раздел ответа.
+    SECTIONS = {
+        Change.FAVORITE: 'favorites',
+        Change.SHOPPING_CART: 'shopping_cart',
+        Change.FOLLOW: 'subscriptions',
+    }
+
+    def get(self, request):
+        since = self.get_int_param('since', None)
+        if since is None:
+            return Response({'token': str(changes.last_token())})
+        if changes.is_expired(since):
+            return Response(
+                {'error': 'Номер изменения устарел, загрузите данные '
+                          'заново.'},
+                status=status.HTTP_410_GONE
+            )
+        limit = min(
+            self.get_int_param('limit', settings.SYNC['LIMIT']),
+            settings.SYNC['MAX_LIMIT']
+        )
+        if limit < 1:
+            raise ValidationError({'limit': 'Укажите положительное число.'})
+        changed, token, has_more = changes.read_changes(
+            request.user, since, limit
+        )
+        data = {
+            'token': str(token),
+            'has_more': has_more,
+            'recipes': self.get_recipes(changed),
+        }
+        for section in self.SECTIONS.values():
+            data[section] = {'added': [], 'deleted': []}
+        for (kind, object_id), deleted in changed.items():
+            if kind in self.SECTIONS:
+                data[self.SECTIONS[kind]][
+                    'deleted' if deleted else 'added'
+                ].append(object_id)
+        return Response(data)
+
+    def get_int_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'Укажите целое число.'})
+
+    def get_recipes(self, changed):
+        """Измененные рецепты целиком и идентификаторы удаленных."""
+
+        recipe_ids = [
+            object_id for (kind, object_id), deleted in changed.items()
+            if kind == Change.RECIPE and not deleted
+        ]
+        recipes = Recipe.objects.only(
+            *RecipeListSerializer.get_columns(None)
+        ).in_bulk(recipe_ids)
+        deleted = [
+            object_id for (kind, object_id), is_deleted in changed.items()
+            if kind == Change.RECIPE
+            and (is_deleted or object_id not in recipes)
+        ]
+        return {
+            'updated': RecipeListSerializer(
+                [recipes[pk] for pk in recipe_ids if pk in recipes],
+                many=True,
+                context={'request': self.request}
+            ).data,
+            'deleted': deleted,
+        }
+
+
+class ProfilesViewSet(ViewSet):
+    """Вьюсет для отчетов профилирования запросов (backend.profiling),
+    доступен только сотрудникам."""
+
+    permission_classes = IsAdminUser,
+    lookup_value_regex = r'[\w-]+'
+
+    def list(self, request):
+        return Response(profiling.list_reports())
+
+    def retrieve(self, request, pk):
+        report = profiling.load_report(pk)
+        if report is None:
+            return Response(
+                {'error': 'Отчет не найден.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(report)
+
+    @action(
+        detail=True,
+        methods=['GET'],
+    )
+    def download(self, request, pk):
+        """Скачивание файла отчета: ?file=pstats, stacks или sql."""
+
+        filename = profiling.REPORT_FILES.get(request.query_params.get('file'))
+        path = filename and os.path.join(
+            profiling.get_profile_path(pk), filename
+        )
+        if path is None or not os.path.isfile(path):
+            return Response(
+                {'error': 'Файл отчета не найден.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=f'{pk}-{filename}'
+        )
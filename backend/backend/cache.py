@@ -0,0 +1,262 @@
+"""Двухуровневый кэш проекта.
+
+Первый уровень - ограниченный LRU-кэш в памяти процесса с коротким сроком
+жизни, второй - общий для всех процессов кэш Django (settings.CACHES).
+Значения хранятся вместе со сроком свежести: после него значение еще
+STALE_TTL секунд отдается как устаревшее, пока один процесс пересчитывает
+его (stale-while-revalidate). Пересчет отсутствующего или устаревшего
+значения выполняет только процесс, получивший блокировку в общем кэше,
+остальные ждут результата или отдают устаревшее значение. Внутри
+процесса пересчет дополнительно защищен блокировкой потоков, между
+процессами - атомарным add() общего кэша (у файлового кэша он не
+атомарен, поэтому изредка значение может пересчитать несколько
+процессов).
+
+Ключи группируются в пространства имен с версией, увеличение версии
+(bump) делает недействительными все ключи пространства. Ключ внутри
+пространства хэшируется (make_key). Общий кэш может
+вытеснить ключ версии, поэтому новая версия начинается с текущего
+времени в наносекундах, а не с 1: после вытеснения версия не совпадет с
+прежней, и значения, записанные до bump, не вернутся.
+
+Счетчики попаданий, промахов и вытеснений ведутся в каждом процессе и
+периодически добавляются к общим счетчикам (команда cache_stats).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from time import monotonic, sleep, time, time_ns
+
+from django.conf import settings
+from django.core.cache import caches
+
+STATS = (
+    'local_hits', 'shared_hits', 'stale_hits', 'misses', 'recomputes',
+    'lock_waits', 'evictions',
+)
+STATS_KEY = 'cache-stats:{}'
+VERSION_KEY = 'cache-version:{}'
+LOCK_KEY = 'cache-lock:{}'
+# Через сколько операций счетчики процесса добавляются к общим.
+STATS_FLUSH_EVERY = 100
+LOCK_POLL_INTERVAL = 0.05
+
+
+class LocalCache:
+    """LRU-кэш в памяти процесса с ограничением количества записей."""
+
+    def __init__(self, max_entries, on_evict):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Значение или None, если записи нет или она устарела."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.on_evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache:
+    """Кэш с локальным и общим уровнями."""
+
+    def __init__(self, alias='default', options=None):
+        options = dict(settings.TWO_TIER_CACHE, **(options or {}))
+        self.alias = alias
+        self.local_ttl = options['LOCAL_TTL']
+        self.stale_ttl = options['STALE_TTL']
+        self.lock_timeout = options['LOCK_TIMEOUT']
+        self.local = LocalCache(
+            options['LOCAL_MAX_ENTRIES'],
+            lambda: self.count('evictions')
+        )
+        self.counters = dict.fromkeys(STATS, 0)
+        self.operations = 0
+        self.stats_lock = threading.Lock()
+        self.inflight = set()
+        self.inflight_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def count(self, name):
+        with self.stats_lock:
+            self.counters[name] += 1
+
+    def version(self, namespace):
+        """Текущая версия пространства имен."""
+
+        key = VERSION_KEY.format(namespace)
+        version = self.local.get(key)
+        if version is None:
+            version = self.shared.get(key)
+            if version is None:
+                version = time_ns()
+                self.shared.add(key, version, None)
+                version = self.shared.get(key, version)
+            self.local.set(key, version, self.local_ttl)
+        return version
+
+    def bump(self, namespace):
+        """Сброс всех ключей пространства имен."""
+
+        key = VERSION_KEY.format(namespace)
+        try:
+            version = self.shared.incr(key)
+        except ValueError:
+            version = time_ns()
+            self.shared.add(key, version, None)
+            version = self.shared.get(key, version)
+        self.local.set(key, version, self.local_ttl)
+        return version
+
+    def make_key(self, namespace, key):
+        """Полный ключ. Часть ключа вызывающего кода может содержать ввод
+        пользователя, поэтому хэшируется: Memcached не принимает ключи с
+        пробелами, управляющими символами и длиннее 250 символов."""
+
+        digest = hashlib.md5(str(key).encode()).hexdigest()
+        return f'{namespace}:{self.version(namespace)}:{digest}'
+
+    def get_or_set(self, namespace, key, compute, timeout):
+        """Значение из кэша или результат compute(), сохраненный на
+        timeout секунд."""
+
+        full_key = self.make_key(namespace, key)
+        value = self.local.get(full_key)
+        if value is not None:
+            self.record('local_hits')
+            return value[0]
+        entry = self.shared.get(full_key)
+        if entry is not None:
+            value, fresh_until = entry
+            if fresh_until > time():
+                self.record('shared_hits')
+                self.local.set(full_key, (value,), self.local_ttl)
+                return value
+            if not self.acquire(full_key):
+                self.record('stale_hits')
+                return value
+            return self.recompute(full_key, compute, timeout)
+        self.record('misses')
+        if self.acquire(full_key):
+            return self.recompute(full_key, compute, timeout)
+        return self.wait(full_key, compute, timeout)
+
+    def recompute(self, full_key, compute, timeout):
+        try:
+            value = compute()
+            self.shared.set(
+                full_key,
+                (value, time() + timeout),
+                timeout + self.stale_ttl
+            )
+            self.local.set(
+                full_key, (value,), min(self.local_ttl, timeout)
+            )
+        finally:
+            self.release(full_key)
+        self.record('recomputes')
+        return value
+
+    def wait(self, full_key, compute, timeout):
+        """Ожидание значения, которое пересчитывает другой процесс. Если
+        оно не появилось за LOCK_TIMEOUT, значение считается здесь."""
+
+        self.record('lock_waits')
+        deadline = monotonic() + self.lock_timeout
+        while monotonic() < deadline:
+            sleep(LOCK_POLL_INTERVAL)
+            entry = self.shared.get(full_key)
+            if entry is not None:
+                return entry[0]
+            if self.acquire(full_key):
+                return self.recompute(full_key, compute, timeout)
+        return compute()
+
+    def acquire(self, full_key):
+        """Блокировка пересчета ключа в процессе и в общем кэше."""
+
+        with self.inflight_lock:
+            if full_key in self.inflight:
+                return False
+            self.inflight.add(full_key)
+        if self.shared.add(LOCK_KEY.format(full_key), 1, self.lock_timeout):
+            return True
+        with self.inflight_lock:
+            self.inflight.discard(full_key)
+        return False
+
+    def release(self, full_key):
+        self.shared.delete(LOCK_KEY.format(full_key))
+        with self.inflight_lock:
+            self.inflight.discard(full_key)
+
+    def record(self, name):
+        self.count(name)
+        with self.stats_lock:
+            self.operations += 1
+            flush = self.operations >= STATS_FLUSH_EVERY
+        if flush:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Добавление счетчиков процесса к общим счетчикам."""
+
+        with self.stats_lock:
+            counters = self.counters
+            self.counters = dict.fromkeys(STATS, 0)
+            self.operations = 0
+        for name, value in counters.items():
+            if not value:
+                continue
+            key = STATS_KEY.format(name)
+            if not self.shared.add(key, value, None):
+                try:
+                    self.shared.incr(key, value)
+                except ValueError:
+                    self.shared.set(key, value, None)
+
+    def stats(self):
+        """Общие счетчики с учетом еще не добавленных счетчиков процесса."""
+
+        shared = self.shared.get_many(
+            [STATS_KEY.format(name) for name in STATS]
+        )
+        with self.stats_lock:
+            return {
+                name: shared.get(STATS_KEY.format(name), 0)
+                + self.counters[name]
+                for name in STATS
+            }
+
+    def reset_stats(self):
+        self.shared.delete_many([STATS_KEY.format(name) for name in STATS])
+        with self.stats_lock:
+            self.counters = dict.fromkeys(STATS, 0)
+            self.operations = 0
+
+
+cache = TwoTierCache()
@@ -0,0 +1,302 @@
+"""Профилирование отдельных запросов по требованию сотрудника.
+
+Запрос к /api/ с заголовком X-Profile или параметром profile выполняется
+под профилировщиком, если его отправил сотрудник (is_staff):
+
+- cprofile (или 1) - cProfile, отчет pstats и стеки сэмплов;
+- sampling - только сэмплирующий профилировщик: поток раз в
+  PROFILING['SAMPLE_INTERVAL'] секунд снимает стек потока запроса, запрос
+  почти не замедляется.
+
+Стеки сэмплов сохраняются в свернутом формате (collapsed stacks), по
+строке "кадр;кадр;кадр количество", его принимают flamegraph.pl и
+speedscope. Вместе с ними сохраняются SQL-запросы с параметрами и
+временем выполнения. Отчет хранится в каталоге PROFILING['DIRECTORY'],
+его идентификатор и адрес возвращаются в заголовках X-Profile-Id и
+X-Profile-Url, скачивание - api/profiles/ (только для сотрудников).
+
+Для остальных запросов промежуточный слой проверяет только путь и
+наличие заголовка или параметра в строке запроса. Флаг от пользователя,
+не являющегося сотрудником, игнорируется.
+"""
+import cProfile
+import json
+import os
+import pstats
+import shutil
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import reverse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .tracing import normalize_sql  # isort:skip
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_PARAM = 'profile'
+MODES = {
+    '1': 'cprofile',
+    'cprofile': 'cprofile',
+    'sampling': 'sampling',
+}
+# Файлы отчета.
+REPORT_FILES = {
+    'pstats': 'profile.pstats',
+    'stacks': 'stacks.folded',
+    'sql': 'sql.txt',
+}
+META_FILE = 'meta.json'
+# Количество функций с наибольшим общим временем в описании отчета.
+TOP_FUNCTIONS = 30
+
+
+def frame_label(code):
+    filename = code.co_filename
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    else:
+        filename = '/'.join(filename.split(os.sep)[-2:])
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Сэмплирующий профилировщик одного потока."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in self.stacks.items()
+        )
+
+
+class QueryRecorder:
+    """Обертка выполнения SQL-запросов (execute_wrapper), записывающая
+    запросы с параметрами и временем выполнения."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, params, many, perf_counter() - started)
+            )
+
+    def listing(self):
+        """Сводка по нормализованному тексту запросов, затем все запросы
+        по порядку выполнения."""
+
+        total = sum(duration for _, _, _, duration in self.queries)
+        groups = {}
+        for sql, _, _, duration in self.queries:
+            group = groups.setdefault(normalize_sql(sql), [0, 0])
+            group[0] += 1
+            group[1] += duration
+        lines = [
+            f'Запросов: {len(self.queries)}, {total * 1000:.2f} мс.',
+            '',
+            'По тексту запроса (количество, мс):',
+        ]
+        for sql, (count, duration) in sorted(
+            groups.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(f'{count:6} {duration * 1000:10.2f}  {sql}')
+        lines += ['', 'По порядку выполнения (мс):']
+        for number, (sql, params, many, duration) in enumerate(
+            self.queries, 1
+        ):
+            lines.append(f'{number}. {duration * 1000:.2f}')
+            lines.append(sql)
+            if params:
+                lines.append(
+                    f'-- {"executemany, " if many else ""}параметры: '
+                    f'{params!r}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+def get_profile_path(profile_id):
+    return os.path.join(settings.PROFILING['DIRECTORY'], profile_id)
+
+
+def top_functions(profile):
+    """Функции с наибольшим общим временем для описания отчета."""
+
+    stats = pstats.Stats(profile).stats
+    top = sorted(stats.items(), key=lambda item: -item[1][3])
+    return [
+        {
+            'function': f'{function} ({filename}:{line})',
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+        }
+        for (filename, line, function), (_, calls, own, total, _) in top[
+            :TOP_FUNCTIONS
+        ]
+    ]
+
+
+def save_report(meta, profile, sampler, recorder):
+    """Сохранение отчета и удаление старых отчетов сверх
+    PROFILING['MAX_PROFILES']."""
+
+    path = get_profile_path(meta['id'])
+    os.makedirs(path)
+    if profile is not None:
+        profile.dump_stats(os.path.join(path, REPORT_FILES['pstats']))
+        meta['top_functions'] = top_functions(profile)
+    with open(
+        os.path.join(path, REPORT_FILES['stacks']), 'w', encoding='UTF-8'
+    ) as file:
+        file.write(sampler.collapsed())
+    with open(
+        os.path.join(path, REPORT_FILES['sql']), 'w', encoding='UTF-8'
+    ) as file:
+        file.write(recorder.listing())
+    with open(os.path.join(path, META_FILE), 'w', encoding='UTF-8') as file:
+        json.dump(meta, file, ensure_ascii=False, indent=2)
+    reports = sorted(os.listdir(settings.PROFILING['DIRECTORY']))
+    for name in reports[:-settings.PROFILING['MAX_PROFILES']]:
+        shutil.rmtree(get_profile_path(name), ignore_errors=True)
+
+
+def list_reports():
+    """Описания сохраненных отчетов, новые первыми."""
+
+    directory = settings.PROFILING['DIRECTORY']
+    if not os.path.isdir(directory):
+        return []
+    reports = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        meta = load_report(name)
+        if meta is not None:
+            meta.pop('top_functions', None)
+            reports.append(meta)
+    return reports
+
+
+def load_report(profile_id):
+    try:
+        with open(
+            os.path.join(get_profile_path(profile_id), META_FILE),
+            encoding='UTF-8'
+        ) as file:
+            return json.load(file)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class ProfilingMiddleware:
+    """Профилирование запроса по флагу сотрудника. Подключается после
+    AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/') or (
+            HEADER not in request.META
+            and f'{QUERY_PARAM}=' not in request.META.get('QUERY_STRING', '')
+        ):
+            return self.get_response(request)
+        mode = MODES.get(
+            request.META.get(HEADER) or request.GET.get(QUERY_PARAM, '')
+        )
+        if (
+            mode is None
+            or not settings.PROFILING['ENABLED']
+            or not self.is_staff(request)
+        ):
+            return self.get_response(request)
+        return self.profile(request, mode)
+
+    @staticmethod
+    def is_staff(request):
+        """Сотрудник по токену или сессии. Ошибка аутентификации не
+        прерывает запрос: ее вернет представление."""
+
+        try:
+            authenticated = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        user = authenticated[0] if authenticated else request.user
+        return user.is_active and user.is_staff
+
+    def profile(self, request, mode):
+        started = datetime.now()
+        meta = {
+            'id': f'{started:%Y%m%d-%H%M%S}-{uuid4().hex[:8]}',
+            'created': started.isoformat(timespec='seconds'),
+            'mode': mode,
+            'method': request.method,
+            'path': request.get_full_path(),
+        }
+        recorder = QueryRecorder()
+        sampler = StackSampler(
+            threading.get_ident(), settings.PROFILING['SAMPLE_INTERVAL']
+        )
+        profile = cProfile.Profile() if mode == 'cprofile' else None
+        timer = perf_counter()
+        sampler.start()
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(recorder):
+                if profile is None:
+                    response = self.get_response(request)
+                else:
+                    response = profile.runcall(self.get_response, request)
+        finally:
+            sampler.stop()
+        meta.update({
+            'status': response.status_code,
+            'duration_ms': round((perf_counter() - timer) * 1000, 3),
+            'samples': sum(sampler.stacks.values()),
+            'sql_count': len(recorder.queries),
+            'sql_ms': round(sum(
+                duration for _, _, _, duration in recorder.queries
+            ) * 1000, 3),
+            'files': [
+                name for name in REPORT_FILES
+                if profile is not None or name != 'pstats'
+            ],
+        })
+        save_report(meta, profile, sampler, recorder)
+        response['X-Profile-Id'] = meta['id']
+        response['X-Profile-Url'] = request.build_absolute_uri(
+            reverse('profiles-detail', args=[meta['id']])
+        )
+        return response
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -39,18 +40,22 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
+    'jobs.apps.JobsConfig',
     'colorfield',
 ]
 
 MIDDLEWARE = [
+    'backend.tracing.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'backend.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.tracing.ViewTracingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -80,10 +85,66 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Соединение, открытое при прогреве рабочего процесса, используется
+        # запросами, а не открывается заново для каждого.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
     }
 }
 
+# Общий для процессов кэш. По умолчанию - файловый, в продакшене можно
+# указать Memcached или Redis-совместимый бэкенд (например,
+# django_redis.cache.RedisCache) и его адрес.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.filebased.FileBasedCache'
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'TIMEOUT': 300,
+        # Файловый и локальный кэши удаляют треть записей при превышении
+        # MAX_ENTRIES (по умолчанию 300). Бэкендам Memcached OPTIONS
+        # передаются клиенту, поэтому для них не задаются.
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv('CACHE_MAX_ENTRIES', default=20000)
+            ),
+        } if CACHE_BACKEND.endswith(('FileBasedCache', 'LocMemCache')) else {},
+    }
+}
+
+# Двухуровневый кэш (backend.cache): размер и срок жизни кэша процесса,
+# срок отдачи устаревших значений и время блокировки пересчета, с.
+TWO_TIER_CACHE = {
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_TTL': 5,
+    'STALE_TTL': 60,
+    'LOCK_TIMEOUT': 10,
+}
+
+# Количество объектов в постраничных списках: срок кэширования, с, и
+# порог оценки планировщика PostgreSQL, выше которого точное количество не
+# считается (0 - всегда считать точно).
+PAGINATION_COUNT = {
+    'TIMEOUT': 300,
+    'ESTIMATE_THRESHOLD': int(
+        os.getenv('PAGINATION_ESTIMATE_THRESHOLD', default=100000)
+    ),
+}
+
+# Бюджеты времени обработки запросов (api.deadlines): SCALE умножает
+# бюджеты всех вьюсетов, RETRY_AFTER - значение заголовка Retry-After, с.
+DEADLINES = {
+    'ENABLED': os.getenv('DEADLINES_ENABLED', default='1') == '1',
+    'SCALE': float(os.getenv('DEADLINES_SCALE', default=1)),
+    'RETRY_AFTER': 5,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -122,7 +183,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.tracing.TracingTokenAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -149,6 +210,102 @@ DJOSER = {
     },
 }
 
+TRENDING = {
+    'HALF_LIFE_HOURS': int(os.getenv('TRENDING_HALF_LIFE_HOURS', default=72)),
+    'WEIGHTS': {
+        'favorite': 1.0,
+        'shopping_cart': 0.5,
+    },
+    'MIN_SCORE': 0.01,
+}
+
+PANTRY_INDEX_TTL = int(os.getenv('PANTRY_INDEX_TTL', default=600))
+
+# Поиск ингредиентов с опечатками (api.ingredient_search): минимальное
+# сходство по триграммам, надбавка за совпадение начала названия,
+# наибольшее количество результатов и срок жизни индекса в памяти, с.
+INGREDIENT_SEARCH = {
+    'THRESHOLD': float(
+        os.getenv('INGREDIENT_SEARCH_THRESHOLD', default=0.3)
+    ),
+    'PREFIX_BOOST': 0.5,
+    'LIMIT': int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=20)),
+    'INDEX_TTL': int(os.getenv('INGREDIENT_SEARCH_INDEX_TTL', default=600)),
+}
+
+SYNC = {
+    'RETENTION_DAYS': int(os.getenv('SYNC_RETENTION_DAYS', default=30)),
+    'LIMIT': 500,
+    'MAX_LIMIT': 1000,
+    'LAG_SECONDS': 2,
+}
+
+# Книга рецептов (api.pdf): процессы пула фоновой задачи, наименьшее
+# количество рецептов для пула, размер и качество картинок.
+RECIPE_BOOK = {
+    'WORKERS': int(os.getenv('RECIPE_BOOK_WORKERS', default=4)),
+    'MIN_PARALLEL': 8,
+    'IMAGE_SIZE': 800,
+    'IMAGE_QUALITY': 80,
+}
+
+# Картинки рецептов (api.uploads): наибольший размер файла, байт, и
+# наибольшее количество точек.
+RECIPE_IMAGE = {
+    'MAX_SIZE': int(os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 2 ** 20)),
+    'MAX_PIXELS': 40 * 10 ** 6,
+}
+
+# Трассировка запросов (backend.tracing): доля трассируемых запросов,
+# порог времени, с, и файл журнала медленных запросов, наибольшее
+# количество спанов в трассе и экспортеры трасс.
+TRACING = {
+    'ENABLED': os.getenv('TRACING_ENABLED', default='0') == '1',
+    'SAMPLE_RATE': float(os.getenv('TRACING_SAMPLE_RATE', default=0.1)),
+    'SLOW_THRESHOLD': float(
+        os.getenv('TRACING_SLOW_THRESHOLD', default=0.5)
+    ),
+    'SLOW_LOG': os.getenv(
+        'TRACING_SLOW_LOG',
+        default=os.path.join(BASE_DIR, 'slow_requests.jsonl')
+    ),
+    'MAX_SPANS': 2000,
+    'EXPORTERS': [
+        {
+            'CLASS': 'backend.tracing.FileSpanExporter',
+            'OPTIONS': {'path': os.getenv('TRACING_SPANS_FILE')},
+        },
+    ] if os.getenv('TRACING_SPANS_FILE') else [],
+}
+
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', default='1') == '1',
+    'DIRECTORY': os.getenv(
+        'PROFILING_DIRECTORY', default=os.path.join(BASE_DIR, 'profiles')
+    ),
+    'SAMPLE_INTERVAL': float(
+        os.getenv('PROFILING_SAMPLE_INTERVAL', default=0.005)
+    ),
+    'MAX_PROFILES': int(os.getenv('PROFILING_MAX_PROFILES', default=100)),
+}
+
+# Прогрев процессов gunicorn (backend.warmup): запросы, которые
+# выполняет каждый рабочий процесс после создания.
+WARMUP = {
+    'ENABLED': os.getenv('WARMUP_ENABLED', default='1') == '1',
+    'PATHS': (
+        '/api/tags/',
+        '/api/ingredients/',
+        '/api/recipes/',
+    ),
+}
+
+JOBS = {
+    'RESULT_TTL_HOURS': int(os.getenv('JOBS_RESULT_TTL_HOURS', default=24)),
+    'TIMEOUT': int(os.getenv('JOBS_TIMEOUT', default=600)),
+    'MAX_ATTEMPTS': 3,
+}
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
@@ -0,0 +1,323 @@
+"""Трассировка запросов.
+
+Для доли запросов settings.TRACING['SAMPLE_RATE'] строится дерево
+спанов: весь запрос (TracingMiddleware), промежуточные слои до вызова
+представления, представление и действие (ViewTracingMiddleware),
+аутентификация (TracingTokenAuthentication), вызовы
+SerializerMethodField (TracedMethodField), SQL-запросы с нормализованным
+текстом и участки, отмеченные span(), например формирование PDF.
+
+Законченная трасса передается экспортерам из TRACING['EXPORTERS'].
+Интерфейс SpanExporter повторяет SpanExporter OpenTelemetry SDK
+(export() и shutdown()), а спаны имеют поля OTLP, поэтому экспортер в
+коллектор OpenTelemetry подключается без изменения остального кода.
+FileSpanExporter записывает спаны в файл JSON lines.
+
+Трассы запросов дольше TRACING['SLOW_THRESHOLD'] секунд записываются в
+журнал медленных запросов TRACING['SLOW_LOG'] (JSON lines, по строке на
+запрос с деревом спанов).
+
+Без трассы span() ничего не делает, поэтому отметки в коде не
+замедляют запросы, не попавшие в выборку.
+"""
+import json
+import random
+import re
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import urandom
+from time import time_ns
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.authentication import TokenAuthentication
+
+current_span = ContextVar('current_span', default=None)
+
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+SQL_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+SQL_SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Текст SQL-запроса без значений: литералы и параметры заменяются на
+    ?, списки параметров IN сворачиваются в (...)."""
+
+    sql = SQL_LITERAL.sub('?', sql)
+    sql = SQL_LIST.sub('(...)', sql)
+    return SQL_SPACES.sub(' ', sql.replace('%s', '?')).strip()
+
+
+class Span:
+    """Участок обработки запроса."""
+
+    __slots__ = (
+        'trace', 'span_id', 'parent', 'name', 'start', 'end', 'attributes',
+    )
+
+    def __init__(self, trace, name, parent=None, start=None, **attributes):
+        self.trace = trace
+        self.span_id = urandom(8).hex()
+        self.parent = parent
+        self.name = name
+        self.start = time_ns() if start is None else start
+        self.end = None
+        self.attributes = attributes
+
+    @property
+    def duration(self):
+        return ((self.end or time_ns()) - self.start) / 1e9
+
+    def finish(self, end=None):
+        self.end = time_ns() if end is None else end
+
+    def to_otlp(self):
+        """Спан в виде словаря с полями OTLP."""
+
+        return {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent.span_id if self.parent else '',
+            'name': self.name,
+            'startTimeUnixNano': self.start,
+            'endTimeUnixNano': self.end,
+            'attributes': self.attributes,
+        }
+
+
+class Trace:
+    """Спаны одного запроса. Количество спанов ограничено
+    TRACING['MAX_SPANS'], остальные только подсчитываются."""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = urandom(16).hex()
+        self.spans = []
+        self.dropped = 0
+        self.root = self.add(name, None, **attributes)
+
+    def add(self, name, parent, start=None, **attributes):
+        if len(self.spans) >= settings.TRACING['MAX_SPANS']:
+            self.dropped += 1
+            return None
+        span = Span(self, name, parent, start, **attributes)
+        self.spans.append(span)
+        return span
+
+    def to_tree(self):
+        """Дерево спанов для журнала медленных запросов."""
+
+        children = {}
+        for span in self.spans[1:]:
+            children.setdefault(span.parent.span_id, []).append(span)
+
+        def node(span):
+            result = {
+                'name': span.name,
+                'start_ms': round((span.start - self.root.start) / 1e6, 3),
+                'duration_ms': round(span.duration * 1000, 3),
+            }
+            if span.attributes:
+                result['attributes'] = span.attributes
+            if span.span_id in children:
+                result['children'] = [
+                    node(child) for child in children[span.span_id]
+                ]
+            return result
+
+        return node(self.root)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Участок кода как дочерний спан текущего. Вне трассы ничего не
+    делает."""
+
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.add(name, parent, **attributes)
+    if child is None:
+        yield None
+        return
+    token = current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        current_span.reset(token)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """Обертка выполнения SQL-запросов (execute_wrapper) со спаном на
+    запрос."""
+
+    with span(
+        'sql',
+        **{
+            'db.system': context['connection'].vendor,
+            'db.statement': normalize_sql(sql),
+            'db.many': many,
+        }
+    ):
+        return execute(sql, params, many, context)
+
+
+class SpanExporter(ABC):
+    """Интерфейс экспорта законченных трасс."""
+
+    @abstractmethod
+    def export(self, spans):
+        """Экспорт законченных спанов одной трассы."""
+
+    def shutdown(self):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Запись спанов в файл JSON lines, по строке на спан."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(
+            json.dumps(span.to_otlp(), ensure_ascii=False, default=str)
+            + '\n'
+            for span in spans
+        )
+        with self.lock, open(self.path, 'a', encoding='UTF-8') as file:
+            file.write(lines)
+
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters():
+    """Экспортеры из TRACING['EXPORTERS'], создаются один раз на процесс."""
+
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            _exporters = [
+                import_string(exporter['CLASS'])(
+                    **exporter.get('OPTIONS', {})
+                )
+                for exporter in settings.TRACING['EXPORTERS']
+            ]
+    return _exporters
+
+
+_slow_log_lock = threading.Lock()
+
+
+def write_slow_log(trace):
+    sql = [span for span in trace.spans if span.name == 'sql']
+    record = {
+        'time': round(trace.root.start / 1e9, 3),
+        'trace_id': trace.trace_id,
+        'duration_ms': round(trace.root.duration * 1000, 3),
+        'sql_count': len(sql),
+        'sql_ms': round(sum(span.duration for span in sql) * 1000, 3),
+        'dropped_spans': trace.dropped,
+        'spans': trace.to_tree(),
+    }
+    line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+    with _slow_log_lock, open(
+        settings.TRACING['SLOW_LOG'], 'a', encoding='UTF-8'
+    ) as file:
+        file.write(line)
+
+
+def finish_trace(trace):
+    """Экспорт законченной трассы и запись медленного запроса."""
+
+    options = settings.TRACING
+    for exporter in get_exporters():
+        exporter.export(trace.spans)
+    if options['SLOW_LOG'] and trace.root.duration > options[
+        'SLOW_THRESHOLD'
+    ]:
+        write_slow_log(trace)
+
+
+class TracingMiddleware:
+    """Трасса запроса. Подключается первым промежуточным слоем."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.TRACING
+        if not options['ENABLED'] or random.random() >= options[
+            'SAMPLE_RATE'
+        ]:
+            return self.get_response(request)
+        trace = Trace(
+            f'{request.method} {request.path}',
+            **{'http.method': request.method, 'http.target': request.path}
+        )
+        token = current_span.set(trace.root)
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(sql_wrapper):
+                response = self.get_response(request)
+            trace.root.attributes['http.status_code'] = response.status_code
+            return response
+        finally:
+            trace.root.finish()
+            current_span.reset(token)
+            finish_trace(trace)
+
+
+class ViewTracingMiddleware:
+    """Спаны промежуточных слоев до вызова представления и самого
+    представления. Подключается последним промежуточным слоем."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        root = current_span.get()
+        if root is None:
+            return self.get_response(request)
+        root.trace.add('middleware', root, start=root.start).finish()
+        with span('view') as view:
+            request.view_span = view
+            return self.get_response(request)
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        view = getattr(request, 'view_span', None)
+        if view is None:
+            return
+        view_class = getattr(view_func, 'cls', None)
+        name = view_class.__name__ if view_class else view_func.__qualname__
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        view.name = f'{name}.{action}' if action else name
+        match = request.resolver_match
+        if match is not None and match.view_name:
+            view.trace.root.attributes['http.route'] = match.view_name
+
+
+class TracingTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену со спаном."""
+
+    def authenticate(self, request):
+        with span('authentication'):
+            return super().authenticate(request)
+
+
+class TracedMethodField(serializers.SerializerMethodField):
+    """SerializerMethodField, вызов метода которого записывается как
+    спан."""
+
+    def to_representation(self, value):
+        with span(f'{type(self.parent).__name__}.{self.method_name}'):
+            return super().to_representation(value)
@@ -0,0 +1,165 @@
+"""Прогрев процессов gunicorn (gunicorn.conf.py).
+
+Главный процесс до создания рабочих импортирует тяжелые модули и
+приложение, загружает маршруты (вместе с ними - все представления,
+djoser и DRF), регистрирует шрифт PDF, загружает модули форматов Pillow
+и строит индексы в памяти, затем закрывает соединения с базой. Рабочие
+процессы наследуют все это при fork, в том числе после перезапуска по
+max_requests. Рабочий процесс после создания открывает соединение с
+базой, обновляет индексы, если они устарели, и выполняет запросы к
+WARMUP['PATHS'], заполняя свой уровень кэша справочников и прогревая
+сериализаторы.
+
+Каждый шаг выполняется отдельно: ошибка шага (например, база еще не
+доступна) записывается в отчет и не мешает запуску, невыполненная
+работа будет сделана при первом запросе, как без прогрева.
+"""
+import importlib
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+# Модули, не зависящие от настроек Django, импорт которых заметно
+# замедляет первый запрос.
+HEAVY_MODULES = (
+    'numpy',
+    'PIL.Image',
+    'reportlab.pdfgen.canvas',
+    'reportlab.pdfbase.ttfonts',
+    'reportlab.lib.utils',
+)
+
+
+class Timings:
+    """Время выполнения шагов прогрева."""
+
+    def __init__(self, process):
+        self.process = process
+        self.started = perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        started = perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as exception:
+            error = f'{type(exception).__name__}: {exception}'
+        self.steps.append((name, perf_counter() - started, error))
+
+    def __str__(self):
+        total = (perf_counter() - self.started) * 1000
+        steps = ', '.join(
+            f'{name} {seconds * 1000:.0f} мс'
+            + (f' (ошибка: {error})' if error else '')
+            for name, seconds, error in self.steps
+        )
+        return f'Прогрев ({self.process}) за {total:.0f} мс: {steps}.'
+
+
+def import_modules(timings):
+    for module in HEAVY_MODULES:
+        with timings.step(f'import {module}'):
+            importlib.import_module(module)
+
+
+def setup_django(timings):
+    with timings.step('django.setup'):
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        import django
+        django.setup()
+    with timings.step('wsgi'):
+        importlib.import_module('backend.wsgi')
+
+
+def load_urls(timings):
+    from django.urls import reverse
+
+    with timings.step('маршруты'):
+        reverse('api-root')
+
+
+def load_resources(timings):
+    from PIL import Image
+
+    from api.pdf import register_fonts  # isort:skip
+
+    with timings.step('шрифты'):
+        register_fonts()
+    with timings.step('форматы Pillow'):
+        Image.init()
+
+
+def build_indexes(timings):
+    from django.db import connection
+
+    from api.ingredient_search import trigram_index  # isort:skip
+    from api.pantry import pantry_index  # isort:skip
+
+    with timings.step('индекс кладовой'):
+        pantry_index.ensure_fresh()
+    # В PostgreSQL поиск с опечатками выполняется индексом pg_trgm.
+    if connection.vendor != 'postgresql':
+        with timings.step('триграммный индекс'):
+            trigram_index.ensure_fresh()
+
+
+def connect_databases(timings):
+    from django.db import connections
+
+    for connection in connections.all():
+        with timings.step(f'соединение {connection.alias}'):
+            connection.ensure_connection()
+
+
+def request_paths(timings):
+    """Запросы к WARMUP['PATHS'] без промежуточных слоев от имени
+    анонимного пользователя."""
+
+    from urllib.parse import urlsplit
+
+    from django.conf import settings
+    from django.test import RequestFactory
+    from django.urls import resolve
+
+    factory = RequestFactory()
+    for path in settings.WARMUP['PATHS']:
+        with timings.step(path):
+            match = resolve(urlsplit(path).path)
+            response = match.func(
+                factory.get(path), *match.args, **match.kwargs
+            )
+            if hasattr(response, 'render'):
+                response.render()
+
+
+def warm_up_master():
+    """Прогрев главного процесса до создания рабочих."""
+
+    timings = Timings('главный процесс')
+    import_modules(timings)
+    setup_django(timings)
+    from django.conf import settings
+    from django.db import connections
+
+    if settings.WARMUP['ENABLED']:
+        load_urls(timings)
+        load_resources(timings)
+        build_indexes(timings)
+        # Соединения не должны наследоваться рабочими процессами.
+        connections.close_all()
+    return timings
+
+
+def warm_up_worker():
+    """Прогрев рабочего процесса после создания."""
+
+    from django.conf import settings
+
+    timings = Timings(f'рабочий процесс {os.getpid()}')
+    if settings.WARMUP['ENABLED']:
+        connect_databases(timings)
+        build_indexes(timings)
+        request_paths(timings)
+    return timings
@@ -0,0 +1,19 @@
+"""Настройки gunicorn с прогревом процессов (backend.warmup)."""
+import os
+
+from backend import warmup  # isort:skip
+
+bind = os.getenv('GUNICORN_BIND', default='0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', default=3))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', default=0))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    # Вызывается в главном процессе до создания рабочих: рабочие процессы
+    # наследуют импортированные модули, шрифты и индексы.
+    server.log.info(str(warmup.warm_up_master()))
+
+
+def post_fork(server, worker):
+    worker.log.info(str(warmup.warm_up_worker()))
@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = 'id', 'kind', 'user', 'status', 'attempts', 'created',
+    list_select_related = 'user',
+    list_filter = 'status', 'kind',
+    search_fields = 'user__username', 'user__email',
+    readonly_fields = (
+        'user', 'kind', 'params', 'attempts', 'worker', 'result', 'filename',
+        'error', 'created', 'started', 'finished', 'expires',
+    )
+    empty_value_display = 'пусто'
+    show_full_result_count = False
@@ -0,0 +1,122 @@
+import os
+import signal
+import socket
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from time import monotonic, sleep
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from jobs.worker import (claim, delete_expired, execute,  # isort:skip
+                         requeue_stale)  # isort:skip
+
+# Как часто возвращать в очередь зависшие задачи и удалять устаревшие.
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    """
+    Обработчик фоновых задач из таблицы Job.
+
+    Задачи выполняются пулом потоков или, с флагом --processes, пулом
+    процессов. Новые задачи захватываются, только когда в пуле есть
+    свободные места. Периодически зависшие задачи возвращаются в очередь,
+    а задачи с истекшим сроком хранения удаляются вместе с результатами.
+    Команда завершается по SIGTERM или SIGINT, дожидаясь запущенных задач.
+    """
+
+    help = 'Обработка фоновых задач.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Количество одновременно выполняемых задач.'
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Выполнять задачи в отдельных процессах, а не в потоках.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Пауза между проверками очереди, с.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить задачи, стоящие в очереди, и завершиться.'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('Параметр --workers должен быть больше нуля.')
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.processes = options['processes']
+        pool = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        self.stdout.write(
+            f'Обработчик {self.worker}: {workers} '
+            f'{"процессов" if self.processes else "потоков"}.'
+        )
+        with pool(max_workers=workers) as executor:
+            self.loop(executor, workers, options)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def loop(self, executor, workers, options):
+        running = set()
+        maintained = None
+        while not self.stopping:
+            if maintained is None or (
+                monotonic() - maintained > MAINTENANCE_INTERVAL
+            ):
+                self.maintain()
+                maintained = monotonic()
+            claimed = claim(self.worker, workers - len(running))
+            if claimed and self.processes:
+                # Дочерние процессы не должны наследовать открытое
+                # соединение с базой.
+                connections.close_all()
+            for job_id in claimed:
+                running.add(executor.submit(execute, job_id))
+            if options['once'] and not running:
+                break
+            if running:
+                done, running = wait(
+                    running,
+                    timeout=options['poll_interval'],
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    self.report(future)
+            else:
+                sleep(options['poll_interval'])
+        for future in running:
+            self.report(future)
+
+    def maintain(self):
+        requeued, failed = requeue_stale()
+        deleted = delete_expired()
+        if requeued or failed or deleted:
+            self.stdout.write(
+                f'Возвращено в очередь: {requeued}, завершено с ошибкой: '
+                f'{failed}, удалено устаревших: {deleted}.'
+            )
+
+    def report(self, future):
+        try:
+            succeeded = future.result()
+        except Exception as error:
+            self.stderr.write(f'Ошибка обработчика: {error}')
+            return
+        self.stdout.write('Задача выполнена.' if succeeded else
+                          'Задача завершилась с ошибкой.')
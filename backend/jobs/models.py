@@ -0,0 +1,105 @@
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class Job(models.Model):
+    """Класс описывающий фоновую задачу."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='Пользователь',
+    )
+    kind = models.CharField(
+        'Вид задачи',
+        max_length=50,
+    )
+    params = models.JSONField(
+        'Параметры',
+        default=dict,
+        blank=True,
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=10,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Количество запусков',
+        default=0,
+    )
+    worker = models.CharField(
+        'Обработчик',
+        max_length=100,
+        blank=True,
+    )
+    result = models.FileField(
+        'Результат',
+        upload_to='jobs/',
+        blank=True,
+    )
+    filename = models.CharField(
+        'Имя файла результата',
+        max_length=255,
+        blank=True,
+    )
+    error = models.TextField(
+        'Ошибка',
+        blank=True,
+    )
+    created = models.DateTimeField(
+        'Дата создания',
+        default=timezone.now,
+    )
+    started = models.DateTimeField(
+        'Дата запуска',
+        null=True,
+        blank=True,
+    )
+    finished = models.DateTimeField(
+        'Дата завершения',
+        null=True,
+        blank=True,
+    )
+    expires = models.DateTimeField(
+        'Срок хранения результата',
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = '-created',
+        indexes = [
+            models.Index(
+                fields=['status', 'created'],
+                name='job_status_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} ({self.get_status_display()})'
@@ -0,0 +1,28 @@
+"""Реестр обработчиков фоновых задач.
+
+Обработчик регистрируется декоратором register с видом задачи, получает
+объект Job и возвращает имя файла результата и его содержимое (File или
+ContentFile). Задача ставится в очередь функцией enqueue и выполняется
+командой run_jobs.
+"""
+from .models import Job  # isort:skip
+
+HANDLERS = {}
+
+
+def register(kind):
+    """Регистрация обработчика задач вида kind."""
+
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+
+    return decorator
+
+
+def enqueue(kind, user, **params):
+    """Постановка задачи в очередь."""
+
+    if kind not in HANDLERS:
+        raise ValueError(f'Неизвестный вид задачи: {kind}.')
+    return Job.objects.create(kind=kind, user=user, params=params)
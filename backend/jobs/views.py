@@ -0,0 +1,42 @@
+from django.http import FileResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.viewsets import ReadOnlyModelViewSet
+
+from api.paginations import CustomPageNumberPagination  # isort:skip
+from api.serializers import JobSerializer  # isort:skip
+
+from .models import Job  # isort:skip
+
+
+class JobViewSet(ReadOnlyModelViewSet):
+    """Вьюсет для просмотра фоновых задач пользователя и получения их
+    результатов."""
+
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CustomPageNumberPagination
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(
+        detail=True,
+        methods=['GET'],
+    )
+    def result(self, request, pk):
+        """Скачивание результата выполненной задачи."""
+
+        job = self.get_object()
+        if job.status != Job.DONE or not job.result:
+            return Response(
+                {'error': 'Результат задачи недоступен.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(
+            job.result.open('rb'),
+            as_attachment=True,
+            filename=job.filename
+        )
@@ -0,0 +1,115 @@
+"""Захват и выполнение фоновых задач.
+
+Очередь хранится в таблице Job. Задача захватывается условным UPDATE
+(статус меняется с pending на running только одним обработчиком), поэтому
+несколько команд run_jobs могут работать с одной базой без брокера.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job  # isort:skip
+from .registry import HANDLERS  # isort:skip
+
+logger = logging.getLogger(__name__)
+
+
+def claim(worker, limit):
+    """Захват до limit задач из очереди, возвращает их идентификаторы."""
+
+    candidates = Job.objects.filter(status=Job.PENDING).order_by(
+        'created'
+    ).values_list('id', flat=True)[:limit * 2]
+    claimed = []
+    for job_id in candidates:
+        updated = Job.objects.filter(id=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING,
+            worker=worker,
+            started=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if updated:
+            claimed.append(job_id)
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def finish(job, **fields):
+    """Сохранение итога задачи, если она все еще принадлежит обработчику."""
+
+    now = timezone.now()
+    return Job.objects.filter(
+        id=job.id, status=Job.RUNNING, worker=job.worker
+    ).update(
+        finished=now,
+        expires=now + timedelta(hours=settings.JOBS['RESULT_TTL_HOURS']),
+        **fields
+    )
+
+
+def execute(job_id):
+    """Выполнение захваченной задачи. Вызывается в потоке или процессе
+    обработчика."""
+
+    try:
+        job = Job.objects.get(id=job_id)
+        try:
+            filename, content = HANDLERS[job.kind](job)
+            job.result.save(
+                f'{job.id}{os.path.splitext(filename)[1]}',
+                content,
+                save=False
+            )
+        except Exception as error:
+            logger.exception('Ошибка выполнения задачи %s', job_id)
+            finish(job, status=Job.FAILED, error=str(error))
+            return False
+        if not finish(job, status=Job.DONE, result=job.result.name,
+                      filename=filename):
+            job.result.delete(save=False)
+        return True
+    finally:
+        connection.close()
+
+
+def requeue_stale():
+    """Возврат в очередь задач, обработчик которых не завершил их за
+    отведенное время, или завершение с ошибкой после исчерпания попыток."""
+
+    deadline = timezone.now() - timedelta(seconds=settings.JOBS['TIMEOUT'])
+    stale = Job.objects.filter(status=Job.RUNNING, started__lt=deadline)
+    failed = stale.filter(
+        attempts__gte=settings.JOBS['MAX_ATTEMPTS']
+    ).update(
+        status=Job.FAILED,
+        error='Превышено время выполнения.',
+        finished=timezone.now(),
+        expires=timezone.now() + timedelta(
+            hours=settings.JOBS['RESULT_TTL_HOURS']
+        )
+    )
+    requeued = stale.update(status=Job.PENDING, worker='')
+    return requeued, failed
+
+
+def delete_expired(batch_size=100):
+    """Удаление задач с истекшим сроком хранения вместе с результатами."""
+
+    deleted = 0
+    while True:
+        jobs = list(Job.objects.filter(
+            expires__lt=timezone.now()
+        ).only('id', 'result')[:batch_size])
+        if not jobs:
+            return deleted
+        for job in jobs:
+            if job.result:
+                job.result.delete(save=False)
+        Job.objects.filter(id__in=[job.id for job in jobs]).delete()
+        deleted += len(jobs)
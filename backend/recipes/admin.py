@@ -2,58 +2,89 @@ from django.contrib import admin
 
 from .models import (Favorite, Ingredient, IngredientAmount, Recipe,
                      ShoppingCart, Tag)
+from .signals import recipe_changed
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = 'id', 'name', 'measurement_unit',
-    list_filter = 'name',
+    list_filter = 'measurement_unit',
     search_fields = 'name',
     empty_value_display = 'пусто'
+    show_full_result_count = False
 
 
 @admin.register(IngredientAmount)
 class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = 'id', 'ingredient', 'recipe', 'amount',
+    list_select_related = 'ingredient', 'recipe',
+    search_fields = 'recipe__name',
+    autocomplete_fields = 'ingredient', 'recipe',
     empty_value_display = 'пусто'
+    show_full_result_count = False
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = 'id', 'name', 'slug',
+    search_fields = 'name', 'slug',
     empty_value_display = 'пусто'
 
 
 class IngredientAmountInLine(admin.StackedInline):
     model = IngredientAmount
     extra = 4
+    autocomplete_fields = 'ingredient',
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = 'id', 'name', 'author', 'amount_ingredients', 'amount_tags',
     list_display_links = 'id', 'name',
-    list_filter = 'name', 'author', 'tags',
-    search_fields = 'name',
+    list_select_related = 'author',
+    list_filter = 'tags',
+    search_fields = 'name', 'author__username', 'author__email',
+    autocomplete_fields = 'author',
     empty_value_display = 'пусто'
+    show_full_result_count = False
     inlines = [IngredientAmountInLine]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'ingredients',
+            'tags'
+        )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipe_changed.send(sender=Recipe, recipe=form.instance)
+
     @staticmethod
     def amount_ingredients(obj):
-        return '\n'.join(list(obj.ingredients.values_list('name', flat=True)))
+        return '\n'.join(
+            ingredient.name for ingredient in obj.ingredients.all()
+        )
 
     @staticmethod
     def amount_tags(obj):
-        return '\n'.join(list(obj.tags.values_list('name', flat=True)))
+        return '\n'.join(tag.name for tag in obj.tags.all())
 
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = 'id', 'user', 'recipe',
+    list_select_related = 'user', 'recipe',
+    search_fields = 'user__username', 'user__email', 'recipe__name',
+    autocomplete_fields = 'user', 'recipe',
     empty_value_display = 'пусто'
+    show_full_result_count = False
 
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = 'id', 'user', 'recipe',
+    list_select_related = 'user', 'recipe',
+    search_fields = 'user__username', 'user__email', 'recipe__name',
+    autocomplete_fields = 'user', 'recipe',
     empty_value_display = 'пусто'
+    show_full_result_count = False
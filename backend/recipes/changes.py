@@ -0,0 +1,126 @@
+"""Журнал изменений для синхронизации клиентов (см. /api/sync/).
+
+Изменения рецептов записываются при пересоздании их карточек, то есть
+при любом изменении представления рецепта, добавление и удаление
+избранного, списка покупок и подписок - сигналами (см. recipes.signals).
+
+Номер изменения - автоинкрементный идентификатор записи, а клиенты
+читают журнал по возрастанию номера. Чтобы номера шли в порядке
+фиксации изменений, записи добавляются после фиксации транзакции,
+изменившей данные (transaction.on_commit), отдельным коротким запросом:
+более поздний номер не может стать видимым раньше меньшего дольше, чем
+на время одной вставки, и SYNC['LAG_SECONDS'] покрывает этот интервал
+независимо от длительности исходной транзакции. Изменение из транзакции,
+после фиксации которой процесс завершился до записи в журнал, клиенты не
+получат до следующего изменения объекта.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Change
+
+
+def log_changes(kind, object_ids, user_id=None, deleted=False):
+    """Запись изменений объектов одного вида после фиксации транзакции."""
+
+    log_user_changes(
+        kind, [(user_id, object_id) for object_id in object_ids], deleted
+    )
+
+
+def log_user_changes(kind, items, deleted=False, batch_size=1000):
+    """Запись изменений объектов одного вида разных пользователей после
+    фиксации транзакции. items - пары (пользователь, объект)."""
+
+    items = list(items)
+
+    def write():
+        now = timezone.now()
+        Change.objects.bulk_create(
+            (
+                Change(
+                    kind=kind,
+                    object_id=object_id,
+                    user_id=user_id,
+                    deleted=deleted,
+                    created=now
+                )
+                for user_id, object_id in items
+            ),
+            batch_size=batch_size
+        )
+
+    if items:
+        transaction.on_commit(write)
+
+
+def last_token():
+    """Номер последнего изменения."""
+
+    return Change.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def is_expired(since):
+    """Изменения после since частично удалены из журнала."""
+
+    oldest = Change.objects.order_by('id').values_list('id', flat=True)[:1]
+    return bool(oldest) and since < oldest[0] - 1
+
+
+def read_changes(user, since, limit):
+    """Изменения, видимые пользователю, после since.
+
+    Возвращает словарь (вид, идентификатор объекта) -> удален ли объект с
+    учетом только последнего изменения каждого объекта, номер последнего
+    прочитанного изменения и признак того, что есть еще изменения.
+
+    Записи читаются по возрастанию номера без условия на время: время
+    записи ставит часами своего процесса, и меньший номер может иметь
+    более позднее время. Чтение останавливается на первой записи моложе
+    SYNC['LAG_SECONDS'] (за ней могут оказаться записи еще не завершенных
+    вставок), номер берется у предыдущей записи, поэтому ни один номер
+    не пропускается."""
+
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.SYNC['LAG_SECONDS']
+    )
+    rows = list(Change.objects.filter(
+        Q(user_id__isnull=True) | Q(user_id=user.id),
+        id__gt=since
+    ).order_by('id').values_list(
+        'id', 'kind', 'object_id', 'deleted', 'created'
+    )[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    for position, row in enumerate(rows):
+        if row[4] >= cutoff:
+            # Остальные записи еще не готовы, клиент получит их при
+            # следующей синхронизации.
+            rows = rows[:position]
+            has_more = False
+            break
+    changes = {}
+    for _, kind, object_id, deleted, _ in rows:
+        changes[(kind, object_id)] = deleted
+    token = rows[-1][0] if rows else since
+    return changes, token, has_more
+
+
+def prune_changes(before, batch_size=10000):
+    """Удаление записей журнала старше before. Последняя запись
+    сохраняется, чтобы по ней определялись устаревшие номера."""
+
+    last = last_token()
+    deleted = 0
+    while True:
+        ids = list(Change.objects.filter(
+            created__lt=before, id__lt=last
+        ).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        Change.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
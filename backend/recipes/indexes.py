@@ -0,0 +1,62 @@
+"""Индексы, которые нельзя описать стандартными средствами Django 3.2."""
+from django.db import models
+from django.db.backends.ddl_references import Statement, Table
+
+# Буквы, которые часто путают при наборе (безударные о и а, ё и е, э и е),
+# и их замены. Триграммы строятся по названию с заменами, чтобы "малако"
+# совпадало с "молоко".
+FOLD_FROM, FOLD_TO = 'ёоэ', 'еае'
+
+
+class PostgreSQLFieldIndex(models.Index):
+    """Индекс по одному полю, который на PostgreSQL создается по шаблону
+    postgresql_template, а на других СУБД - как обычный индекс по полю."""
+
+    postgresql_template = None
+
+    def __init__(self, *, field, name):
+        super().__init__(fields=[field], name=name)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        return path, args, {'field': self.fields[0], 'name': self.name}
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        column = model._meta.get_field(self.fields[0]).column
+        return Statement(
+            self.postgresql_template,
+            name=schema_editor.quote_name(self.name),
+            table=Table(model._meta.db_table, schema_editor.quote_name),
+            column=schema_editor.quote_name(column),
+        )
+
+
+class UpperPatternIndex(PostgreSQLFieldIndex):
+    """Индекс для поиска по началу строки без учета регистра
+    (istartswith, SearchFilter с '^').
+
+    Django выполняет такой поиск на PostgreSQL как
+    UPPER("поле"::text) LIKE UPPER('префикс%'), поэтому индекс строится по
+    тому же выражению с классом операторов text_pattern_ops, который
+    позволяет использовать индекс для LIKE при любой локали базы."""
+
+    postgresql_template = (
+        'CREATE INDEX %(name)s ON %(table)s '
+        '((UPPER(%(column)s::text)) text_pattern_ops)'
+    )
+
+
+class TrigramIndex(PostgreSQLFieldIndex):
+    """GIN-индекс триграмм pg_trgm для поиска с опечатками (оператор % и
+    similarity()) по названию в нижнем регистре с заменами FOLD_FROM ->
+    FOLD_TO. Расширение pg_trgm создается перед миграциями (см.
+    recipes.signals). На других СУБД поиск с опечатками выполняется по
+    индексу в памяти процесса (api.ingredient_search)."""
+
+    postgresql_template = (
+        'CREATE INDEX %(name)s ON %(table)s USING gin '
+        f"((translate(lower(%(column)s), '{FOLD_FROM}', '{FOLD_TO}')) "
+        'gin_trgm_ops)'
+    )
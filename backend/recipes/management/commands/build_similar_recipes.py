@@ -0,0 +1,251 @@
+from array import array
+from time import monotonic
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from scipy import sparse
+
+from recipes.models import (IngredientAmount, Recipe,  # isort:skip
+                            SimilarRecipe)
+
+# Оценка объема памяти на один ненулевой элемент произведения матриц:
+# значение, индекс столбца и временные массивы при расчете сходства.
+BYTES_PER_ENTRY = 48
+MAX_CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Расчет похожих рецептов по пересечению наборов ингредиентов.
+
+    Рецепты представляются разреженными бинарными векторами по
+    ингредиентам, сходство считается пачками строк через произведение
+    разреженных матриц, для каждого рецепта сохраняются top-K соседей.
+    Размер пачки подбирается так, чтобы уложиться в заданный объем памяти.
+    Время расчета сохраняется в рецепте, поэтому рецепты без похожих
+    тоже считаются рассчитанными. С флагом --incremental пересчитываются
+    только рецепты без времени расчета (новые и измененные), а их
+    сходство добавляется в списки остальных рецептов.
+    """
+
+    help = 'Расчет похожих рецептов по ингредиентам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=10,
+            help='Количество похожих рецептов для каждого рецепта.'
+        )
+        parser.add_argument(
+            '--metric',
+            choices=('jaccard', 'cosine'),
+            default='jaccard',
+            help='Мера сходства наборов ингредиентов.'
+        )
+        parser.add_argument(
+            '--min-score',
+            type=float,
+            default=0.1,
+            help='Минимальное сходство, при котором рецепты считаются '
+                 'похожими.'
+        )
+        parser.add_argument(
+            '--memory',
+            type=int,
+            default=256,
+            help='Ограничение памяти на пачку строк, МБ.'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Пересчитать только новые и измененные рецепты.'
+        )
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1:
+            raise CommandError('Параметр --top-k должен быть больше нуля.')
+        started = monotonic()
+        self.top_k = options['top_k']
+        self.metric = options['metric']
+        self.min_score = options['min_score']
+        self.load_vectors()
+        if not len(self.recipe_ids):
+            self.stdout.write('Нет рецептов с ингредиентами.')
+            return
+        if options['incremental']:
+            computed = Recipe.objects.filter(
+                similar_computed_at__isnull=False
+            ).values_list('id', flat=True)
+            targets = np.flatnonzero(~np.isin(
+                self.recipe_ids,
+                np.fromiter(computed.iterator(), dtype=np.int64)
+            ))
+            self.load_thresholds()
+        else:
+            targets = np.arange(len(self.recipe_ids))
+        self.incremental = options['incremental']
+        chunk_size = min(MAX_CHUNK_SIZE, max(
+            1,
+            options['memory'] * 2 ** 20
+            // (len(self.recipe_ids) * BYTES_PER_ENTRY)
+        ))
+        saved = 0
+        for start in range(0, len(targets), chunk_size):
+            saved += self.process_chunk(targets[start:start + chunk_size])
+        elapsed = monotonic() - started
+        self.stdout.write(
+            f'Обработано рецептов: {len(targets)} из '
+            f'{len(self.recipe_ids)}, сохранено пар: {saved}, '
+            f'время: {elapsed:.1f} с '
+            f'({len(targets) / max(elapsed, 1e-6):.0f} рецептов/с).'
+        )
+
+    def load_vectors(self):
+        """Построение разреженной матрицы рецепт x ингредиент."""
+
+        recipes, ingredients = array('q'), array('q')
+        amounts = IngredientAmount.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        )
+        for recipe_id, ingredient_id in amounts.iterator(chunk_size=5000):
+            recipes.append(recipe_id)
+            ingredients.append(ingredient_id)
+        self.recipe_ids, rows = np.unique(
+            np.frombuffer(recipes, dtype=np.int64), return_inverse=True
+        )
+        _, columns = np.unique(
+            np.frombuffer(ingredients, dtype=np.int64), return_inverse=True
+        )
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(len(self.recipe_ids), columns.max(initial=-1) + 1)
+        )
+        self.matrix = matrix
+        self.transposed = matrix.T.tocsr()
+        self.sizes = np.diff(matrix.indptr).astype(np.float32)
+
+    def load_thresholds(self):
+        """Количество соседей и минимальное сходство в сохраненных
+        списках, упорядоченные как строки матрицы."""
+
+        self.counts = np.zeros(len(self.recipe_ids), dtype=np.int64)
+        self.min_scores = np.zeros(len(self.recipe_ids), dtype=np.float32)
+        lists = SimilarRecipe.objects.values('recipe_id').annotate(
+            count=Count('id'),
+            min_score=Min('score')
+        ).order_by()
+        for row in lists.iterator():
+            self.update_threshold(row['recipe_id'], row)
+
+    def update_threshold(self, recipe_id, row):
+        position = np.searchsorted(self.recipe_ids, recipe_id)
+        if (position < len(self.recipe_ids)
+                and self.recipe_ids[position] == recipe_id):
+            self.counts[position] = row['count']
+            self.min_scores[position] = row['min_score'] or 0
+
+    def similarity(self, rows):
+        """Пары (строка, столбец, сходство) для пачки строк."""
+
+        product = (self.matrix[rows] @ self.transposed).tocoo()
+        sources, targets = rows[product.row], product.col
+        intersection = product.data
+        if self.metric == 'jaccard':
+            scores = intersection / (
+                self.sizes[sources] + self.sizes[targets] - intersection
+            )
+        else:
+            scores = intersection / np.sqrt(
+                self.sizes[sources] * self.sizes[targets]
+            )
+        mask = (sources != targets) & (scores >= self.min_score)
+        return sources[mask], targets[mask], scores[mask]
+
+    def top(self, sources, targets, scores):
+        """Отбор top-K соседей для каждой строки."""
+
+        order = np.lexsort((-scores, sources))
+        sources, targets, scores = (
+            sources[order], targets[order], scores[order]
+        )
+        starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+        counts = np.diff(np.r_[starts, len(sources)])
+        ranks = np.arange(len(sources)) - np.repeat(starts, counts)
+        mask = ranks < self.top_k
+        return sources[mask], targets[mask], scores[mask]
+
+    def process_chunk(self, rows):
+        sources, targets, scores = self.similarity(rows)
+        top_sources, top_targets, top_scores = self.top(
+            sources, targets, scores
+        )
+        recipe_ids = self.recipe_ids
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(
+                recipe_id__in=recipe_ids[rows].tolist()
+            ).delete()
+            SimilarRecipe.objects.bulk_create(
+                (
+                    SimilarRecipe(
+                        recipe_id=recipe_id,
+                        similar_id=similar_id,
+                        score=score
+                    )
+                    for recipe_id, similar_id, score in zip(
+                        recipe_ids[top_sources].tolist(),
+                        recipe_ids[top_targets].tolist(),
+                        top_scores.tolist()
+                    )
+                ),
+                batch_size=1000
+            )
+            Recipe.objects.filter(
+                id__in=recipe_ids[rows].tolist()
+            ).update(similar_computed_at=timezone.now())
+            if self.incremental:
+                self.merge_reverse(rows, sources, targets, scores)
+        return len(top_scores)
+
+    def merge_reverse(self, rows, sources, targets, scores):
+        """Добавление пересчитанных рецептов в списки соседей остальных
+        рецептов, если сходство проходит в их top-K."""
+
+        mask = ~np.isin(targets, rows) & (
+            (self.counts[targets] < self.top_k)
+            | (scores > self.min_scores[targets])
+        )
+        positions, similar, scores = (
+            targets[mask], sources[mask], scores[mask]
+        )
+        SimilarRecipe.objects.bulk_create(
+            (
+                SimilarRecipe(
+                    recipe_id=recipe_id,
+                    similar_id=similar_id,
+                    score=score
+                )
+                for recipe_id, similar_id, score in zip(
+                    self.recipe_ids[positions].tolist(),
+                    self.recipe_ids[similar].tolist(),
+                    scores.tolist()
+                )
+            ),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+        for recipe_id in self.recipe_ids[np.unique(positions)].tolist():
+            extra = SimilarRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('id', flat=True)[self.top_k:]
+            SimilarRecipe.objects.filter(id__in=list(extra)).delete()
+            self.update_threshold(
+                recipe_id,
+                SimilarRecipe.objects.filter(recipe_id=recipe_id).aggregate(
+                    count=Count('id'),
+                    min_score=Min('score')
+                )
+            )
@@ -0,0 +1,147 @@
+import os
+import shutil
+from time import monotonic, time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.models import Job  # isort:skip
+from recipes.models import Recipe  # isort:skip
+
+# Каталоги хранилища и поля, которые ссылаются на файлы в них.
+MEDIA_SOURCES = (
+    ('recipes/images', Recipe, 'image'),
+    ('jobs', Job, 'result'),
+)
+# Через сколько просмотренных файлов выводится ход работы (-v 2).
+PROGRESS_EVERY = 100000
+
+
+def scan_files(directory, skip=None):
+    """Файлы каталога и вложенных каталогов без символических ссылок.
+    В памяти одновременно находятся только открытые каталоги пути."""
+
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path != skip:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+class Command(BaseCommand):
+    """
+    Удаление файлов картинок рецептов и результатов задач, на которые не
+    ссылается ни одна запись. Такие файлы остаются после замены картинки
+    и удаления рецепта.
+
+    Каталоги просматриваются потоково через os.scandir, имена файлов
+    проверяются по базе порциями, поэтому потребление памяти не зависит
+    от количества файлов. Файлы моложе срока ожидания не трогаются: запись
+    о только что загруженном файле может быть еще не сохранена. С
+    --quarantine файлы переносятся в указанный каталог с сохранением
+    относительного пути, иначе удаляются.
+    """
+
+    help = 'Удаление файлов, на которые не ссылаются записи базы.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=24,
+            help='Не трогать файлы моложе указанного срока, часов.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только вывести найденные файлы.'
+        )
+        parser.add_argument(
+            '--quarantine',
+            help='Каталог, в который переносятся файлы вместо удаления.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество имен файлов, проверяемых за один запрос.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            root = default_storage.path('')
+        except NotImplementedError:
+            raise CommandError('Хранилище файлов не локальное.')
+        quarantine = options['quarantine']
+        if quarantine is not None:
+            quarantine = os.path.abspath(quarantine)
+        self.totals = dict.fromkeys(('scanned', 'orphaned', 'size'), 0)
+        started = monotonic()
+        deadline = time() - options['grace_hours'] * 3600
+        for directory, model, field in MEDIA_SOURCES:
+            path = os.path.join(root, directory)
+            if not os.path.isdir(path):
+                continue
+            batch = []
+            for entry in scan_files(path, skip=quarantine):
+                self.count_scanned(started, options)
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > deadline:
+                    continue
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                batch.append((name, entry.path, stat.st_size))
+                if len(batch) >= options['batch_size']:
+                    self.collect(batch, model, field, quarantine, options)
+                    batch = []
+            self.collect(batch, model, field, quarantine, options)
+        elapsed = monotonic() - started
+        scanned = self.totals['scanned']
+        action = 'Найдено' if options['dry_run'] else (
+            'Перенесено' if quarantine else 'Удалено'
+        )
+        self.stdout.write(
+            f'Просмотрено файлов: {scanned} за {elapsed:.1f} с '
+            f'({scanned / max(elapsed, 1e-6):.0f} файлов/с). '
+            f'{action} файлов без ссылок: {self.totals["orphaned"]} '
+            f'({self.totals["size"] / 2 ** 20:.1f} МБ).'
+        )
+
+    def count_scanned(self, started, options):
+        self.totals['scanned'] += 1
+        scanned = self.totals['scanned']
+        if options['verbosity'] > 1 and not scanned % PROGRESS_EVERY:
+            elapsed = monotonic() - started
+            self.stderr.write(
+                f'Просмотрено файлов: {scanned} '
+                f'({scanned / max(elapsed, 1e-6):.0f} файлов/с)'
+            )
+
+    def collect(self, batch, model, field, quarantine, options):
+        """Удаление или перенос файлов порции, на которые нет ссылок."""
+
+        if not batch:
+            return
+        referenced = set(model.objects.filter(
+            **{f'{field}__in': [name for name, _, _ in batch]}
+        ).values_list(field, flat=True))
+        for name, path, size in batch:
+            if name in referenced:
+                continue
+            if options['verbosity'] > 1 or options['dry_run']:
+                self.stdout.write(name)
+            if not options['dry_run']:
+                try:
+                    if quarantine is None:
+                        os.remove(path)
+                    else:
+                        target = os.path.join(quarantine, name)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.move(path, target)
+                except FileNotFoundError:
+                    continue
+            self.totals['orphaned'] += 1
+            self.totals['size'] += size
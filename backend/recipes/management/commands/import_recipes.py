@@ -0,0 +1,350 @@
+import gzip
+import json
+import os
+import sys
+from contextlib import contextmanager
+from time import monotonic
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes.changes import log_user_changes  # isort:skip
+from recipes.models import (Change, Favorite, Ingredient,  # isort:skip
+                            IngredientAmount, Recipe,  # isort:skip
+                            ShoppingCart, Tag)  # isort:skip
+from users.models import Follow  # isort:skip
+
+User = get_user_model()
+
+
+@contextmanager
+def keep_auto_dates(model):
+    """Отключение auto_now_add, чтобы сохранить даты из выгрузки."""
+
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now_add', False)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """
+    Загрузка рецептов и связанных объектов из NDJSON, созданного командой
+    export_recipes.
+
+    Строки читаются потоково и сохраняются пачками, каждая пачка - в своей
+    транзакции. Идентификаторы объектов сопоставляются заново: теги - по
+    слагу, ингредиенты - по названию и единице измерения, пользователи - по
+    e-mail, рецепты создаются новыми. В памяти хранятся только таблицы
+    соответствия идентификаторов пользователей, тегов, ингредиентов и
+    рецептов. Уже существующие связи (избранное, подписки и т. п.)
+    пропускаются. Имя нового пользователя, занятое пользователем с другим
+    e-mail, дополняется суффиксом. Загруженные избранное, списки покупок
+    и подписки записываются в журнал изменений для синхронизации
+    клиентов.
+    """
+
+    help = 'Загрузка рецептов и связанных объектов из NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            nargs='?',
+            default='-',
+            help='Файл с выгрузкой, по умолчанию стандартный ввод.'
+        )
+        parser.add_argument(
+            '--media',
+            help='Каталог с картинками рецептов из выгрузки.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество объектов, сохраняемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        source = options['input']
+        if source == '-':
+            stream = sys.stdin
+        elif source.endswith('.gz'):
+            stream = gzip.open(source, 'rt', encoding='UTF-8')
+        else:
+            stream = open(source, encoding='UTF-8')
+        self.media = options['media']
+        self.ids = {
+            'users.user': {},
+            'recipes.tag': {},
+            'recipes.ingredient': {},
+            'recipes.recipe': {},
+        }
+        self.loaders = {
+            'users.user': self.load_users,
+            'recipes.tag': self.load_tags,
+            'recipes.ingredient': self.load_ingredients,
+            'recipes.recipe': self.load_recipes,
+            'recipes.recipe_tags': self.load_recipe_tags,
+            'recipes.ingredientamount': self.load_amounts,
+            'recipes.favorite': self.load_favorites,
+            'recipes.shoppingcart': self.load_shopping_carts,
+            'users.follow': self.load_follows,
+        }
+        self.loaded_events = False
+        self.started = monotonic()
+        self.total = 0
+        try:
+            for label, batch in self.read_batches(
+                stream, options['batch_size']
+            ):
+                self.flush(label, batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        call_command('rebuild_tag_masks', stdout=self.stderr)
+        call_command('rebuild_recipe_cards', '--missing', stdout=self.stderr)
+        if self.loaded_events:
+            call_command('rescale_trending', stdout=self.stderr)
+        elapsed = monotonic() - self.started
+        self.stderr.write(
+            f'Загружено объектов: {self.total} за {elapsed:.1f} с '
+            f'({self.total / max(elapsed, 1e-6):.0f} объектов/с).'
+        )
+
+    def read_batches(self, stream, batch_size):
+        """Пачки подряд идущих объектов одной модели."""
+
+        label, batch = None, []
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                raise CommandError(f'Строка {number}: {error}')
+            if record['model'] not in self.loaders:
+                raise CommandError(
+                    f'Строка {number}: неизвестная модель '
+                    f'{record["model"]}.'
+                )
+            if batch and (record['model'] != label
+                          or len(batch) >= batch_size):
+                yield label, batch
+                batch = []
+            label = record['model']
+            batch.append(record)
+        if batch:
+            yield label, batch
+
+    def flush(self, label, batch):
+        """Сохранение пачки объектов одной модели в транзакции."""
+
+        with transaction.atomic():
+            self.loaders[label]([record['fields'] for record in batch], [
+                record['pk'] for record in batch
+            ])
+        self.total += len(batch)
+        elapsed = monotonic() - self.started
+        self.stderr.write(
+            f'{label}: всего {self.total} '
+            f'({self.total / max(elapsed, 1e-6):.0f} объектов/с)'
+        )
+
+    def remap(self, label, old_id):
+        try:
+            return self.ids[label][old_id]
+        except KeyError:
+            raise CommandError(
+                f'Объект {label} с идентификатором {old_id} не найден в '
+                f'выгрузке.'
+            )
+
+    def load_users(self, records, pks):
+        emails = [fields['email'] for fields in records]
+        for fields in records:
+            if fields['last_login']:
+                fields['last_login'] = parse_datetime(fields['last_login'])
+        existing = dict(User.objects.filter(email__in=emails).values_list(
+            'email', 'id'
+        ))
+        new_users = [
+            fields for fields in records if fields['email'] not in existing
+        ]
+        self.rename_taken_usernames(new_users)
+        User.objects.bulk_create(User(**fields) for fields in new_users)
+        existing.update(User.objects.filter(email__in=emails).values_list(
+            'email', 'id'
+        ))
+        for fields, pk in zip(records, pks):
+            self.ids['users.user'][pk] = existing[fields['email']]
+
+    def rename_taken_usernames(self, records):
+        """Имена новых пользователей, занятые пользователями с другим
+        e-mail, дополняются суффиксом -2, -3 и т. д. Иначе вставка пачки
+        нарушила бы уникальность имени, когда предыдущие пачки уже
+        сохранены. Переименования выводятся в stderr."""
+
+        usernames = {fields['username'] for fields in records}
+        taken = set(User.objects.filter(
+            username__in=usernames
+        ).values_list('username', flat=True))
+        for fields in records:
+            username = fields['username']
+            if username in taken:
+                fields['username'] = self.free_username(username, taken)
+                self.stderr.write(
+                    f'Пользователь {fields["email"]}: имя {username} '
+                    f'занято, сохранено как {fields["username"]}.'
+                )
+            taken.add(fields['username'])
+
+    @staticmethod
+    def free_username(username, taken):
+        max_length = User._meta.get_field('username').max_length
+        number = 2
+        while True:
+            suffix = f'-{number}'
+            candidate = username[:max_length - len(suffix)] + suffix
+            if candidate not in taken and not User.objects.filter(
+                username=candidate
+            ).exists():
+                return candidate
+            number += 1
+
+    def load_tags(self, records, pks):
+        slugs = [fields['slug'] for fields in records]
+        Tag.objects.bulk_create(
+            (Tag(**fields) for fields in records),
+            ignore_conflicts=True
+        )
+        existing = dict(Tag.objects.filter(slug__in=slugs).values_list(
+            'slug', 'id'
+        ))
+        for fields, pk in zip(records, pks):
+            self.ids['recipes.tag'][pk] = existing[fields['slug']]
+
+    def load_ingredients(self, records, pks):
+        Ingredient.objects.bulk_create(
+            (Ingredient(**fields) for fields in records),
+            ignore_conflicts=True
+        )
+        existing = {
+            (name, unit): pk for pk, name, unit
+            in Ingredient.objects.filter(
+                name__in=[fields['name'] for fields in records]
+            ).values_list('id', 'name', 'measurement_unit')
+        }
+        for fields, pk in zip(records, pks):
+            self.ids['recipes.ingredient'][pk] = existing[
+                (fields['name'], fields['measurement_unit'])
+            ]
+
+    def load_recipes(self, records, pks):
+        recipes = []
+        for fields in records:
+            fields['author_id'] = self.remap(
+                'users.user', fields.pop('author')
+            )
+            fields['pub_date'] = parse_datetime(fields['pub_date'])
+            fields['image'] = self.copy_image(fields['image'])
+            recipes.append(Recipe(**fields))
+        with keep_auto_dates(Recipe):
+            if connection.features.can_return_rows_from_bulk_insert:
+                Recipe.objects.bulk_create(recipes)
+            else:
+                for recipe in recipes:
+                    recipe.save(force_insert=True)
+        for recipe, pk in zip(recipes, pks):
+            self.ids['recipes.recipe'][pk] = recipe.pk
+
+    def load_recipe_tags(self, records, pks):
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(
+                    recipe_id=self.remap('recipes.recipe', fields['recipe']),
+                    tag_id=self.remap('recipes.tag', fields['tag'])
+                )
+                for fields in records
+            ),
+            ignore_conflicts=True
+        )
+
+    def load_amounts(self, records, pks):
+        IngredientAmount.objects.bulk_create(
+            (
+                IngredientAmount(
+                    recipe_id=self.remap('recipes.recipe', fields['recipe']),
+                    ingredient_id=self.remap(
+                        'recipes.ingredient', fields['ingredient']
+                    ),
+                    amount=fields['amount']
+                )
+                for fields in records
+            ),
+            ignore_conflicts=True
+        )
+
+    def load_user_recipes(self, model, kind, records):
+        objects = [
+            model(
+                user_id=self.remap('users.user', fields['user']),
+                recipe_id=self.remap('recipes.recipe', fields['recipe']),
+                created=parse_datetime(fields['created'])
+            )
+            for fields in records
+        ]
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        # bulk_create не отправляет сигналы, журнал пополняется здесь.
+        # Уже существовавшие связи тоже записываются: клиент получит
+        # только подтверждение текущего состояния.
+        log_user_changes(
+            kind, ((obj.user_id, obj.recipe_id) for obj in objects)
+        )
+        self.loaded_events = True
+
+    def load_favorites(self, records, pks):
+        self.load_user_recipes(Favorite, Change.FAVORITE, records)
+
+    def load_shopping_carts(self, records, pks):
+        self.load_user_recipes(ShoppingCart, Change.SHOPPING_CART, records)
+
+    def load_follows(self, records, pks):
+        follows = [
+            Follow(
+                user_id=self.remap('users.user', fields['user']),
+                author_id=self.remap('users.user', fields['author'])
+            )
+            for fields in records
+        ]
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        log_user_changes(
+            Change.FOLLOW,
+            ((follow.user_id, follow.author_id) for follow in follows)
+        )
+
+    def copy_image(self, name):
+        """Копирование картинки из каталога выгрузки в хранилище.
+
+        Если файл с таким именем уже есть в хранилище, используется он."""
+
+        if not self.media or not name or default_storage.exists(name):
+            return name
+        path = os.path.join(self.media, name)
+        if not os.path.exists(path):
+            return name
+        with open(path, 'rb') as file:
+            return Recipe._meta.get_field('image').storage.save(
+                name, File(file)
+            )
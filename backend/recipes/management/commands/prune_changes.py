@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.changes import prune_changes  # isort:skip
+
+
+class Command(BaseCommand):
+    """
+    Очистка журнала изменений, по которому синхронизируются клиенты.
+    Клиенты, не синхронизировавшиеся дольше срока хранения, получат 410 и
+    загрузят данные заново. Запускается периодически, например раз в сутки.
+    """
+
+    help = 'Очистка журнала изменений для синхронизации.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.SYNC['RETENTION_DAYS'],
+            help='Срок хранения изменений, дней.'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(
+            timezone.now() - timedelta(days=options['days'])
+        )
+        self.stdout.write(f'Удалено записей журнала: {deleted}.')
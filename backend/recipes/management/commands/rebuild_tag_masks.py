@@ -0,0 +1,36 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.masks import (rebuild_tag_counters,  # isort:skip
+                           update_tags_masks)  # isort:skip
+from recipes.models import Recipe, Tag  # isort:skip
+
+
+class Command(BaseCommand):
+    """
+    Назначение битов тегам без бита, пересчет масок тегов всех рецептов и
+    счетчиков рецептов с тегами. Запускается после применения миграций и
+    загрузки данных.
+    """
+
+    help = 'Пересчет масок тегов рецептов и счетчиков рецептов с тегами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество рецептов, обрабатываемых за один раз.'
+        )
+
+    def handle(self, *args, **options):
+        for tag in Tag.objects.filter(bit__isnull=True).order_by('pk'):
+            try:
+                tag.save(update_fields=('bit',))
+            except ValidationError as error:
+                raise CommandError(' '.join(error.messages))
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        update_tags_masks(recipe_ids, batch_size=options['batch_size'])
+        self.stdout.write(f'Обновлено масок тегов: {len(recipe_ids)}.')
+        counters = rebuild_tag_counters()
+        self.stdout.write(f'Пересчитано счетчиков тегов: {counters}.')
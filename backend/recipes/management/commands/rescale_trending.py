@@ -0,0 +1,113 @@
+import math
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes import trending  # isort:skip
+from recipes.models import (Favorite, RecipeTrend,  # isort:skip
+                            ShoppingCart)  # isort:skip
+
+
+class Command(BaseCommand):
+    """
+    Пересчет оценок популярности рецептов по избранному и спискам покупок.
+
+    Инкрементальные обновления накапливают погрешность при вычитании
+    удаленных событий, а рецепты без новых событий остаются в таблице.
+    Команда пересчитывает оценки по событиям, которые еще заметно влияют
+    на популярность, и удаляет оценки полностью затухших рецептов.
+    Запускается периодически, например раз в сутки.
+
+    Рецепты обрабатываются пачками: оценки пачки блокируются
+    (select_for_update), затем читаются события. Событие записывается в
+    одной транзакции с изменением оценки (recipes.trending), поэтому
+    событие, зафиксированное до блокировки, уже учтено в прочитанных
+    событиях, а более позднее ждет окончания пересчета и добавляется к
+    новой оценке.
+    """
+
+    help = 'Пересчет оценок популярности рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество рецептов, пересчитываемых в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        min_score = trending.threshold(now)
+        max_weight = max(trending.WEIGHTS.values())
+        since = datetime.fromtimestamp(
+            (min_score - math.log(max_weight)) / trending.DECAY,
+            tz=timezone.utc
+        )
+        recipe_ids = set(RecipeTrend.objects.values_list(
+            'recipe_id', flat=True
+        ))
+        for model in (Favorite, ShoppingCart):
+            recipe_ids.update(model.objects.filter(
+                created__gte=since
+            ).values_list('recipe_id', flat=True).distinct())
+        recipe_ids = sorted(recipe_ids)
+        batch_size = options['batch_size']
+        rescaled = deleted = 0
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            with transaction.atomic():
+                counts = self.rescale_batch(batch, since, min_score)
+            rescaled += counts[0]
+            deleted += counts[1]
+        self.stdout.write(
+            f'Пересчитано оценок: {rescaled}, удалено: {deleted}.'
+        )
+
+    @staticmethod
+    def rescale_batch(recipe_ids, since, min_score):
+        """Пересчет оценок рецептов внутри транзакции. Возвращает
+        количество пересчитанных и удаленных оценок."""
+
+        trends = RecipeTrend.objects.select_for_update().filter(
+            recipe_id__in=recipe_ids
+        ).in_bulk()
+        scores = {}
+        for model, kind in ((Favorite, 'favorite'),
+                            (ShoppingCart, 'shopping_cart')):
+            events = model.objects.filter(
+                recipe_id__in=recipe_ids,
+                created__gte=since
+            ).values_list('recipe_id', 'created')
+            for recipe_id, created in events.iterator(chunk_size=2000):
+                value = trending.event_score(kind, created)
+                if recipe_id in scores:
+                    value = trending.log_add(scores[recipe_id], value)
+                scores[recipe_id] = value
+        scores = {
+            recipe_id: score for recipe_id, score in scores.items()
+            if score >= min_score
+        }
+        stale = [
+            recipe_id for recipe_id in trends if recipe_id not in scores
+        ]
+        RecipeTrend.objects.filter(recipe_id__in=stale).delete()
+        updated = []
+        for recipe_id, trend in trends.items():
+            if recipe_id in scores:
+                trend.score = scores[recipe_id]
+                updated.append(trend)
+        RecipeTrend.objects.bulk_update(updated, ('score',))
+        # Оценку рецепта без записи могло создать событие после чтения,
+        # тогда она остается: ее исправит следующий пересчет.
+        RecipeTrend.objects.bulk_create(
+            (
+                RecipeTrend(recipe_id=recipe_id, score=score)
+                for recipe_id, score in scores.items()
+                if recipe_id not in trends
+            ),
+            ignore_conflicts=True
+        )
+        return len(scores), len(stale)
@@ -0,0 +1,121 @@
+"""Маска тегов рецепта: каждому тегу назначен бит (Tag.bit), рецепт хранит
+объединение битов своих тегов в Recipe.tags_mask. Фильтрация по тегам
+сводится к одному условию на это поле без соединения с таблицей тегов.
+
+Вместе с масками изменяются счетчики рецептов с тегом всего и по авторам
+(TagCounter): по разнице старой и новой маски рецепта."""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import Recipe, Tag, TagCounter
+
+
+def tags_to_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
+
+def mask_to_bits(mask):
+    return [bit for bit in range(Tag.MAX_TAGS) if mask >> bit & 1]
+
+
+def update_tags_masks(recipe_ids, batch_size=1000):
+    """Пересчет масок тегов для рецептов."""
+
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        chunk = recipe_ids[start:start + batch_size]
+        masks = dict.fromkeys(chunk, 0)
+        bits = Recipe.tags.through.objects.filter(
+            recipe_id__in=chunk,
+            tag__bit__isnull=False
+        ).values_list('recipe_id', 'tag__bit')
+        for recipe_id, bit in bits:
+            masks[recipe_id] |= 1 << bit
+        with transaction.atomic(savepoint=False):
+            # Старые маски блокируются до записи счетчиков, иначе
+            # одновременное изменение тегов рецепта учитывалось бы дважды.
+            old_masks = Recipe.objects.select_for_update().filter(
+                pk__in=chunk
+            ).order_by().values_list('pk', 'author_id', 'tags_mask')
+            changes = [
+                (author_id, old_mask, masks[recipe_id])
+                for recipe_id, author_id, old_mask in old_masks
+                if old_mask != masks[recipe_id]
+            ]
+            grouped = defaultdict(list)
+            for recipe_id, mask in masks.items():
+                grouped[mask].append(recipe_id)
+            for mask, ids in grouped.items():
+                Recipe.objects.filter(pk__in=ids).update(tags_mask=mask)
+            update_tag_counters(changes)
+
+
+def update_tag_counters(changes):
+    """Изменение счетчиков рецептов с тегом. changes - тройки (автор,
+    старая маска, новая маска); удаленный рецепт - новая маска 0."""
+
+    deltas = Counter()
+    for author_id, old_mask, new_mask in changes:
+        for mask, delta in ((old_mask & ~new_mask, -1),
+                            (new_mask & ~old_mask, 1)):
+            for bit in mask_to_bits(mask):
+                deltas[bit, author_id] += delta
+                deltas[bit, None] += delta
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    tag_ids = dict(Tag.objects.filter(
+        bit__in={bit for bit, _ in deltas}
+    ).values_list('bit', 'id'))
+    counters = {
+        (tag_ids[bit], author_id): delta
+        for (bit, author_id), delta in deltas.items() if bit in tag_ids
+    }
+    # Недостающие счетчики создаются только для увеличения.
+    TagCounter.objects.bulk_create(
+        (
+            TagCounter(tag_id=tag_id, author_id=author_id)
+            for (tag_id, author_id), delta in counters.items() if delta > 0
+        ),
+        ignore_conflicts=True
+    )
+    # Одно обновление на величину изменения.
+    by_delta = defaultdict(lambda: defaultdict(list))
+    for (tag_id, author_id), delta in counters.items():
+        by_delta[delta][author_id].append(tag_id)
+    for delta, authors in by_delta.items():
+        condition = Q()
+        for author_id, ids in authors.items():
+            condition |= Q(author_id=author_id, tag_id__in=ids)
+        TagCounter.objects.filter(condition).update(count=F('count') + delta)
+
+
+def rebuild_tag_counters():
+    """Пересчет всех счетчиков рецептов с тегом по таблице тегов
+    рецептов."""
+
+    counts = Recipe.tags.through.objects.values(
+        'tag_id', 'recipe__author_id'
+    ).annotate(count=Count('recipe_id')).order_by().values_list(
+        'tag_id', 'recipe__author_id', 'count'
+    )
+    counters = []
+    totals = Counter()
+    for tag_id, author_id, count in counts.iterator():
+        counters.append(
+            TagCounter(tag_id=tag_id, author_id=author_id, count=count)
+        )
+        totals[tag_id] += count
+    counters.extend(
+        TagCounter(tag_id=tag_id, count=count)
+        for tag_id, count in totals.items()
+    )
+    with transaction.atomic():
+        TagCounter.objects.all().delete()
+        TagCounter.objects.bulk_create(counters, batch_size=1000)
+    return len(counters)
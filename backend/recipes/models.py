@@ -1,7 +1,12 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from .indexes import TrigramIndex, UpperPatternIndex  # isort:skip
+from .storage import ContentAddressedStorage  # isort:skip
 
 User = get_user_model()
 
@@ -22,6 +27,16 @@ class Tag(models.Model):
         max_length=200,
         unique=True,
     )
+    bit = models.PositiveSmallIntegerField(
+        'Бит в маске тегов',
+        unique=True,
+        null=True,
+        editable=False,
+    )
+
+    # Маска хранится в знаковом 64-битном поле.
+    MAX_TAGS = 63
+    MAX_TAGS_MESSAGE = f'Количество тегов не может быть больше {MAX_TAGS}.'
 
     class Meta:
         verbose_name = 'Тег'
@@ -30,6 +45,47 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit if self.bit is not None else 0
+
+    def clean(self):
+        if self.bit is None and Tag.objects.filter(
+            bit__isnull=False
+        ).count() >= self.MAX_TAGS:
+            raise ValidationError(self.MAX_TAGS_MESSAGE)
+
+    @classmethod
+    def get_free_bit(cls):
+        used = set(cls.objects.filter(bit__isnull=False).values_list(
+            'bit', flat=True
+        ))
+        bit = next(
+            (bit for bit in range(cls.MAX_TAGS) if bit not in used), None
+        )
+        if bit is None:
+            raise ValidationError(cls.MAX_TAGS_MESSAGE)
+        return bit
+
+    def save(self, *args, **kwargs):
+        if self.bit is not None:
+            super().save(*args, **kwargs)
+            return
+        # Одновременно сохраняемые теги могут выбрать один свободный бит:
+        # тег, получивший ошибку уникальности бита, выбирает следующий.
+        while True:
+            self.bit = self.get_free_bit()
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if not Tag.objects.filter(bit=self.bit).exclude(
+                    pk=self.pk
+                ).exists():
+                    self.bit = None
+                    raise
+
 
 class Ingredient(models.Model):
     """Класс описывающий ингредиент."""
@@ -53,6 +109,10 @@ class Ingredient(models.Model):
                 name='unique ingredient'
             ),
         )
+        indexes = (
+            UpperPatternIndex(field='name', name='ingredient_name_upper_idx'),
+            TrigramIndex(field='name', name='ingredient_name_trgm_idx'),
+        )
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -61,11 +121,13 @@ class Ingredient(models.Model):
 class Recipe(models.Model):
     """Класс описывающий рецепт блюда."""
 
+    # Индекс по автору заменяет составной индекс с датой публикации.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
         verbose_name='Автор',
+        db_index=False,
     )
     name = models.CharField(
         'Название',
@@ -74,6 +136,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='recipes/images/',
+        storage=ContentAddressedStorage(),
     )
     text = models.TextField(
         'Описание',
@@ -103,15 +166,55 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+    tags_mask = models.BigIntegerField(
+        'Маска тегов',
+        default=0,
+        editable=False,
+    )
+    card = models.JSONField(
+        'Карточка рецепта',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    # Время расчета похожих рецептов: пустое у новых и измененных
+    # рецептов, которые пересчитает build_similar_recipes --incremental.
+    similar_computed_at = models.DateTimeField(
+        'Дата расчета похожих рецептов',
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = '-pub_date',
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        # Имя картинки при загрузке: после замены картинки старый файл
+        # удаляется, если на него нет ссылок (recipes.signals).
+        recipe.loaded_image = recipe.__dict__.get('image')
+        # Автор при загрузке: при смене автора счетчики рецептов с тегами
+        # переносятся к новому автору (recipes.signals).
+        recipe.loaded_author_id = recipe.__dict__.get('author_id')
+        return recipe
+
 
 class IngredientAmount(models.Model):
     """Класс описывающий количество ингредиента в рецепте."""
@@ -122,11 +225,13 @@ class IngredientAmount(models.Model):
         related_name='amounts',
         verbose_name='Ингредиент',
     )
+    # Индекс по рецепту заменяет составной индекс с ингредиентом.
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         related_name='amounts',
         verbose_name='Рецепт',
+        db_index=False,
     )
     amount = models.PositiveSmallIntegerField(
         validators=(
@@ -147,6 +252,14 @@ class IngredientAmount(models.Model):
                 name='unique ingredient amount'
             ),
         )
+        indexes = (
+            # Ингредиенты рецептов из списка покупок для суммирования
+            # читаются из индекса без обращения к таблице.
+            models.Index(
+                fields=['recipe', 'ingredient', 'amount'],
+                name='amount_recipe_ingredient_idx'
+            ),
+        )
 
 
 class Favorite(models.Model):
@@ -164,6 +277,10 @@ class Favorite(models.Model):
         related_name='user_favorites',
         verbose_name='Пользователь',
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        default=timezone.now,
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -191,6 +308,10 @@ class ShoppingCart(models.Model):
         related_name='shopping_carts',
         verbose_name='Пользователь',
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        default=timezone.now,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -201,3 +322,165 @@ class ShoppingCart(models.Model):
                 name='unique shopping carts'
             ),
         )
+
+
+class TagCounter(models.Model):
+    """Класс описывающий количество рецептов с тегом: всех (автор не
+    указан) или одного автора.
+
+    Счетчики изменяются вместе с масками тегов рецептов (recipes.masks) и
+    пересчитываются командой rebuild_tag_masks."""
+
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='counters',
+        verbose_name='Тег',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='tag_counters',
+        verbose_name='Автор',
+        null=True,
+        blank=True,
+        db_index=False,
+    )
+    count = models.IntegerField(
+        'Количество рецептов',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Счетчик рецептов с тегом'
+        verbose_name_plural = 'Счетчики рецептов с тегами'
+        constraints = (
+            # Индекс ограничения служит и для выборки счетчиков автора.
+            models.UniqueConstraint(
+                fields=['author', 'tag'],
+                name='unique author tag counter'
+            ),
+            models.UniqueConstraint(
+                fields=['tag'],
+                condition=models.Q(author__isnull=True),
+                name='unique tag counter'
+            ),
+        )
+
+
+class RecipeTrend(models.Model):
+    """Класс описывающий популярность рецепта с учетом давности событий.
+
+    Оценка хранится в логарифмической шкале (см. recipes.trending), поэтому
+    сортировка по ней совпадает с сортировкой по затухающей популярности.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trend',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(
+        'Оценка популярности',
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+
+
+class SimilarRecipe(models.Model):
+    """Класс описывающий рецепт, похожий по набору ингредиентов.
+
+    Таблица заполняется командой build_similar_recipes."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbours',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbour_of',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(
+        'Сходство',
+    )
+
+    class Meta:
+        ordering = '-score',
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique similar recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx'
+            ),
+        )
+
+
+class Change(models.Model):
+    """Класс описывающий запись журнала изменений для синхронизации
+    клиентов.
+
+    Номер записи служит монотонно растущим номером изменения, записи
+    добавляются после фиксации изменивших данные транзакций. Для
+    избранного и списка покупок object_id - идентификатор рецепта, для
+    подписок - идентификатор автора, user_id - владелец записи (у
+    изменений рецептов не заполняется). Журнал очищается командой
+    prune_changes."""
+
+    RECIPE = 'recipe'
+    FAVORITE = 'favorite'
+    SHOPPING_CART = 'shopping_cart'
+    FOLLOW = 'follow'
+    KINDS = (
+        (RECIPE, 'Рецепт'),
+        (FAVORITE, 'Избранное'),
+        (SHOPPING_CART, 'Список покупок'),
+        (FOLLOW, 'Подписка'),
+    )
+
+    id = models.BigAutoField(
+        primary_key=True,
+    )
+    kind = models.CharField(
+        'Вид объекта',
+        max_length=20,
+        choices=KINDS,
+    )
+    object_id = models.BigIntegerField(
+        'Идентификатор объекта',
+    )
+    # Не внешний ключ: записи создаются и при удалении пользователя.
+    user_id = models.BigIntegerField(
+        'Пользователь',
+        null=True,
+        blank=True,
+    )
+    deleted = models.BooleanField(
+        'Удален',
+        default=False,
+    )
+    created = models.DateTimeField(
+        'Дата изменения',
+        default=timezone.now,
+        db_index=True,
+    )
+
+    class Meta:
+        ordering = 'id',
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Журнал изменений'
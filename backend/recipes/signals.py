@@ -0,0 +1,194 @@
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_migrate)
+from django.dispatch import Signal, receiver
+
+from users.models import Follow  # isort:skip
+
+from . import trending  # isort:skip
+from .changes import log_changes  # isort:skip
+from .masks import update_tag_counters, update_tags_masks  # isort:skip
+from .models import (Change, Favorite, Recipe,  # isort:skip
+                     ShoppingCart, SimilarRecipe, Tag)  # isort:skip
+
+# Отправляется после сохранения рецепта вместе с тегами и ингредиентами,
+# аргумент recipe - измененный рецепт.
+recipe_changed = Signal()
+
+TRENDING_EVENTS = {
+    Favorite: 'favorite',
+    ShoppingCart: 'shopping_cart',
+}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def add_trending_event(sender, instance, created, raw=False, **kwargs):
+    """Увеличение популярности рецепта при добавлении в избранное или в
+    список покупок."""
+
+    if created and not raw:
+        trending.add_event(
+            instance.recipe_id,
+            TRENDING_EVENTS[sender],
+            instance.created
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def remove_trending_event(sender, instance, **kwargs):
+    """Уменьшение популярности рецепта при удалении из избранного или из
+    списка покупок."""
+
+    trending.remove_event(
+        instance.recipe_id,
+        TRENDING_EVENTS[sender],
+        instance.created
+    )
+
+
+CHANGE_KINDS = {
+    Favorite: (Change.FAVORITE, 'recipe_id'),
+    ShoppingCart: (Change.SHOPPING_CART, 'recipe_id'),
+    Follow: (Change.FOLLOW, 'author_id'),
+}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def log_added(sender, instance, created, raw=False, **kwargs):
+    """Запись в журнал изменений добавления в избранное, в список
+    покупок или подписки."""
+
+    if created and not raw:
+        kind, field = CHANGE_KINDS[sender]
+        log_changes(kind, (getattr(instance, field),), instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def log_removed(sender, instance, **kwargs):
+    """Запись в журнал изменений удаления из избранного, из списка
+    покупок или подписки."""
+
+    kind, field = CHANGE_KINDS[sender]
+    log_changes(
+        kind, (getattr(instance, field),), instance.user_id, deleted=True
+    )
+
+
+def release_image(name):
+    """Удаление файла картинки после фиксации транзакции, если на него не
+    ссылается ни один рецепт."""
+
+    def release():
+        if not Recipe.objects.filter(image=name).exists():
+            Recipe._meta.get_field('image').storage.release(name)
+
+    if name:
+        transaction.on_commit(release)
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    """Удаление старой картинки после ее замены."""
+
+    if raw or 'image' in instance.get_deferred_fields():
+        return
+    loaded = getattr(instance, 'loaded_image', None)
+    if loaded != instance.image.name:
+        release_image(loaded)
+    instance.loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    if 'image' not in instance.get_deferred_fields():
+        release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def move_author_tag_counters(sender, instance, created, raw=False, **kwargs):
+    """Перенос счетчиков рецептов с тегами к новому автору рецепта."""
+
+    if raw or 'author_id' in instance.get_deferred_fields():
+        return
+    loaded = getattr(instance, 'loaded_author_id', None)
+    if not created and loaded is not None and loaded != instance.author_id:
+        # Маска читается из базы: теги могли измениться после загрузки.
+        mask = Recipe.objects.filter(pk=instance.pk).values_list(
+            'tags_mask', flat=True
+        ).first() or 0
+        update_tag_counters(((loaded, mask, 0), (instance.author_id, 0, mask)))
+    instance.loaded_author_id = instance.author_id
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe_tags(sender, instance, **kwargs):
+    """Уменьшение счетчиков рецептов с тегами удаленного рецепта."""
+
+    if not {'author_id', 'tags_mask'} & instance.get_deferred_fields():
+        update_tag_counters(((instance.author_id, instance.tags_mask, 0),))
+
+
+@receiver(post_delete, sender=Recipe)
+def log_recipe_deleted(sender, instance, **kwargs):
+    """Запись удаления рецепта в журнал изменений."""
+
+    log_changes(Change.RECIPE, (instance.id,), deleted=True)
+
+
+@receiver(recipe_changed)
+def reset_similar_recipes(sender, recipe, **kwargs):
+    """Удаление устаревших похожих рецептов и времени их расчета. Рецепт
+    будет пересчитан командой build_similar_recipes --incremental."""
+
+    SimilarRecipe.objects.filter(
+        Q(recipe=recipe) | Q(similar=recipe)
+    ).delete()
+    recipe.similar_computed_at = None
+    Recipe.objects.filter(pk=recipe.pk).update(similar_computed_at=None)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def sync_tags_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    """Пересчет маски тегов при изменении тегов рецепта."""
+
+    if reverse and action == 'pre_clear':
+        instance.cleared_recipe_ids = list(
+            instance.recipes.values_list('id', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        update_tags_masks((instance.pk,))
+    elif action == 'post_clear':
+        update_tags_masks(getattr(instance, 'cleared_recipe_ids', ()))
+    else:
+        update_tags_masks(pk_set)
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    """Освобождение бита удаленного тега в масках рецептов."""
+
+    if instance.bit is not None:
+        Recipe.objects.filter(
+            tags_mask__gte=instance.mask
+        ).update(tags_mask=F('tags_mask').bitand(~instance.mask))
+
+
+@receiver(pre_migrate)
+def create_trigram_extension(sender, using, **kwargs):
+    """Расширение pg_trgm для индекса поиска ингредиентов с опечатками.
+    Создается до миграций, чтобы индекс можно было построить в той же
+    миграции, что и таблицу."""
+
+    connection = connections[using]
+    if sender.name == 'recipes' and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
@@ -0,0 +1,65 @@
+"""Хранилище картинок рецептов с адресацией по содержимому.
+
+Файл сохраняется под именем из SHA-256 содержимого:
+recipes/images/ab/cd/abcd....jpg. Одинаковые картинки хранятся один
+раз, повторная загрузка не записывает файл, а только обновляет время
+его изменения. Содержимое файла с таким именем никогда не меняется,
+поэтому nginx отдает их с Cache-Control: immutable.
+
+Отдельного счетчика ссылок нет: количество ссылок - количество рецептов
+с этим именем картинки. Файл удаляется после удаления или замены
+картинки рецепта, если на него не ссылается ни один рецепт (см.
+recipes.signals).
+"""
+import hashlib
+import os
+from time import time
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+
+# Файл, загруженный повторно за этот срок, не удаляется: рецепт, который
+# на него ссылается, может быть еще не сохранен, с.
+RELEASE_GRACE = 60 * 60
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save().
+        return name
+
+    @staticmethod
+    def get_content_name(name, content):
+        """Имя файла по SHA-256 содержимого, расширение сохраняется."""
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join((
+            os.path.dirname(name), digest[:2], digest[2:4], digest + extension
+        ))
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        # Файл записывается под временным именем и переименовывается, чтобы
+        # под именем содержимого не мог оказаться недописанный файл.
+        temporary = super()._save(f'{name}.{uuid4().hex}.part', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+    def release(self, name):
+        """Удаление файла, на который больше нет ссылок, если он не был
+        загружен повторно в последние RELEASE_GRACE секунд."""
+
+        try:
+            if os.stat(self.path(name)).st_mtime > time() - RELEASE_GRACE:
+                return
+        except FileNotFoundError:
+            return
+        self.delete(name)
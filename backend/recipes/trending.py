@@ -0,0 +1,78 @@
+"""Расчет популярности рецептов с экспоненциальным затуханием.
+
+Каждое событие (добавление в избранное или в список покупок) с весом w,
+случившееся в момент t, вносит в популярность вклад w * exp(-k * (now - t)).
+Общий множитель exp(-k * now) одинаков для всех рецептов, поэтому для
+сортировки достаточно хранить log(sum(w * exp(k * t))). Такая оценка
+обновляется инкрементально при каждом событии и не переполняется со
+временем, а ее порядок совпадает с порядком затухающей популярности.
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RecipeTrend
+
+HALF_LIFE = settings.TRENDING['HALF_LIFE_HOURS'] * 3600
+DECAY = math.log(2) / HALF_LIFE
+WEIGHTS = settings.TRENDING['WEIGHTS']
+MIN_SCORE = settings.TRENDING['MIN_SCORE']
+
+
+def log_add(first, second):
+    """Логарифм суммы exp(first) + exp(second) без переполнения."""
+
+    high, low = max(first, second), min(first, second)
+    return high + math.log1p(math.exp(low - high))
+
+
+def event_score(kind, moment):
+    """Вклад события в логарифмической шкале."""
+
+    return math.log(WEIGHTS[kind]) + DECAY * moment.timestamp()
+
+
+def threshold(moment=None):
+    """Минимальная оценка рецепта, который еще считается популярным."""
+
+    moment = moment or timezone.now()
+    return math.log(MIN_SCORE) + DECAY * moment.timestamp()
+
+
+def add_event(recipe_id, kind, moment):
+    """Учет нового события в оценке рецепта."""
+
+    value = event_score(kind, moment)
+    with transaction.atomic():
+        trend, created = (
+            RecipeTrend.objects.select_for_update().get_or_create(
+                recipe_id=recipe_id,
+                defaults={'score': value}
+            )
+        )
+        if not created:
+            trend.score = log_add(trend.score, value)
+            trend.save(update_fields=('score',))
+
+
+def remove_event(recipe_id, kind, moment):
+    """Исключение вклада удаленного события из оценки рецепта.
+
+    Запись об оценке при этом никогда не создается: при каскадном удалении
+    рецепта она может быть уже удалена."""
+
+    value = event_score(kind, moment)
+    with transaction.atomic():
+        trend = RecipeTrend.objects.select_for_update().filter(
+            recipe_id=recipe_id
+        ).first()
+        if trend is None:
+            return
+        difference = value - trend.score
+        if difference > -1e-9:
+            trend.delete()
+            return
+        trend.score += math.log1p(-math.exp(difference))
+        trend.save(update_fields=('score',))
@@ -7,13 +7,21 @@ from users.models import Follow, User  # isort:skip
 class UserAdmin(admin.ModelAdmin):
     list_display = 'id', 'username', 'email', 'first_name', 'last_name',
     search_fields = 'username', 'email',
-    list_filter = 'username', 'email',
+    list_filter = 'is_staff', 'is_active',
     empty_value_display = 'пусто'
+    show_full_result_count = False
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
     list_display = 'id', 'user', 'author',
-    search_fields = 'user', 'author',
-    list_filter = 'user', 'author',
+    list_select_related = 'user', 'author',
+    search_fields = (
+        'user__username',
+        'user__email',
+        'author__username',
+        'author__email',
+    )
+    autocomplete_fields = 'user', 'author',
     empty_value_display = 'пусто'
+    show_full_result_count = False
@@ -47,11 +47,13 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Автор',
     )
+    # Индекс по подписчику заменяет составной индекс с автором.
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='follower',
         verbose_name='Подписчик',
+        db_index=False,
     )
 
     class Meta:
@@ -63,3 +65,9 @@ class Follow(models.Model):
                 name='unique follow'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=['user', 'author'],
+                name='follow_user_author_idx'
+            ),
+        )
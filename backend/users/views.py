@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Count
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
@@ -8,6 +9,8 @@ from rest_framework.permissions import (IsAuthenticated,
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.deadlines import DeadlineMixin  # isort:skip
+from api.fields import SparseFieldsViewMixin, wants  # isort:skip
 from api.paginations import CustomPageNumberPagination  # isort:skip
 from api.serializers import (CustomUserSerializer,  # isort:skip
                              FollowSerializer)  # isort:skip
@@ -17,13 +20,18 @@ from .models import Follow  # isort:skip
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(DeadlineMixin, SparseFieldsViewMixin, UserViewSet):
     """Вьюсет для работы с пользователем."""
 
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = CustomPageNumberPagination
+    deadlines = {
+        'list': 0.3,
+        'retrieve': 0.3,
+        'me': 0.3,
+    }
 
     @action(
         detail=False,
@@ -33,8 +41,10 @@ class CustomUserViewSet(UserViewSet):
     def me(self, request):
         """Запрос информации пользователя о себе."""
 
-        context = {'request': request}
-        serializer = CustomUserSerializer(request.user, context=context)
+        serializer = CustomUserSerializer(
+            request.user,
+            context=self.get_serializer_context()
+        )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -90,12 +100,17 @@ class FollowViewSet(APIView):
         )
 
 
-class FollowListView(ListAPIView):
+class FollowListView(DeadlineMixin, SparseFieldsViewMixin, ListAPIView):
     """Класс для просмотра подписок."""
 
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPageNumberPagination
+    deadlines = {'get': 0.3}
 
     def get_queryset(self):
-        return User.objects.filter(following__user=self.request.user)
+        queryset = User.objects.filter(following__user=self.request.user)
+        selection = self.get_field_selection()
+        if wants(selection, 'recipes_count'):
+            queryset = queryset.annotate(recipes_total=Count('recipes'))
+        return queryset